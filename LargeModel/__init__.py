@@ -0,0 +1,16 @@
+"""
+Large model backends, one module per provider. Each module has:
+- available() -> bool, whether it is configured;
+- async complete(messages, *, model=None, max_tokens=None) -> str.
+"""
+import importlib
+from types import ModuleType
+
+from app.core.config import settings
+
+
+def load(name: str | None = None) -> ModuleType:
+  """
+  Return the large model module, DEFAULT_LARGE_MODEL when no name is given.
+  """
+  return importlib.import_module(f"LargeModel.{name or settings.DEFAULT_LARGE_MODEL}")
@@ -0,0 +1,44 @@
+"""
+OpenAI chat models.
+"""
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.core.metrics import LLM_TOKENS
+
+_client: AsyncOpenAI | None = None
+
+
+def available() -> bool:
+  """
+  Check if the model can be called, i.e. an API key is configured.
+  """
+  return bool(settings.OPENAI_API_KEY)
+
+
+def _get_client() -> AsyncOpenAI:
+  global _client  # pylint: disable=global-statement
+  if _client is None:
+    # One client per worker, it keeps the HTTP connections alive
+    _client = AsyncOpenAI(
+      api_key=settings.OPENAI_API_KEY, timeout=settings.OPENAI_TIMEOUT_SECONDS
+    )
+  return _client
+
+
+async def complete(
+  messages: list[dict[str, str]], *, model: str | None = None, max_tokens: int | None = None
+) -> str:
+  """
+  Return the model's answer to a list of {"role", "content"} messages.
+  """
+  response = await _get_client().chat.completions.create(
+    model=model or settings.OPENAI_MODEL,
+    messages=messages,  # type: ignore[arg-type]
+    max_tokens=max_tokens,
+  )
+  if response.usage is not None:
+    # The model that answered, not the requested name, keeps the labels few
+    LLM_TOKENS.labels(response.model, "prompt").inc(response.usage.prompt_tokens)
+    LLM_TOKENS.labels(response.model, "completion").inc(response.usage.completion_tokens)
+  return response.choices[0].message.content or ""
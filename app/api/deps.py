@@ -1,16 +1,20 @@
-from collections.abc import Generator
+import uuid
+from collections.abc import AsyncGenerator, Awaitable, Callable
 from typing import Annotated
 
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core import security
 from app.core.config import settings
-from app.core.db import engine
+from app.core.db import async_session_factory
+from app.core.rate_limit import rate_limiter
+from app.core.replicas import SAFE_METHODS, replica_router, wrote_recently
+from app.core.user_cache import user_cache
 from app.models import TokenPayload, User
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -18,37 +22,80 @@ reusable_oauth2 = OAuth2PasswordBearer(
 )
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    async with async_session_factory() as session:
         yield session
+    user_id = getattr(request.state, "user_id", None)
+    if user_id and request.method not in SAFE_METHODS:
+        # Read your own writes: keep this user's reads on the primary for a while
+        replica_router.mark_write(user_id)
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+SessionDep = Annotated[AsyncSession, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
+async def get_current_user(
+    request: Request, session: SessionDep, token: TokenDep
+) -> User:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
         )
         token_data = TokenPayload(**payload)
-    except (InvalidTokenError, ValidationError):
+        user_id = uuid.UUID(token_data.sub)
+    except (InvalidTokenError, ValidationError, TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+    user = user_cache.get(session, user_id)
+    if user is None:
+        with user_cache.reading(user_id) as version:
+            user = await session.get(User, user_id)
+            if user:
+                user_cache.put(user, version)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
+    request.state.user_id = user.id
     return user
 
 
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
 
+def rate_limit(route_class: str) -> Callable[[User], Awaitable[None]]:
+    """
+    Dependency taking a token of the current user's bucket for route_class.
+    """
+
+    async def check(current_user: CurrentUser) -> None:
+        await rate_limiter.check(route_class, str(current_user.id))
+
+    return check
+
+
+async def get_read_db(
+    request: Request, current_user: CurrentUser
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only routes, on a replica when one is usable, else on
+    the primary.
+    """
+    engine = await replica_router.read_engine(
+        current_user.id, wrote_recently(request)
+    )
+    factory_kwargs = {"bind": engine} if engine is not None else {}
+    async with async_session_factory(**factory_kwargs) as read_session:
+        yield read_session
+
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_db)]
+
+
 def get_current_active_superuser(current_user: CurrentUser) -> User:
     if not current_user.is_superuser:
         raise HTTPException(
@@ -0,0 +1,76 @@
+"""
+Conditional GETs of polled routes.
+
+Routes answer with a weak ETag, and with an empty 304 when the client's
+If-None-Match already has it, so nothing is loaded nor serialized. Tags
+derive from row versions, updated_at being bumped by every update:
+- a row's tag comes from its id and updated_at. Routes only probe the
+  version before loading the row when the request is conditional, other
+  requests load the row and tag it;
+- a list's tag comes from the count and a digest of the ids and updated_at
+  of all the rows the caller can see, and the page. Any insert, update or
+  delete changes the digest, whatever the order of their commits or the
+  clocks of the workers which wrote them (a latest updated_at wouldn't
+  change for an update committed after a newer one). The probe reading
+  them replaces the list's count query, the page is only read when it
+  changed.
+"""
+import hashlib
+from typing import Any
+
+from fastapi import Request, Response
+from sqlalchemy import ColumnElement
+from sqlmodel import SQLModel, func, select
+from sqlmodel.sql.expression import SelectOfScalar
+
+
+def make_etag(*parts: Any) -> str:
+  """
+  Weak ETag identifying a version of a resource.
+  """
+  digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+  return f'W/"{digest}"'
+
+
+def list_version_statement(
+  table_model: type[SQLModel], *criteria: ColumnElement[bool]
+) -> SelectOfScalar[tuple[int, Any]]:
+  """
+  Count and version digest of the rows of table_model matching criteria.
+  """
+  table = table_model.__table__  # type: ignore[attr-defined]
+  # Sums are order independent, no sort of the rows is needed
+  digest = func.sum(
+    func.hashtextextended(func.concat(table.c.id, "|", table.c.updated_at), 0)
+  )
+  statement = select(func.count(), digest).select_from(table)
+  if criteria:
+    statement = statement.where(*criteria)
+  return statement
+
+
+def is_conditional(request: Request) -> bool:
+  """
+  Check if the request has an If-None-Match header.
+  """
+  return "if-none-match" in request.headers
+
+
+def matches(request: Request, etag: str) -> bool:
+  """
+  Check if the request's If-None-Match has etag, compared weakly.
+  """
+  header = request.headers.get("if-none-match")
+  if not header:
+    return False
+  if header.strip() == "*":
+    return True
+  opaque = etag.removeprefix("W/")
+  return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+  """
+  Empty 304 response of a resource the client already has.
+  """
+  return Response(status_code=304, headers={"ETag": etag})
@@ -1,21 +1,27 @@
 """
 This file is used to include all the routers in the APIRouter.
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
 from app.api.routes import (
-  items, login, private, users, utils, organizations, messages, chats, templates)
+  items, login, private, users, utils, organizations, messages, chats, templates, transfer,
+  completions)
+from app.api.deps import rate_limit
 from app.core.config import settings
 
 api_router = APIRouter()
 api_router.include_router(login.router)
 api_router.include_router(users.router)
 api_router.include_router(utils.router)
-api_router.include_router(items.router)
-api_router.include_router(organizations.router)
-api_router.include_router(messages.router)
-api_router.include_router(chats.router)
-api_router.include_router(templates.router)
+api_router.include_router(items.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(organizations.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(messages.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(chats.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(templates.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(transfer.router, dependencies=[Depends(rate_limit("crud"))])
+api_router.include_router(
+  completions.router, dependencies=[Depends(rate_limit("completions"))]
+)
 
 
 if settings.ENVIRONMENT == "local":
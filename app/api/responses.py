@@ -0,0 +1,59 @@
+"""
+Fast JSON responses.
+
+FastAPI validates what a route returns against its response_model again and
+serializes the result before encoding it. Routes returning a Response skip
+both steps, their response_model then only documents them:
+- list_response builds list payloads straight from selected column tuples,
+  without loading ORM objects, and encodes them with orjson;
+- model_response encodes a model already matching the public schema.
+Everything else is encoded with orjson too, ORJSONResponse being the
+application's default response class.
+"""
+from collections.abc import Sequence
+from typing import Any
+
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+from sqlalchemy import Column
+from sqlmodel import SQLModel
+
+
+def public_columns(public_model: type[SQLModel], table_model: type[SQLModel]) -> list[Column]:
+  """
+  Columns of a table backing the fields of its public model, to select.
+  """
+  table = table_model.__table__  # type: ignore[attr-defined]
+  return [table.c[name] for name in public_model.model_fields if name in table.c]
+
+
+def public_rows(
+  public_model: type[SQLModel], columns: Sequence[Column], rows: Sequence[Any]
+) -> list[dict[str, Any]]:
+  """
+  Turn selected column tuples into public model dicts, fields without a
+  column get their default.
+  """
+  keys = [column.key for column in columns]
+  defaults = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in public_model.model_fields.items()
+    if name not in keys
+  }
+  return [{**defaults, **dict(zip(keys, row))} for row in rows]
+
+
+def list_response(
+  public_model: type[SQLModel], columns: Sequence[Column], rows: Sequence[Any], count: int
+) -> ORJSONResponse:
+  """
+  Response of a list route: {"data": [...], "count": count}.
+  """
+  return ORJSONResponse({"data": public_rows(public_model, columns, rows), "count": count})
+
+
+def model_response(model: BaseModel) -> Response:
+  """
+  Response of a model which already is the public schema.
+  """
+  return Response(model.model_dump_json(), media_type="application/json")
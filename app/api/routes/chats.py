@@ -1,63 +1,200 @@
 """
 
 """
+import base64
+import binascii
 import uuid
-from typing import Any
+from datetime import datetime
+from typing import Annotated, Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Chat, ChatCreate, ChatPublic, ChatsPublic, ChatUpdate, Message
+from app import crud, message_body
+from app.api import etags, responses
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep
+from app.conversation import conversation_cache, publish_changes
+from app.core.replicas import open_read_session, wrote_recently
+from app.models import (
+  Chat, ChatCreate, ChatDetailPublic, ChatMessagesPublic, ChatPublic, ChatsPublic, ChatUpdate,
+  Message,
+)
+from app.ndjson import NDJSON_MEDIA_TYPE, encode_models, wants_ndjson
 
 router = APIRouter(prefix="/chats", tags=["chats"])
 
+# Selected by the list route, which builds its payload from the rows
+CHAT_COLUMNS = responses.public_columns(ChatPublic, Chat)
+
+
+def _encode_cursor(message: Any) -> str:
+  key = f"{message.created_at.isoformat()}|{message.id}"
+  return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> crud.MessageKey:
+  try:
+    key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, message_id = key.split("|")
+    return datetime.fromisoformat(created_at), uuid.UUID(message_id)
+  except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+    raise HTTPException(status_code=422, detail="Invalid cursor") from e
+
 
 @router.get("/", response_model=ChatsPublic)
-def read_chats(
-  session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_chats(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  request: Request,
+  skip: int = 0,
+  limit: int = 100,
 ) -> Any:
   """
   Retrieve chats.
   """
   if current_user.is_superuser:
-    count_statement = select(func.count()).select_from(Chat)
-    count = session.exec(count_statement).one()
-    statement = select(Chat).offset(skip).limit(limit)
-    chats = session.exec(statement).all()
+    version_statement = etags.list_version_statement(Chat)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("chats", None, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
+    statement = select(*CHAT_COLUMNS).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
   else:
-    count_statement = (
-      select(func.count())
-      .select_from(Chat)
-      .where(Chat.owner_id == current_user.id)
-    )
-    count = session.exec(count_statement).one()
+    version_statement = etags.list_version_statement(Chat, Chat.owner_id == current_user.id)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("chats", current_user.id, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
     statement = (
-      select(Chat)
+      select(*CHAT_COLUMNS)
       .where(Chat.owner_id == current_user.id)
       .offset(skip)
       .limit(limit)
     )
-    chats = session.exec(statement).all()
+    rows = (await session.exec(statement)).all()
 
-  return ChatsPublic(data=chats, count=count)
+  response = responses.list_response(ChatPublic, CHAT_COLUMNS, rows, count)
+  response.headers["ETag"] = etag
+  return response
 
 
-@router.get("/{id}", response_model=ChatPublic)
-def read_chat(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+@router.get("/{id}", response_model=ChatDetailPublic)
+async def read_chat(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  id: uuid.UUID,
+  request: Request,
+  response: Response,
+) -> Any:
   """
   Get chat by ID.
   """
-  chat = session.get(Chat, id)
+  if etags.is_conditional(request):
+    version_statement = select(Chat.owner_id, Chat.updated_at).where(Chat.id == id)
+    version = (await session.exec(version_statement)).first()
+    if version and (current_user.is_superuser or version[0] == current_user.id):
+      etag = etags.make_etag("chat", id, version[1])
+      if etags.matches(request, etag):
+        return etags.not_modified(etag)
+  chat = await session.get(Chat, id)
   if not chat:
     raise HTTPException(status_code=404, detail="Chat not found")
   if not current_user.is_superuser and (chat.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
+  response.headers["ETag"] = etags.make_etag("chat", id, chat.updated_at)
   return chat
 
 
+@router.get(
+  "/{id}/messages",
+  response_model=ChatMessagesPublic,
+  responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def read_chat_messages(
+  request: Request,
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  id: uuid.UUID,
+  after: datetime | None = None,
+  before: datetime | None = None,
+  cursor: str | None = None,
+  tail: Annotated[int | None, Query(ge=1, le=1000)] = None,
+  limit: Annotated[int | None, Query(ge=1)] = None,
+  accept: Annotated[str | None, Header()] = None,
+) -> Any:
+  """
+  Get a chat's messages, oldest first.
+
+  Returns the messages created between after and before, or with tail the
+  newest tail messages (before before, if given), e.g. to build prompt
+  context. Send Accept: application/x-ndjson to stream the whole range
+  instead of getting a page of at most limit (default 100, max 1000) messages.
+  Messages come with their full content.
+
+  Pages come with next_cursor when there are more: pass it as cursor, with
+  the same parameters, to get the newer messages (the older ones with tail).
+  """
+  chat = await session.get(Chat, id)
+  if not chat:
+    raise HTTPException(status_code=404, detail="Chat not found")
+  if not current_user.is_superuser and (chat.owner_id != current_user.id):
+    raise HTTPException(status_code=400, detail="Not enough permissions")
+
+  start: datetime | crud.MessageKey | None = after
+  end: datetime | crud.MessageKey | None = before
+  if cursor is not None:
+    if tail is None:
+      start = _decode_cursor(cursor)
+    else:
+      end = _decode_cursor(cursor)
+
+  if wants_ndjson(accept) and tail is None:
+    statement = crud.chat_messages_statement(
+      chat_id=id, after=start, before=end, limit=limit
+    )
+    user_id = current_user.id
+    recent_write = wrote_recently(request)
+
+    async def stream_messages():
+      # The request session is closed once the response starts, use our own
+      async with open_read_session(user_id, recent_write) as stream_session:
+        messages = await stream_session.stream_scalars(
+          statement.execution_options(yield_per=500)
+        )
+        # Load the bodies of each fetched batch with one query
+        async for batch in messages.partitions():
+          for message in await message_body.with_full_content(stream_session, batch):
+            yield message
+
+    return StreamingResponse(encode_models(stream_messages()), media_type=NDJSON_MEDIA_TYPE)
+
+  messages, has_more = await crud.get_chat_messages_async(
+    session=session,
+    chat_id=id,
+    after=start,
+    before=end,
+    tail=tail,
+    limit=min(limit or 100, 1000),
+  )
+  next_cursor = None
+  if has_more and messages:
+    next_cursor = _encode_cursor(messages[0] if tail is not None else messages[-1])
+  messages = await message_body.with_full_content(session, messages)
+  if wants_ndjson(accept):
+    async def tail_messages():
+      for message in messages:
+        yield message
+
+    return StreamingResponse(encode_models(tail_messages()), media_type=NDJSON_MEDIA_TYPE)
+  return responses.model_response(
+    ChatMessagesPublic(data=messages, has_more=has_more, next_cursor=next_cursor)
+  )
+
+
 @router.post("/", response_model=ChatPublic)
-def create_chat(
+async def create_chat(
   *, session: SessionDep, current_user: CurrentUser, chat_in: ChatCreate
 ) -> Any:
   """
@@ -65,13 +202,13 @@ def create_chat(
   """
   chat = Chat.model_validate(chat_in, update={"owner_id": current_user.id})
   session.add(chat)
-  session.commit()
-  session.refresh(chat)
+  await session.commit()
+  await session.refresh(chat)
   return chat
 
 
 @router.put("/{id}", response_model=ChatPublic)
-def update_chat(
+async def update_chat(
   *,
   session: SessionDep,
   current_user: CurrentUser,
@@ -81,7 +218,7 @@ def update_chat(
   """
   Update an chat.
   """
-  chat = session.get(Chat, id)
+  chat = await session.get(Chat, id)
   if not chat:
     raise HTTPException(status_code=404, detail="Chat not found")
   if not current_user.is_superuser and (chat.owner_id != current_user.id):
@@ -89,23 +226,25 @@ def update_chat(
   update_dict = chat_in.model_dump(exclude_unset=True)
   chat.sqlmodel_update(update_dict)
   session.add(chat)
-  session.commit()
-  session.refresh(chat)
+  await session.commit()
+  await session.refresh(chat)
   return chat
 
 
 @router.delete("/{id}")
-def delete_chat(
+async def delete_chat(
   session: SessionDep, current_user: CurrentUser, id: uuid.UUID
 ) -> Message:
   """
   Delete an chat.
   """
-  chat = session.get(Chat, id)
+  chat = await session.get(Chat, id)
   if not chat:
     raise HTTPException(status_code=404, detail="Chat not found")
   if not current_user.is_superuser and (chat.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  session.delete(chat)
-  session.commit()
+  await session.delete(chat)
+  await publish_changes(session, [chat.id])
+  await session.commit()
+  conversation_cache.invalidate([chat.id])
   return Message(message="Chat deleted successfully")
@@ -0,0 +1,41 @@
+"""
+Completion routes.
+"""
+import time
+from typing import Any
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy.orm import joinedload
+
+import LargeModel
+from app import completions
+from app.api.deps import CurrentUser, SessionDep
+from app.core.metrics import COMPLETION_STAGE_SECONDS
+from app.models import Chat, CompletionInput, MessagePublic
+
+router = APIRouter(prefix="/completions", tags=["completions"])
+
+
+@router.post("/", response_model=MessagePublic)
+async def create_completion(
+  *, session: SessionDep, current_user: CurrentUser, completion_in: CompletionInput
+) -> Any:
+  """
+  Answer a question in a chat, the question and the answer are added to it.
+  """
+  start = time.perf_counter()
+  with COMPLETION_STAGE_SECONDS.labels("lookup").time():
+    chat = await session.get(
+      Chat, completion_in.chat_id, options=[joinedload(Chat.template)]
+    )
+  if not chat:
+    raise HTTPException(status_code=404, detail="Chat not found")
+  if not current_user.is_superuser and (chat.owner_id != current_user.id):
+    raise HTTPException(status_code=400, detail="Not enough permissions")
+  if not LargeModel.load().available():
+    raise HTTPException(status_code=503, detail="No large model configured")
+  if not chat.template:
+    raise HTTPException(status_code=404, detail="Template not found")
+  answer = await completions.chat_completions(session, chat, chat.template, completion_in)
+  COMPLETION_STAGE_SECONDS.labels("total").observe(time.perf_counter() - start)
+  return answer
@@ -4,59 +4,86 @@ Items routes
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, HTTPException, Request, Response
+from sqlmodel import select
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Item, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate, Message
+from app import bulk
+from app.api import etags, responses
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep
+from app.models import BulkResult, Item, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate, Message
 
 router = APIRouter(prefix="/items", tags=["items"])
 
+# Selected by the list route, which builds its payload from the rows
+ITEM_COLUMNS = responses.public_columns(ItemPublic, Item)
+
 
 @router.get("/", response_model=ItemsPublic)
-def read_items(
-  session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_items(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  request: Request,
+  skip: int = 0,
+  limit: int = 100,
 ) -> Any:
   """
   Retrieve items.
   """
   if current_user.is_superuser:
-    count_statement = select(func.count()).select_from(Item)
-    count = session.exec(count_statement).one()
-    statement = select(Item).offset(skip).limit(limit)
-    items = session.exec(statement).all()
+    version_statement = etags.list_version_statement(Item)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("items", None, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
+    statement = select(*ITEM_COLUMNS).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
   else:
-    count_statement = (
-      select(func.count())
-      .select_from(Item)
-      .where(Item.owner_id == current_user.id)
-    )
-    count = session.exec(count_statement).one()
+    version_statement = etags.list_version_statement(Item, Item.owner_id == current_user.id)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("items", current_user.id, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
     statement = (
-      select(Item)
+      select(*ITEM_COLUMNS)
       .where(Item.owner_id == current_user.id)
       .offset(skip)
       .limit(limit)
     )
-    items = session.exec(statement).all()
-  return ItemsPublic(data=items, count=count)
+    rows = (await session.exec(statement)).all()
+  response = responses.list_response(ItemPublic, ITEM_COLUMNS, rows, count)
+  response.headers["ETag"] = etag
+  return response
 
 
 @router.get("/{id}", response_model=ItemPublic)
-def read_item(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+async def read_item(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  id: uuid.UUID,
+  request: Request,
+  response: Response,
+) -> Any:
   """
   Get item by ID.
   """
-  item = session.get(Item, id)
+  if etags.is_conditional(request):
+    version_statement = select(Item.owner_id, Item.updated_at).where(Item.id == id)
+    version = (await session.exec(version_statement)).first()
+    if version and (current_user.is_superuser or version[0] == current_user.id):
+      etag = etags.make_etag("item", id, version[1])
+      if etags.matches(request, etag):
+        return etags.not_modified(etag)
+  item = await session.get(Item, id)
   if not item:
     raise HTTPException(status_code=404, detail="Item not found")
   if not current_user.is_superuser and (item.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
+  response.headers["ETag"] = etags.make_etag("item", id, item.updated_at)
   return item
 
 
 @router.post("/", response_model=ItemPublic)
-def create_item(
+async def create_item(
   *, session: SessionDep, current_user: CurrentUser, item_in: ItemCreate
 ) -> Any:
   """
@@ -64,13 +91,82 @@ def create_item(
   """
   item = Item.model_validate(item_in, update={"owner_id": current_user.id})
   session.add(item)
-  session.commit()
-  session.refresh(item)
+  await session.commit()
+  await session.refresh(item)
   return item
 
 
+@router.post(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.schema_ref(ItemCreate)),
+)
+async def create_items_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Create many items in one transaction.
+
+  The body is a JSON array, or NDJSON with Content-Type: application/x-ndjson.
+  Invalid rows are skipped and reported in errors, with atomic=true they
+  reject the whole request instead.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_rows(rows, ItemCreate)
+  bulk.check_atomic(errors, atomic)
+  ids = await bulk.insert_rows(session, Item, [
+    Item.model_validate(item_in, update={"owner_id": current_user.id}).model_dump()
+    for _, item_in in valid
+  ])
+  await session.commit()
+  return bulk.bulk_result(ids, errors)
+
+
+@router.patch(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.update_schema(ItemUpdate)),
+)
+async def update_items_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Update many items in one transaction, each row has the id of the item
+  to update and the fields to change.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_updates(rows, ItemUpdate)
+  bulk.check_atomic(errors, atomic)
+  owner_condition = None if current_user.is_superuser else Item.owner_id == current_user.id
+  ids, not_found = await bulk.update_rows(session, Item, valid, owner_condition)
+  bulk.check_atomic(not_found, atomic)
+  await session.commit()
+  return bulk.bulk_result(ids, errors + not_found)
+
+
+@router.post(
+  "/bulk/delete",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.ID_SCHEMA),
+)
+async def delete_items_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Delete many items in one transaction, the body is the list of their ids.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_ids(rows)
+  bulk.check_atomic(errors, atomic)
+  owner_condition = None if current_user.is_superuser else Item.owner_id == current_user.id
+  ids, not_found = await bulk.delete_rows(session, Item, valid, owner_condition)
+  bulk.check_atomic(not_found, atomic)
+  await session.commit()
+  return bulk.bulk_result(ids, errors + not_found)
+
+
 @router.put("/{id}", response_model=ItemPublic)
-def update_item(
+async def update_item(
   *,
   session: SessionDep,
   current_user: CurrentUser,
@@ -80,7 +176,7 @@ def update_item(
   """
   Update an item.
   """
-  item = session.get(Item, id)
+  item = await session.get(Item, id)
   if not item:
     raise HTTPException(status_code=404, detail="Item not found")
   if not current_user.is_superuser and (item.owner_id != current_user.id):
@@ -88,23 +184,23 @@ def update_item(
   update_dict = item_in.model_dump(exclude_unset=True)
   item.sqlmodel_update(update_dict)
   session.add(item)
-  session.commit()
-  session.refresh(item)
+  await session.commit()
+  await session.refresh(item)
   return item
 
 
 @router.delete("/{id}")
-def delete_item(
+async def delete_item(
   session: SessionDep, current_user: CurrentUser, id: uuid.UUID
 ) -> Message:
   """
   Delete an item.
   """
-  item = session.get(Item, id)
+  item = await session.get(Item, id)
   if not item:
     raise HTTPException(status_code=404, detail="Item not found")
   if not current_user.is_superuser and (item.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  session.delete(item)
-  session.commit()
+  await session.delete(item)
+  await session.commit()
   return Message(message="Item deleted successfully")
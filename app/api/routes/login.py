@@ -12,12 +12,13 @@ from app import crud
 from app.api.deps import CurrentUser, SessionDep, get_current_active_superuser
 from app.core import security
 from app.core.config import settings
-from app.core.security import get_password_hash
+from app.core.hashing import password_hasher
+from app.core.user_cache import publish_change, user_cache
 from app.models import Message, NewPassword, Token, UserPublic
+from app.outbox import email_sender, enqueue_email
 from app.utils import (
   generate_password_reset_token,
   generate_reset_password_email,
-  send_email,
   verify_password_reset_token,
 )
 
@@ -25,13 +26,13 @@ router = APIRouter(tags=["login"])
 
 
 @router.post("/login/access-token")
-def login_access_token(
+async def login_access_token(
   session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
   """
   OAuth2 compatible token login, get an access token for future requests
   """
-  user = crud.authenticate(
+  user = await crud.authenticate_async(
     session=session, email=form_data.username, password=form_data.password
   )
   if not user:
@@ -47,7 +48,7 @@ def login_access_token(
 
 
 @router.post("/login/test-token", response_model=UserPublic)
-def test_token(current_user: CurrentUser) -> Any:
+async def test_token(current_user: CurrentUser) -> Any:
   """
   Test access token
   """
@@ -55,38 +56,38 @@ def test_token(current_user: CurrentUser) -> Any:
 
 
 @router.post("/password-recovery/{email}")
-def recover_password(email: str, session: SessionDep) -> Message:
+async def recover_password(email: str, session: SessionDep) -> Message:
   """
   Password Recovery
   """
-  user = crud.get_user_by_email(session=session, email=email)
+  user = await crud.get_user_by_email_async(session=session, email=email)
 
   if not user:
     raise HTTPException(
       status_code=404,
       detail="The user with this email does not exist in the system.",
     )
-  password_reset_token = generate_password_reset_token(email=email)
-  email_data = generate_reset_password_email(
-    email_to=user.email, email=email, token=password_reset_token
-  )
-  send_email(
+  # The token is made when the email is sent, it is never stored
+  enqueue_email(
+    session,
     email_to=user.email,
-    subject=email_data.subject,
-    html_content=email_data.html_content,
+    template_name="reset_password.html",
+    context={"email_to": user.email, "email": email},
   )
+  await session.commit()
+  email_sender.wake()
   return Message(message="Password recovery email sent")
 
 
 @router.post("/reset-password/")
-def reset_password(session: SessionDep, body: NewPassword) -> Message:
+async def reset_password(session: SessionDep, body: NewPassword) -> Message:
   """
   Reset password
   """
   email = verify_password_reset_token(token=body.token)
   if not email:
     raise HTTPException(status_code=400, detail="Invalid token")
-  user = crud.get_user_by_email(session=session, email=email)
+  user = await crud.get_user_by_email_async(session=session, email=email)
   if not user:
     raise HTTPException(
       status_code=404,
@@ -94,10 +95,12 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
     )
   elif not user.is_active:
     raise HTTPException(status_code=400, detail="Inactive user")
-  hashed_password = get_password_hash(password=body.new_password)
+  hashed_password = await password_hasher.hash(body.new_password)
   user.hashed_password = hashed_password
   session.add(user)
-  session.commit()
+  await publish_change(session, user.id)
+  await session.commit()
+  user_cache.invalidate(user.id)
   return Message(message="Password updated successfully")
 
 
@@ -106,11 +109,11 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
   dependencies=[Depends(get_current_active_superuser)],
   response_class=HTMLResponse,
 )
-def recover_password_html_content(email: str, session: SessionDep) -> Any:
+async def recover_password_html_content(email: str, session: SessionDep) -> Any:
   """
   HTML Content for Password Recovery
   """
-  user = crud.get_user_by_email(session=session, email=email)
+  user = await crud.get_user_by_email_async(session=session, email=email)
 
   if not user:
     raise HTTPException(
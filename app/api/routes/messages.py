@@ -1,77 +1,238 @@
 """
-
+Message routes.
 """
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy.orm import joinedload
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Message, MessageCreate, MessagePublic, MessagesPublic, MessageUpdate, Message
+from app import bulk, message_body
+from app.api import responses
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep
+from app.conversation import conversation_cache, publish_changes
+from app.models import (
+  BulkResult, Chat, Message, MessageBody, MessageCreate, MessagePublic, MessagesPublic,
+  MessageUpdate, User,
+)
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
+# Selected by the list route, which builds its payload from the rows
+MESSAGE_COLUMNS = responses.public_columns(MessagePublic, Message)
+
+
+def _owner_condition(current_user: User) -> Any:
+  # Messages are owned through their chat
+  if current_user.is_superuser:
+    return None
+  return col(Message.chat_id).in_(select(Chat.id).where(Chat.owner_id == current_user.id))
+
+
+async def _owns_chat(session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID) -> bool:
+  owner_id = (await session.exec(select(Chat.owner_id).where(Chat.id == chat_id))).first()
+  return owner_id == user_id
+
+
+async def _get_message(session: AsyncSession, id: uuid.UUID) -> Message | None:
+  # With its chat, whose owner is checked
+  return await session.get(Message, id, options=[joinedload(Message.chat)])
+
+
+def _owns_message(message: Message, current_user: User) -> bool:
+  return current_user.is_superuser or (
+    message.chat is not None and message.chat.owner_id == current_user.id
+  )
+
+
+async def _chat_ids(session: AsyncSession, ids: list[uuid.UUID]) -> set[uuid.UUID]:
+  # Chats of messages about to change, to invalidate their conversation windows
+  if not ids:
+    return set()
+  statement = select(Message.chat_id).where(col(Message.id).in_(ids)).distinct()
+  return set((await session.exec(statement)).all())
+
 
 @router.get("/", response_model=MessagesPublic)
-def read_messages(
-  session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_messages(
+  session: ReadSessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
 ) -> Any:
   """
   Retrieve messages.
   """
   if current_user.is_superuser:
     count_statement = select(func.count()).select_from(Message)
-    count = session.exec(count_statement).one()
-    statement = select(Message).offset(skip).limit(limit)
-    messages = session.exec(statement).all()
+    count = (await session.exec(count_statement)).one()
+    statement = select(*MESSAGE_COLUMNS).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
   else:
+    # Messages are owned through their chat
     count_statement = (
       select(func.count())
       .select_from(Message)
-      .where(Message.owner_id == current_user.id)
+      .join(Chat)
+      .where(Chat.owner_id == current_user.id)
     )
-    count = session.exec(count_statement).one()
+    count = (await session.exec(count_statement)).one()
     statement = (
-      select(Message)
-      .where(Message.owner_id == current_user.id)
+      select(*MESSAGE_COLUMNS)
+      .join(Chat)
+      .where(Chat.owner_id == current_user.id)
       .offset(skip)
       .limit(limit)
     )
-    messages = session.exec(statement).all()
+    rows = (await session.exec(statement)).all()
 
-  return MessagesPublic(data=messages, count=count)
+  return responses.list_response(MessagePublic, MESSAGE_COLUMNS, rows, count)
 
 
 @router.get("/{id}", response_model=MessagePublic)
-def read_message(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+async def read_message(session: ReadSessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
   """
-  Get message by ID.
+  Get message by ID, with its full content.
   """
-  message = session.get(Message, id)
+  message = await _get_message(session, id)
   if not message:
     raise HTTPException(status_code=404, detail="Message not found")
-  if not current_user.is_superuser and (message.owner_id != current_user.id):
+  if not _owns_message(message, current_user):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  return message
+  return (await message_body.with_full_content(session, [message]))[0]
 
 
 @router.post("/", response_model=MessagePublic)
-def create_message(
+async def create_message(
   *, session: SessionDep, current_user: CurrentUser, message_in: MessageCreate
 ) -> Any:
   """
   Create new message.
   """
-  message = Message.model_validate(message_in, update={"owner_id": current_user.id})
+  if not current_user.is_superuser and not await _owns_chat(
+    session, message_in.chat_id, current_user.id
+  ):
+    raise HTTPException(status_code=400, detail="Not enough permissions")
+  message, body = message_body.new_message(message_in)
   session.add(message)
-  session.commit()
-  session.refresh(message)
-  return message
+  if body is not None:
+    session.add(body)
+  await publish_changes(session, [message.chat_id])
+  await session.commit()
+  await session.refresh(message)
+  message_public = MessagePublic.model_validate(
+    message, update={"content": message_in.content, "truncated": False}
+  )
+  conversation_cache.append(message_public)
+  return message_public
+
+
+@router.post(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.schema_ref(MessageCreate)),
+)
+async def create_messages_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Create many messages in one transaction, e.g. to import a chat archive.
+
+  The body is a JSON array, or NDJSON with Content-Type: application/x-ndjson.
+  Invalid rows are skipped and reported in errors, with atomic=true they
+  reject the whole request instead.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_rows(rows, MessageCreate)
+  chat_ids = {message_in.chat_id for _, message_in in valid}
+  statement = select(Chat.id).where(col(Chat.id).in_(chat_ids))
+  if not current_user.is_superuser:
+    statement = statement.where(Chat.owner_id == current_user.id)
+  allowed_chats = set((await session.exec(statement)).all()) if chat_ids else set()
+  errors += [
+    bulk.row_error(index, "Chat not found")
+    for index, message_in in valid
+    if message_in.chat_id not in allowed_chats
+  ]
+  bulk.check_atomic(errors, atomic)
+  rows = []
+  body_rows = []
+  for _, message_in in valid:
+    if message_in.chat_id in allowed_chats:
+      message, body = message_body.new_message(message_in)
+      rows.append(message.model_dump())
+      if body is not None:
+        body_rows.append(body.model_dump())
+  ids = await bulk.insert_rows(session, Message, rows)
+  if body_rows:
+    await bulk.insert_rows(session, MessageBody, body_rows, id_column="message_id")
+  await publish_changes(session, allowed_chats)
+  await session.commit()
+  conversation_cache.invalidate(allowed_chats)
+  return bulk.bulk_result(ids, errors)
+
+
+@router.patch(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.update_schema(MessageUpdate)),
+)
+async def update_messages_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Update many messages in one transaction, each row has the id of the
+  message to update and the fields to change.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_updates(rows, MessageUpdate)
+  bulk.check_atomic(errors, atomic)
+  # New contents become a preview in the row and, when long, a new body
+  bodies: dict[uuid.UUID, message_body.EncodedBody | None] = {}
+  for _, row_id, changes in valid:
+    if changes.get("content") is not None:
+      fields, bodies[row_id] = message_body.split_content(changes["content"])
+      changes.update(fields)
+  chat_ids = await _chat_ids(session, [row_id for _, row_id, _ in valid])
+  ids, not_found = await bulk.update_rows(
+    session, Message, valid, _owner_condition(current_user)
+  )
+  bulk.check_atomic(not_found, atomic)
+  await message_body.replace_bodies(
+    session, {row_id: body for row_id, body in bodies.items() if row_id in ids}
+  )
+  await publish_changes(session, chat_ids)
+  await session.commit()
+  conversation_cache.invalidate(chat_ids)
+  return bulk.bulk_result(ids, errors + not_found)
+
+
+@router.post(
+  "/bulk/delete",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.ID_SCHEMA),
+)
+async def delete_messages_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Delete many messages in one transaction, the body is the list of their ids.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_ids(rows)
+  bulk.check_atomic(errors, atomic)
+  chat_ids = await _chat_ids(session, [row_id for _, row_id in valid])
+  ids, not_found = await bulk.delete_rows(
+    session, Message, valid, _owner_condition(current_user)
+  )
+  bulk.check_atomic(not_found, atomic)
+  await publish_changes(session, chat_ids)
+  await session.commit()
+  conversation_cache.invalidate(chat_ids)
+  return bulk.bulk_result(ids, errors + not_found)
 
 
 @router.put("/{id}", response_model=MessagePublic)
-def update_message(
+async def update_message(
   *,
   session: SessionDep,
   current_user: CurrentUser,
@@ -81,31 +242,38 @@ def update_message(
   """
   Update an message.
   """
-  message = session.get(Message, id)
+  message = await _get_message(session, id)
   if not message:
     raise HTTPException(status_code=404, detail="Message not found")
-  if not current_user.is_superuser and (message.owner_id != current_user.id):
+  if not _owns_message(message, current_user):
     raise HTTPException(status_code=400, detail="Not enough permissions")
   update_dict = message_in.model_dump(exclude_unset=True)
+  content = update_dict.pop("content", None)
   message.sqlmodel_update(update_dict)
+  if content is not None:
+    await message_body.set_content(session, message, content)
   session.add(message)
-  session.commit()
-  session.refresh(message)
-  return message
+  await publish_changes(session, [message.chat_id])
+  await session.commit()
+  conversation_cache.invalidate([message.chat_id])
+  await session.refresh(message)
+  return (await message_body.with_full_content(session, [message]))[0]
 
 
 @router.delete("/{id}")
-def delete_message(
+async def delete_message(
   session: SessionDep, current_user: CurrentUser, id: uuid.UUID
 ) -> Message:
   """
   Delete an message.
   """
-  message = session.get(Message, id)
+  message = await _get_message(session, id)
   if not message:
     raise HTTPException(status_code=404, detail="Message not found")
-  if not current_user.is_superuser and (message.owner_id != current_user.id):
+  if not _owns_message(message, current_user):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  session.delete(message)
-  session.commit()
+  await session.delete(message)
+  await publish_changes(session, [message.chat_id])
+  await session.commit()
+  conversation_cache.invalidate([message.chat_id])
   return Message(message="Message deleted successfully")
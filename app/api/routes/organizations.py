@@ -4,10 +4,11 @@ Organization routes.
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, HTTPException, Request, Response
+from sqlmodel import select
 
-from app.api.deps import CurrentUser, SessionDep
+from app.api import etags, responses
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep
 from app.models import (
   Organization, OrganizationCreate, OrganizationPublic, OrganizationsPublic, OrganizationUpdate,
   Message
@@ -15,52 +16,81 @@ from app.models import (
 
 router = APIRouter(prefix="/organizations", tags=["organizations"])
 
+# Selected by the list route, which builds its payload from the rows
+ORGANIZATION_COLUMNS = responses.public_columns(OrganizationPublic, Organization)
+
 
 @router.get("/", response_model=OrganizationsPublic)
-def read_organizations(
-  session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_organizations(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  request: Request,
+  skip: int = 0,
+  limit: int = 100,
 ) -> Any:
   """
   Retrieve organizations.
   """
   if current_user.is_superuser:
-    count_statement = select(func.count()).select_from(Organization)
-    count = session.exec(count_statement).one()
-    statement = select(Organization).offset(skip).limit(limit)
-    organizations = session.exec(statement).all()
+    version_statement = etags.list_version_statement(Organization)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("organizations", None, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
+    statement = select(*ORGANIZATION_COLUMNS).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
   else:
-    count_statement = (
-      select(func.count())
-      .select_from(Organization)
-      .where(Organization.owner_id == current_user.id)
+    version_statement = etags.list_version_statement(
+      Organization, Organization.owner_id == current_user.id
     )
-    count = session.exec(count_statement).one()
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("organizations", current_user.id, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
     statement = (
-      select(Organization)
+      select(*ORGANIZATION_COLUMNS)
       .where(Organization.owner_id == current_user.id)
       .offset(skip)
       .limit(limit)
     )
-    organizations = session.exec(statement).all()
+    rows = (await session.exec(statement)).all()
 
-  return OrganizationsPublic(data=organizations, count=count)
+  response = responses.list_response(OrganizationPublic, ORGANIZATION_COLUMNS, rows, count)
+  response.headers["ETag"] = etag
+  return response
 
 
 @router.get("/{id}", response_model=OrganizationPublic)
-def read_organization(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+async def read_organization(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  id: uuid.UUID,
+  request: Request,
+  response: Response,
+) -> Any:
   """
   Get organization by ID.
   """
-  organization = session.get(Organization, id)
+  if etags.is_conditional(request):
+    version_statement = (
+      select(Organization.owner_id, Organization.updated_at).where(Organization.id == id)
+    )
+    version = (await session.exec(version_statement)).first()
+    if version and (current_user.is_superuser or version[0] == current_user.id):
+      etag = etags.make_etag("organization", id, version[1])
+      if etags.matches(request, etag):
+        return etags.not_modified(etag)
+  organization = await session.get(Organization, id)
   if not organization:
     raise HTTPException(status_code=404, detail="Organization not found")
   if not current_user.is_superuser and (organization.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
+  response.headers["ETag"] = etags.make_etag("organization", id, organization.updated_at)
   return organization
 
 
 @router.post("/", response_model=OrganizationPublic)
-def create_organization(
+async def create_organization(
   *, session: SessionDep, current_user: CurrentUser, organization_in: OrganizationCreate
 ) -> Any:
   """
@@ -68,13 +98,13 @@ def create_organization(
   """
   organization = Organization.model_validate(organization_in, update={"owner_id": current_user.id})
   session.add(organization)
-  session.commit()
-  session.refresh(organization)
+  await session.commit()
+  await session.refresh(organization)
   return organization
 
 
 @router.put("/{id}", response_model=OrganizationPublic)
-def update_organization(
+async def update_organization(
   *,
   session: SessionDep,
   current_user: CurrentUser,
@@ -84,7 +114,7 @@ def update_organization(
   """
   Update an organization.
   """
-  organization = session.get(Organization, id)
+  organization = await session.get(Organization, id)
   if not organization:
     raise HTTPException(status_code=404, detail="Organization not found")
   if not current_user.is_superuser and (organization.owner_id != current_user.id):
@@ -92,23 +122,23 @@ def update_organization(
   update_dict = organization_in.model_dump(exclude_unset=True)
   organization.sqlmodel_update(update_dict)
   session.add(organization)
-  session.commit()
-  session.refresh(organization)
+  await session.commit()
+  await session.refresh(organization)
   return organization
 
 
 @router.delete("/{id}")
-def delete_organization(
+async def delete_organization(
   session: SessionDep, current_user: CurrentUser, id: uuid.UUID
 ) -> Message:
   """
   Delete an organization.
   """
-  organization = session.get(Organization, id)
+  organization = await session.get(Organization, id)
   if not organization:
     raise HTTPException(status_code=404, detail="Organization not found")
   if not current_user.is_superuser and (organization.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  session.delete(organization)
-  session.commit()
+  await session.delete(organization)
+  await session.commit()
   return Message(message="Organization deleted successfully")
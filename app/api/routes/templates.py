@@ -4,60 +4,91 @@ Template routes.
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, HTTPException, Request, Response
+from sqlmodel import select
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Template, TemplateCreate, TemplatePublic, TemplatesPublic, TemplateUpdate, Message
+from app import bulk
+from app.api import etags, responses
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep
+from app.models import (
+  BulkResult, Template, TemplateCreate, TemplatePublic, TemplatesPublic, TemplateUpdate, Message
+)
 
 router = APIRouter(prefix="/templates", tags=["templates"])
 
+# Selected by the list route, which builds its payload from the rows
+TEMPLATE_COLUMNS = responses.public_columns(TemplatePublic, Template)
+
 
 @router.get("/", response_model=TemplatesPublic)
-def read_templates(
-  session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_templates(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  request: Request,
+  skip: int = 0,
+  limit: int = 100,
 ) -> Any:
   """
   Retrieve templates.
   """
   if current_user.is_superuser:
-    count_statement = select(func.count()).select_from(Template)
-    count = session.exec(count_statement).one()
-    statement = select(Template).offset(skip).limit(limit)
-    templates = session.exec(statement).all()
+    version_statement = etags.list_version_statement(Template)
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("templates", None, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
+    statement = select(*TEMPLATE_COLUMNS).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
   else:
-    count_statement = (
-      select(func.count())
-      .select_from(Template)
-      .where(Template.owner_id == current_user.id)
+    version_statement = etags.list_version_statement(
+      Template, Template.owner_id == current_user.id
     )
-    count = session.exec(count_statement).one()
+    count, digest = (await session.exec(version_statement)).one()
+    etag = etags.make_etag("templates", current_user.id, skip, limit, count, digest)
+    if etags.matches(request, etag):
+      return etags.not_modified(etag)
     statement = (
-      select(Template)
+      select(*TEMPLATE_COLUMNS)
       .where(Template.owner_id == current_user.id)
       .offset(skip)
       .limit(limit)
     )
-    templates = session.exec(statement).all()
+    rows = (await session.exec(statement)).all()
 
-  return TemplatesPublic(data=templates, count=count)
+  response = responses.list_response(TemplatePublic, TEMPLATE_COLUMNS, rows, count)
+  response.headers["ETag"] = etag
+  return response
 
 
 @router.get("/{id}", response_model=TemplatePublic)
-def read_template(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+async def read_template(
+  session: ReadSessionDep,
+  current_user: CurrentUser,
+  id: uuid.UUID,
+  request: Request,
+  response: Response,
+) -> Any:
   """
   Get template by ID.
   """
-  template = session.get(Template, id)
+  if etags.is_conditional(request):
+    version_statement = select(Template.owner_id, Template.updated_at).where(Template.id == id)
+    version = (await session.exec(version_statement)).first()
+    if version and (current_user.is_superuser or version[0] == current_user.id):
+      etag = etags.make_etag("template", id, version[1])
+      if etags.matches(request, etag):
+        return etags.not_modified(etag)
+  template = await session.get(Template, id)
   if not template:
     raise HTTPException(status_code=404, detail="Template not found")
   if not current_user.is_superuser and (template.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
+  response.headers["ETag"] = etags.make_etag("template", id, template.updated_at)
   return template
 
 
 @router.post("/", response_model=TemplatePublic)
-def create_template(
+async def create_template(
   *, session: SessionDep, current_user: CurrentUser, template_in: TemplateCreate
 ) -> Any:
   """
@@ -65,13 +96,82 @@ def create_template(
   """
   template = Template.model_validate(template_in, update={"owner_id": current_user.id})
   session.add(template)
-  session.commit()
-  session.refresh(template)
+  await session.commit()
+  await session.refresh(template)
   return template
 
 
+@router.post(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.schema_ref(TemplateCreate)),
+)
+async def create_templates_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Create many templates in one transaction.
+
+  The body is a JSON array, or NDJSON with Content-Type: application/x-ndjson.
+  Invalid rows are skipped and reported in errors, with atomic=true they
+  reject the whole request instead.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_rows(rows, TemplateCreate)
+  bulk.check_atomic(errors, atomic)
+  ids = await bulk.insert_rows(session, Template, [
+    Template.model_validate(template_in, update={"owner_id": current_user.id}).model_dump()
+    for _, template_in in valid
+  ])
+  await session.commit()
+  return bulk.bulk_result(ids, errors)
+
+
+@router.patch(
+  "/bulk",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.update_schema(TemplateUpdate)),
+)
+async def update_templates_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Update many templates in one transaction, each row has the id of the template
+  to update and the fields to change.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_updates(rows, TemplateUpdate)
+  bulk.check_atomic(errors, atomic)
+  owner_condition = None if current_user.is_superuser else Template.owner_id == current_user.id
+  ids, not_found = await bulk.update_rows(session, Template, valid, owner_condition)
+  bulk.check_atomic(not_found, atomic)
+  await session.commit()
+  return bulk.bulk_result(ids, errors + not_found)
+
+
+@router.post(
+  "/bulk/delete",
+  response_model=BulkResult,
+  openapi_extra=bulk.request_body(bulk.ID_SCHEMA),
+)
+async def delete_templates_bulk(
+  request: Request, session: SessionDep, current_user: CurrentUser, atomic: bool = False
+) -> Any:
+  """
+  Delete many templates in one transaction, the body is the list of their ids.
+  """
+  rows = await bulk.read_rows(request)
+  valid, errors = bulk.validate_ids(rows)
+  bulk.check_atomic(errors, atomic)
+  owner_condition = None if current_user.is_superuser else Template.owner_id == current_user.id
+  ids, not_found = await bulk.delete_rows(session, Template, valid, owner_condition)
+  bulk.check_atomic(not_found, atomic)
+  await session.commit()
+  return bulk.bulk_result(ids, errors + not_found)
+
+
 @router.put("/{id}", response_model=TemplatePublic)
-def update_template(
+async def update_template(
   *,
   session: SessionDep,
   current_user: CurrentUser,
@@ -81,7 +181,7 @@ def update_template(
   """
   Update an template.
   """
-  template = session.get(Template, id)
+  template = await session.get(Template, id)
   if not template:
     raise HTTPException(status_code=404, detail="Template not found")
   if not current_user.is_superuser and (template.owner_id != current_user.id):
@@ -89,23 +189,23 @@ def update_template(
   update_dict = template_in.model_dump(exclude_unset=True)
   template.sqlmodel_update(update_dict)
   session.add(template)
-  session.commit()
-  session.refresh(template)
+  await session.commit()
+  await session.refresh(template)
   return template
 
 
 @router.delete("/{id}")
-def delete_template(
+async def delete_template(
   session: SessionDep, current_user: CurrentUser, id: uuid.UUID
 ) -> Message:
   """
   Delete an template.
   """
-  template = session.get(Template, id)
+  template = await session.get(Template, id)
   if not template:
     raise HTTPException(status_code=404, detail="Template not found")
   if not current_user.is_superuser and (template.owner_id != current_user.id):
     raise HTTPException(status_code=400, detail="Not enough permissions")
-  session.delete(template)
-  session.commit()
+  await session.delete(template)
+  await session.commit()
   return Message(message="Template deleted successfully")
@@ -0,0 +1,137 @@
+"""
+Export and import routes, to move a user's data between environments.
+"""
+import uuid
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+
+from app import transfer
+from app.api.deps import CurrentUser, ReadSessionDep, SessionDep, get_current_active_superuser
+from app.conversation import conversation_cache, publish_changes
+from app.core.replicas import open_read_session, wrote_recently
+from app.models import ImportResult, User
+from app.ndjson import NDJSON_MEDIA_TYPE
+
+router = APIRouter(prefix="/users", tags=["transfer"])
+
+EXPORT_RESPONSES: dict[int | str, dict[str, Any]] = {
+  200: {"content": {NDJSON_MEDIA_TYPE: {}, "application/gzip": {}}}
+}
+IMPORT_BODY = {
+  "requestBody": {
+    "required": True,
+    "content": {NDJSON_MEDIA_TYPE: {}, "application/gzip": {}},
+  }
+}
+
+
+def _export_response(owner_id: uuid.UUID, gzip: bool, recent_write: bool) -> StreamingResponse:
+  async def records():
+    # The request session is closed once the response starts, use our own
+    async with open_read_session(owner_id, recent_write) as session:
+      async for line in transfer.export_records(session, owner_id):
+        yield line
+
+  filename = f"export-{owner_id}.ndjson"
+  if gzip:
+    return StreamingResponse(
+      transfer.gzip_chunks(records()),
+      media_type="application/gzip",
+      headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'},
+    )
+  return StreamingResponse(
+    records(),
+    media_type=NDJSON_MEDIA_TYPE,
+    headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+  )
+
+
+async def _import(
+  request: Request, session: SessionDep, owner_id: uuid.UUID, new_ids: bool
+) -> ImportResult:
+  gzipped = (
+    request.headers.get("content-encoding") == "gzip"
+    or request.headers.get("content-type") == "application/gzip"
+  )
+  lines = transfer.decoded_lines(request.stream(), gzipped)
+  try:
+    counts = await transfer.import_records(session, owner_id, lines, new_ids)
+    if counts["message"]:
+      # Messages may have been added to existing chats
+      await publish_changes(session, None)
+    await session.commit()
+  except transfer.ImportTooLarge as e:
+    await session.rollback()
+    raise HTTPException(status_code=413, detail={"line": e.line, "detail": e.detail})
+  except transfer.TransferError as e:
+    await session.rollback()
+    raise HTTPException(status_code=422, detail={"line": e.line, "detail": e.detail})
+  except IntegrityError:
+    await session.rollback()
+    raise HTTPException(
+      status_code=409, detail="Some records already exist, import them with new_ids=true"
+    )
+  if counts["message"]:
+    conversation_cache.invalidate()
+  return ImportResult(**counts)
+
+
+@router.get("/me/export", response_class=StreamingResponse, responses=EXPORT_RESPONSES)
+async def export_user_me(request: Request, current_user: CurrentUser, gzip: bool = False) -> Any:
+  """
+  Export own organizations, templates, chats and messages as NDJSON.
+  """
+  return _export_response(current_user.id, gzip, wrote_recently(request))
+
+
+@router.post("/me/import", response_model=ImportResult, openapi_extra=IMPORT_BODY)
+async def import_user_me(
+  request: Request, session: SessionDep, current_user: CurrentUser, new_ids: bool = False
+) -> Any:
+  """
+  Import an export (NDJSON, optionally gzipped) into own account.
+
+  Records keep their ids, unless new_ids is set to import a copy of data
+  that already exists in this environment.
+  """
+  return await _import(request, session, current_user.id, new_ids)
+
+
+@router.get(
+  "/{user_id}/export",
+  dependencies=[Depends(get_current_active_superuser)],
+  response_class=StreamingResponse,
+  responses=EXPORT_RESPONSES,
+)
+async def export_user(
+  request: Request, session: ReadSessionDep, user_id: uuid.UUID, gzip: bool = False
+) -> Any:
+  """
+  Export a user's organizations, templates, chats and messages as NDJSON.
+  """
+  if not await session.get(User, user_id):
+    raise HTTPException(status_code=404, detail="User not found")
+  return _export_response(user_id, gzip, wrote_recently(request))
+
+
+@router.post(
+  "/{user_id}/import",
+  dependencies=[Depends(get_current_active_superuser)],
+  response_model=ImportResult,
+  openapi_extra=IMPORT_BODY,
+)
+async def import_user(
+  request: Request,
+  session: SessionDep,
+  user_id: uuid.UUID,
+  new_ids: bool = False,
+) -> Any:
+  """
+  Import an export (NDJSON, optionally gzipped) into a user's account.
+  """
+  if not await session.get(User, user_id):
+    raise HTTPException(status_code=404, detail="User not found")
+  return await _import(request, session, user_id, new_ids)
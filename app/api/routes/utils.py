@@ -1,9 +1,28 @@
-from fastapi import APIRouter, Depends
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import PlainTextResponse
 from pydantic.networks import EmailStr
 
-from app.api.deps import get_current_active_superuser
-from app.models import Message
-from app.utils import generate_test_email, send_email
+from app.api.deps import SessionDep, get_current_active_superuser
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.core.hashing import password_hasher
+from app.core.pool import pool_status
+from app.core.profiler import profile_cpu, profile_memory
+from app.core.tracing import trace_sampler
+from app.core.replicas import replica_router
+from app.health import readiness
+from app.models import (
+    DatabasePoolStatus,
+    EmailOutboxStatus,
+    Message,
+    PasswordHashingStatus,
+    ReadinessStatus,
+    TraceSampling,
+    TraceSamplingUpdate,
+)
+from app.outbox import email_sender, enqueue_email
 
 router = APIRouter(prefix="/utils", tags=["utils"])
 
@@ -13,19 +32,143 @@ router = APIRouter(prefix="/utils", tags=["utils"])
     dependencies=[Depends(get_current_active_superuser)],
     status_code=201,
 )
-def test_email(email_to: EmailStr) -> Message:
+async def test_email(session: SessionDep, email_to: EmailStr) -> Message:
     """
     Test emails.
     """
-    email_data = generate_test_email(email_to=email_to)
-    send_email(
+    enqueue_email(
+        session,
         email_to=email_to,
-        subject=email_data.subject,
-        html_content=email_data.html_content,
+        template_name="test_email.html",
+        context={"email_to": email_to},
     )
+    await session.commit()
+    email_sender.wake()
     return Message(message="Test email sent")
 
 
+@router.get(
+    "/db-pool/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=list[DatabasePoolStatus],
+)
+async def db_pool() -> list[dict]:
+    """
+    Connection pool usage of this worker.
+    """
+    engines = [async_engine, engine] + [r.engine for r in replica_router.replicas]
+    return [pool_status(e) for e in engines]
+
+
+@router.get(
+    "/password-hashing/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=PasswordHashingStatus,
+)
+async def password_hashing() -> dict:
+    """
+    Password hashing pool usage of this worker.
+    """
+    return password_hasher.stats()
+
+
+@router.get(
+    "/email-outbox/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=EmailOutboxStatus,
+)
+async def email_outbox(session: SessionDep) -> dict:
+    """
+    Emails waiting in the outbox and this worker's sender counters.
+    """
+    return await email_sender.stats(session)
+
+
+@router.get(
+    "/trace-sampling/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=TraceSampling,
+)
+async def read_trace_sampling() -> dict:
+    """
+    Trace sampling rates of this worker.
+    """
+    return trace_sampler.config()
+
+
+@router.put(
+    "/trace-sampling/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=TraceSampling,
+)
+async def update_trace_sampling(session: SessionDep, sampling_in: TraceSamplingUpdate) -> dict:
+    """
+    Change the trace sampling rates of all the workers, until they restart.
+    """
+    config = {**trace_sampler.config(), **sampling_in.model_dump(exclude_none=True)}
+    await trace_sampler.publish(session, config)
+    await session.commit()
+    trace_sampler.update(config)
+    return trace_sampler.config()
+
+
+@router.get(
+    "/profile/cpu/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_class=PlainTextResponse,
+)
+async def cpu_profile(
+    seconds: Annotated[float, Query(gt=0, le=settings.PROFILER_MAX_SECONDS)] = 10,
+) -> str:
+    """
+    Sample this worker's stacks for some seconds. Returns collapsed stacks,
+    for flamegraph.pl or speedscope.
+    """
+    return await profile_cpu(seconds, settings.PROFILER_INTERVAL_SECONDS)
+
+
+@router.get(
+    "/profile/memory/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_class=PlainTextResponse,
+)
+async def memory_profile(
+    seconds: Annotated[float, Query(gt=0, le=settings.PROFILER_MAX_SECONDS)] = 10,
+    top: Annotated[int, Query(gt=0, le=1_000)] = 50,
+) -> str:
+    """
+    Trace this worker's allocations for some seconds. Returns the source
+    lines whose allocated memory grew most.
+    """
+    return await profile_memory(seconds, top)
+
+
 @router.get("/health-check/")
 async def health_check() -> bool:
+    """
+    Liveness, kept for existing clients.
+    """
+    return True
+
+
+@router.get("/live/")
+async def live() -> bool:
+    """
+    Liveness: the worker's event loop answers.
+    """
     return True
+
+
+@router.get(
+    "/ready/",
+    response_model=ReadinessStatus,
+    responses={503: {"model": ReadinessStatus, "description": "Not ready"}},
+)
+async def ready(response: Response) -> dict:
+    """
+    Readiness: the worker can serve requests, 503 when it can't.
+    """
+    status = await readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
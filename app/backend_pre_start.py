@@ -8,7 +8,7 @@ import logging
 
 from sqlalchemy import Engine
 from sqlmodel import Session, select
-from tenacity import after_log, before_log, retry, stop_after_attempt, wait_fixed
+from tenacity import after_log, before_log, retry, stop_after_delay, wait_exponential_jitter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
@@ -18,13 +18,16 @@ from app.core.db import engine
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-MAX_TRIES = 60 * 5  # 5 minutes
-WAIT_SECONDS = 1
+MAX_SECONDS = 60 * 5  # 5 minutes
+# Retries start fast, for a database just starting, and back off up to
+# MAX_WAIT_SECONDS, with jitter so many containers don't retry in step
+FIRST_WAIT_SECONDS = 0.1
+MAX_WAIT_SECONDS = 10
 
 
 @retry(
-  stop=stop_after_attempt(MAX_TRIES),
-  wait=wait_fixed(WAIT_SECONDS),
+  stop=stop_after_delay(MAX_SECONDS),
+  wait=wait_exponential_jitter(initial=FIRST_WAIT_SECONDS, max=MAX_WAIT_SECONDS),
   before=before_log(logger, logging.INFO),
   after=after_log(logger, logging.WARN),
 )
@@ -0,0 +1,339 @@
+"""
+Bulk writes: parse an array (JSON or NDJSON) of rows, validate them one by
+one and write the valid ones in a single transaction, with multi-row
+INSERT ... RETURNING for small batches and COPY for large ones.
+"""
+import json
+import uuid
+from collections.abc import AsyncIterator, Iterable
+from typing import Any
+
+from fastapi import HTTPException, Request
+import psycopg
+from pydantic import ValidationError
+from sqlalchemy import ColumnElement, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models import BulkResult, BulkRowError
+from app.ndjson import NDJSON_MEDIA_TYPE
+
+# Rows per INSERT statement, keeps us far below the 65535 bind parameters limit
+INSERT_CHUNK_SIZE = 1000
+
+
+def request_body(items_schema: dict[str, Any]) -> dict[str, Any]:
+  """
+  OpenAPI description of a bulk request body, for the routes' openapi_extra
+  (they read the body themselves to accept NDJSON).
+  """
+  return {
+    "requestBody": {
+      "required": True,
+      "content": {
+        "application/json": {"schema": {"type": "array", "items": items_schema}},
+        NDJSON_MEDIA_TYPE: {"schema": items_schema},
+      },
+    }
+  }
+
+
+def schema_ref(model: type[SQLModel]) -> dict[str, Any]:
+  """
+  Reference to a model's OpenAPI schema.
+  """
+  return {"$ref": f"#/components/schemas/{model.__name__}"}
+
+
+def update_schema(model: type[SQLModel]) -> dict[str, Any]:
+  """
+  Schema of a bulk update row: the update model plus the row id.
+  """
+  return {
+    "allOf": [
+      schema_ref(model),
+      {
+        "type": "object",
+        "properties": {"id": {"type": "string", "format": "uuid"}},
+        "required": ["id"],
+      },
+    ]
+  }
+
+
+ID_SCHEMA = {"type": "string", "format": "uuid"}
+
+
+async def read_rows(request: Request) -> list[Any]:
+  """
+  Read the request body as a JSON array, or as NDJSON when sent with
+  Content-Type: application/x-ndjson. Bodies over BULK_MAX_BYTES and lines
+  over BULK_MAX_LINE_BYTES are rejected with a 413.
+  """
+  rows: list[Any] = []
+  if NDJSON_MEDIA_TYPE in request.headers.get("content-type", ""):
+    async for line in _lines(_body_chunks(request)):
+      if line.strip():
+        rows.append(_parse_line(line))
+        _check_size(rows)
+  else:
+    body = b"".join([chunk async for chunk in _body_chunks(request)])
+    try:
+      rows = json.loads(body)
+    except ValueError:
+      raise HTTPException(status_code=400, detail="Body must be a JSON array")
+    if not isinstance(rows, list):
+      raise HTTPException(status_code=400, detail="Body must be a JSON array")
+  _check_size(rows)
+  return rows
+
+
+def _too_large(detail: str) -> HTTPException:
+  return HTTPException(status_code=413, detail=detail)
+
+
+async def _body_chunks(request: Request) -> AsyncIterator[bytes]:
+  limit = settings.BULK_MAX_BYTES
+  length = request.headers.get("content-length", "")
+  if length.isdigit() and int(length) > limit:
+    raise _too_large(f"At most {limit} bytes per request")
+  # Counted too, the body may be chunked or its length wrong
+  total = 0
+  async for chunk in request.stream():
+    total += len(chunk)
+    if total > limit:
+      raise _too_large(f"At most {limit} bytes per request")
+    yield chunk
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+  limit = settings.BULK_MAX_LINE_BYTES
+  # Pieces of the unfinished line, only joined once it ends, so a long
+  # line isn't copied and scanned again with each chunk
+  pending: list[bytes] = []
+  pending_size = 0
+  async for chunk in chunks:
+    first, *rest = chunk.split(b"\n")
+    pending.append(first)
+    pending_size += len(first)
+    if pending_size > limit:
+      raise _too_large(f"Lines of at most {limit} bytes")
+    if not rest:
+      continue
+    yield b"".join(pending)
+    *lines, last = rest
+    for line in lines:
+      if len(line) > limit:
+        raise _too_large(f"Lines of at most {limit} bytes")
+      yield line
+    pending, pending_size = [last], len(last)
+    if pending_size > limit:
+      raise _too_large(f"Lines of at most {limit} bytes")
+  yield b"".join(pending)
+
+
+def _parse_line(line: bytes) -> Any:
+  try:
+    return json.loads(line)
+  except ValueError:
+    # Keep the row so it is reported with its index
+    return None
+
+
+def _check_size(rows: list[Any]) -> None:
+  if len(rows) > settings.BULK_MAX_ROWS:
+    raise _too_large(f"At most {settings.BULK_MAX_ROWS} rows per request")
+
+
+def row_error(index: int, error: ValidationError | str) -> BulkRowError:
+  """
+  Describe why a row was rejected.
+  """
+  if isinstance(error, ValidationError):
+    return BulkRowError(index=index, errors=json.loads(error.json(include_url=False)))
+  return BulkRowError(index=index, errors=[{"msg": error}])
+
+
+def validate_rows(
+  rows: list[Any], model: type[SQLModel]
+) -> tuple[list[tuple[int, Any]], list[BulkRowError]]:
+  """
+  Validate every row, return the (index, model) pairs of the valid ones and
+  the errors of the others.
+  """
+  valid: list[tuple[int, Any]] = []
+  errors: list[BulkRowError] = []
+  for index, row in enumerate(rows):
+    try:
+      valid.append((index, model.model_validate(row)))
+    except ValidationError as e:
+      errors.append(row_error(index, e))
+  return valid, errors
+
+
+def validate_updates(
+  rows: list[Any], model: type[SQLModel]
+) -> tuple[list[tuple[int, uuid.UUID, dict[str, Any]]], list[BulkRowError]]:
+  """
+  Validate update rows, each one an object with the id of the row to update
+  and the fields to change.
+  """
+  valid: list[tuple[int, uuid.UUID, dict[str, Any]]] = []
+  errors: list[BulkRowError] = []
+  for index, row in enumerate(rows):
+    if not isinstance(row, dict) or "id" not in row:
+      errors.append(row_error(index, "Row must be an object with an id"))
+      continue
+    fields = dict(row)
+    try:
+      row_id = uuid.UUID(str(fields.pop("id")))
+      changes = model.model_validate(fields).model_dump(exclude_unset=True)
+    except ValidationError as e:
+      errors.append(row_error(index, e))
+      continue
+    except ValueError:
+      errors.append(row_error(index, "Invalid id"))
+      continue
+    valid.append((index, row_id, changes))
+  return valid, errors
+
+
+def validate_ids(rows: list[Any]) -> tuple[list[tuple[int, uuid.UUID]], list[BulkRowError]]:
+  """
+  Validate a list of ids.
+  """
+  valid: list[tuple[int, uuid.UUID]] = []
+  errors: list[BulkRowError] = []
+  for index, row in enumerate(rows):
+    try:
+      valid.append((index, uuid.UUID(str(row))))
+    except ValueError:
+      errors.append(row_error(index, "Invalid id"))
+  return valid, errors
+
+
+def check_atomic(errors: list[BulkRowError], atomic: bool) -> None:
+  """
+  In atomic mode a single invalid row rejects the whole request.
+  """
+  if atomic and errors:
+    raise HTTPException(
+      status_code=422, detail=[error.model_dump() for error in errors]
+    )
+
+
+async def copy_rows(
+  session: AsyncSession, table_model: type[SQLModel], rows: list[dict[str, Any]]
+) -> None:
+  """
+  Write rows with COPY FROM STDIN, in the session's transaction.
+  """
+  table = table_model.__table__  # type: ignore[attr-defined]
+  columns = list(rows[0])
+  column_list = ", ".join(f'"{column}"' for column in columns)
+  statement = f'COPY "{table.name}" ({column_list}) FROM STDIN'
+  connection = await session.connection()
+  raw_connection = await connection.get_raw_connection()
+  try:
+    async with raw_connection.driver_connection.cursor() as cursor:
+      async with cursor.copy(statement) as copy:
+        for row in rows:
+          await copy.write_row([row[column] for column in columns])
+  except psycopg.errors.IntegrityError as e:
+    # Raised by the driver directly, surface it like any other statement's
+    raise IntegrityError(statement, None, e) from e
+
+
+async def insert_rows(
+  session: AsyncSession,
+  table_model: type[SQLModel],
+  rows: list[dict[str, Any]],
+  id_column: str = "id",
+) -> list[uuid.UUID]:
+  """
+  Insert rows in the session's transaction and return their ids. Large
+  batches go through COPY, the ids are generated client side anyway.
+  """
+  if not rows:
+    return []
+  if len(rows) >= settings.BULK_COPY_THRESHOLD:
+    await copy_rows(session, table_model, rows)
+    return [row[id_column] for row in rows]
+  table = table_model.__table__  # type: ignore[attr-defined]
+  ids: list[uuid.UUID] = []
+  for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+    statement = insert(table).values(rows[start:start + INSERT_CHUNK_SIZE])
+    result = await session.execute(statement.returning(table.c[id_column]))
+    ids.extend(result.scalars().all())
+  return ids
+
+
+async def owned_ids(
+  session: AsyncSession,
+  table_model: type[SQLModel],
+  ids: Iterable[uuid.UUID],
+  owner_condition: ColumnElement[bool] | None,
+) -> set[uuid.UUID]:
+  """
+  Return which of the ids exist and belong to the caller.
+  """
+  statement = select(table_model.id).where(col(table_model.id).in_(list(ids)))
+  if owner_condition is not None:
+    statement = statement.where(owner_condition)
+  return set((await session.execute(statement)).scalars().all())
+
+
+async def update_rows(
+  session: AsyncSession,
+  table_model: type[SQLModel],
+  updates: list[tuple[int, uuid.UUID, dict[str, Any]]],
+  owner_condition: ColumnElement[bool] | None,
+) -> tuple[list[uuid.UUID], list[BulkRowError]]:
+  """
+  Apply updates with an executemany UPDATE by primary key.
+  """
+  allowed = await owned_ids(
+    session, table_model, (row_id for _, row_id, _ in updates), owner_condition
+  )
+  errors = [
+    row_error(index, "Not found") for index, row_id, _ in updates if row_id not in allowed
+  ]
+  parameters = [
+    {"id": row_id, **changes}
+    for _, row_id, changes in updates
+    if row_id in allowed and changes
+  ]
+  if parameters:
+    await session.execute(update(table_model), parameters)
+  return [row_id for _, row_id, _ in updates if row_id in allowed], errors
+
+
+async def delete_rows(
+  session: AsyncSession,
+  table_model: type[SQLModel],
+  ids: list[tuple[int, uuid.UUID]],
+  owner_condition: ColumnElement[bool] | None,
+) -> tuple[list[uuid.UUID], list[BulkRowError]]:
+  """
+  Delete rows with a single DELETE ... RETURNING.
+  """
+  statement = (
+    delete(table_model)
+    .where(col(table_model.id).in_([row_id for _, row_id in ids]))
+    .returning(table_model.id)
+    .execution_options(synchronize_session=False)
+  )
+  if owner_condition is not None:
+    statement = statement.where(owner_condition)
+  deleted = set((await session.execute(statement)).scalars().all())
+  errors = [row_error(index, "Not found") for index, row_id in ids if row_id not in deleted]
+  return [row_id for _, row_id in ids if row_id in deleted], errors
+
+
+def bulk_result(ids: list[uuid.UUID], errors: list[BulkRowError]) -> BulkResult:
+  """
+  Build the response of a bulk endpoint.
+  """
+  return BulkResult(ids=ids, count=len(ids), errors=sorted(errors, key=lambda e: e.index))
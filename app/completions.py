@@ -1,27 +1,95 @@
 """
 This module contains the logic for generating completions for the user input.
+
+The prompt is built from the chat's template, its rolling summary and the
+latest messages not covered by the summary, taken from the conversation
+cache, within COMPLETION_CONTEXT_TOKENS. Its size doesn't grow with the chat.
+
+Each stage is timed in the completion_stage_seconds histogram: prompt,
+model and save here, lookup and total in the route.
 """
-import importlib
+import time
+from collections.abc import Sequence
+from datetime import datetime
+
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-# from openai import
-from app.firestore import get_document_by_id
-from app.models import CompletionsInput, Message
+import LargeModel
+from app import message_body, summaries
+from app.conversation import conversation_cache, estimate_tokens, publish_changes
+from app.core.config import settings
+from app.core.metrics import COMPLETION_STAGE_SECONDS
+from app.models import Chat, CompletionInput, MessageCreate, MessagePublic, Template
 
-def chat_completions(user_input: CompletionsInput) -> list[Message]:
+
+def build_prompt(
+  template: Template, chat: Chat, messages: Sequence[MessagePublic], query: str
+) -> list[dict[str, str]]:
   """
-  Generate completions for the user input.
+  Build the model messages for a question: instructions, summary, as many
+  recent messages as the context budget allows and the question.
   """
-  # get template from firebase by id
-  prompt_template = get_document_by_id("TEMPLATE_COLLECTION_NAME", user_input.prompt)
-  # get model from firebase by id
-  large_model = get_document_by_id("MODEL_COLLECTION_NAME", prompt_template.model)
-  # get connector from firebase by id
-  connector = get_document_by_id("CONNECTOR_COLLECTION_NAME", prompt_template.connector)
-  # create the completion request
-  connector_function = importlib.import_module(f'Connector.{connector.function}')
-  context_from_connector = connector_function(user_input.query)
-  # create the completion request
-  completion_function = importlib.import_module(f'LargeModel.{large_model.function}')
-  completion_response = completion_function(
-    user_input.query, prompt_template, context_from_connector)
-  return completion_response
+  prompt: list[dict[str, str]] = []
+  if template.instructions:
+    prompt.append({"role": "system", "content": template.instructions})
+  budget = settings.COMPLETION_CONTEXT_TOKENS
+  if chat.summary:
+    prompt.append(
+      {"role": "system", "content": f"Summary of the earlier conversation:\n{chat.summary}"}
+    )
+    budget -= estimate_tokens(chat.summary)
+  recent: list[dict[str, str]] = []
+  for message in reversed(summaries.pending_messages(chat, messages)):
+    budget -= estimate_tokens(message.content)
+    if budget < 0:
+      break
+    recent.append({"role": message.role, "content": message.content})
+  prompt += reversed(recent)
+  if template.template and "{query}" in template.template:
+    query = template.template.replace("{query}", query)
+  prompt.append({"role": "user", "content": query})
+  return prompt
+
+
+async def chat_completions(
+  session: AsyncSession, chat: Chat, template: Template, user_input: CompletionInput
+) -> MessagePublic:
+  """
+  Answer a question in a chat. The question and the answer are added to the
+  chat, and its summary is refreshed in the background when due.
+  """
+  asked_at = datetime.utcnow()
+  with COMPLETION_STAGE_SECONDS.labels("prompt").time():
+    window = await conversation_cache.get(session, chat.id)
+    prompt = build_prompt(template, chat, window.messages, user_input.query)
+    # Don't hold a connection while the model answers
+    await session.commit()
+
+  with COMPLETION_STAGE_SECONDS.labels("model").time():
+    large_model = LargeModel.load()
+    answer = await large_model.complete(prompt, model=template.model)
+  answer = answer[:settings.MESSAGE_MAX_LENGTH]
+
+  saving_at = time.perf_counter()
+  question_message, question_body = message_body.new_message(
+    MessageCreate(role="user", content=user_input.query, chat_id=chat.id)
+  )
+  question_message.created_at = asked_at
+  answer_message, answer_body = message_body.new_message(
+    MessageCreate(role="assistant", content=answer, chat_id=chat.id)
+  )
+  session.add_all([question_message, answer_message])
+  session.add_all([body for body in (question_body, answer_body) if body is not None])
+  await publish_changes(session, [chat.id])
+  await session.commit()
+  COMPLETION_STAGE_SECONDS.labels("save").observe(time.perf_counter() - saving_at)
+
+  new_messages = [
+    MessagePublic.model_validate(message, update={"content": content, "truncated": False})
+    for message, content in ((question_message, user_input.query), (answer_message, answer))
+  ]
+  for message in new_messages:
+    conversation_cache.append(message)
+  if summaries.needs_summary(chat, [*window.messages, *new_messages]):
+    summaries.schedule_summary(chat.id)
+  return new_messages[-1]
@@ -0,0 +1,163 @@
+"""
+Rolling conversation state of active chats.
+
+Answering a follow-up question needs the last messages of the chat. For each
+active chat the cache keeps a window of its last CONVERSATION_WINDOW_MESSAGES
+messages, with their full content and token count, and appends new messages
+to it as they are created, so preparing the context of the next turn usually
+doesn't read the database. Chats unused for CONVERSATION_CACHE_TTL_SECONDS,
+or the least recently used ones once the cache is full, are evicted.
+
+Any other change to a chat's messages (edit, delete, bulk write, import)
+invalidates its window, in this worker and, through the broadcast, in the
+others.
+"""
+import uuid
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from cachetools import TTLCache
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud, message_body
+from app.core.broadcast import broadcast
+from app.core.config import settings
+from app.core.versions import KeyVersions
+from app.models import MessagePublic
+
+BROADCAST_TOPIC = "conversation"
+
+
+def estimate_tokens(text: str) -> int:
+  """
+  Rough token count of a text, about 4 characters per token for the OpenAI
+  tokenizers on English text. Good enough to budget a prompt.
+  """
+  return (len(text) + 3) // 4
+
+
+@dataclass
+class Conversation:
+  """
+  The last messages of a chat, oldest first, and their token count.
+  """
+  messages: deque[MessagePublic]
+  tokens: int = 0
+
+  def append(self, message: MessagePublic) -> None:
+    """
+    Add a message, dropping the oldest one when the window is full.
+    """
+    if len(self.messages) == self.messages.maxlen:
+      self.tokens -= estimate_tokens(self.messages[0].content)
+    self.messages.append(message)
+    self.tokens += estimate_tokens(message.content)
+
+
+@dataclass(frozen=True)
+class ConversationWindow:
+  """
+  Snapshot of a conversation, safe to use across awaits.
+  """
+  messages: list[MessagePublic] = field(default_factory=list)
+  tokens: int = 0
+
+
+class ConversationCache:
+  """
+  LRU/TTL cache of the conversations of active chats.
+  """
+
+  def __init__(self, maxsize: int, ttl: float, window: int) -> None:
+    self.window = window
+    self._cache: TTLCache[uuid.UUID, Conversation] = TTLCache(maxsize=maxsize, ttl=ttl)
+    # Changes of the chats being loaded, a load that raced with one isn't cached
+    self._versions = KeyVersions()
+    self.hits = 0
+    self.misses = 0
+
+  async def get(self, session: AsyncSession, chat_id: uuid.UUID) -> ConversationWindow:
+    """
+    Return the last messages of a chat, reading them only on a cache miss.
+    """
+    conversation = self._cache.get(chat_id)
+    if conversation is not None:
+      self.hits += 1
+    else:
+      self.misses += 1
+      with self._versions.reading(chat_id) as version:
+        messages, _ = await crud.get_chat_messages_async(
+          session=session, chat_id=chat_id, tail=self.window
+        )
+        conversation = Conversation(messages=deque(maxlen=self.window))
+        for message in await message_body.with_full_content(session, messages):
+          conversation.append(message)
+        if self._versions.current(version):
+          self._cache[chat_id] = conversation
+    return ConversationWindow(messages=list(conversation.messages), tokens=conversation.tokens)
+
+  def append(self, message: MessagePublic) -> None:
+    """
+    Add a committed message, with its full content, to its chat's window.
+    """
+    self._versions.bump(message.chat_id)
+    conversation = self._cache.get(message.chat_id)
+    if conversation is None:
+      return
+    last = conversation.messages[-1] if conversation.messages else None
+    if last is not None and last.created_at and message.created_at and (
+      message.created_at < last.created_at
+    ):
+      # Committed out of order, reload the window rather than sort it
+      self._cache.pop(message.chat_id, None)
+      return
+    conversation.append(message)
+
+  def invalidate(self, chat_ids: Iterable[uuid.UUID] | None = None) -> None:
+    """
+    Drop the windows of the chats, or all of them.
+    """
+    if chat_ids is None:
+      self._versions.bump_all()
+      self._cache.clear()
+      return
+    for chat_id in chat_ids:
+      self._versions.bump(chat_id)
+      self._cache.pop(chat_id, None)
+
+  def stats(self) -> dict[str, Any]:
+    """
+    Cache size and hit counters.
+    """
+    return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+conversation_cache = ConversationCache(
+  maxsize=settings.CONVERSATION_CACHE_SIZE,
+  ttl=settings.CONVERSATION_CACHE_TTL_SECONDS,
+  window=settings.CONVERSATION_WINDOW_MESSAGES,
+)
+
+
+async def publish_changes(
+  session: AsyncSession, chat_ids: Iterable[uuid.UUID] | None
+) -> None:
+  """
+  Have the other workers drop the windows of the chats (all with None) once
+  the session's transaction commits. Call it before the commit, and
+  conversation_cache.append or invalidate after it.
+  """
+  payload = {"chat_ids": None if chat_ids is None else [str(chat_id) for chat_id in chat_ids]}
+  await broadcast.publish(session, BROADCAST_TOPIC, payload)
+
+
+def _on_broadcast(payload: dict[str, Any] | None) -> None:
+  if payload is None or payload.get("chat_ids") is None:
+    conversation_cache.invalidate()
+  else:
+    conversation_cache.invalidate(uuid.UUID(chat_id) for chat_id in payload["chat_ids"])
+
+
+broadcast.subscribe(BROADCAST_TOPIC, _on_broadcast)
@@ -0,0 +1,81 @@
+"""
+In-process background jobs.
+
+Jobs are coroutines run as asyncio tasks after the request that submitted
+them returned. Each job has a key and a key runs at most once at a time, so
+e.g. a chat isn't summarized twice concurrently by the same worker; at most
+BACKGROUND_JOBS_CONCURRENCY jobs run together. Jobs are lost when the worker
+stops, so they must be safe to submit again (they are re-triggered by the
+next request needing them).
+"""
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from app.core import query_tracker
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs:
+  """
+  Registry of running jobs, by key.
+  """
+
+  def __init__(self, concurrency: int) -> None:
+    self.concurrency = concurrency
+    self._semaphore: asyncio.Semaphore | None = None
+    self._tasks: dict[str, asyncio.Task[None]] = {}
+    self.completed = 0
+    self.failed = 0
+
+  def submit(self, key: str, job: Callable[..., Awaitable[Any]], *args: Any) -> bool:
+    """
+    Run job(*args) in the background, unless a job with the same key is
+    already queued or running. Returns whether it was submitted.
+    """
+    if key in self._tasks:
+      return False
+    self._tasks[key] = asyncio.create_task(self._run(key, job, args), name=key)
+    return True
+
+  async def _run(self, key: str, job: Callable[..., Awaitable[Any]], args: tuple) -> None:
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.concurrency)
+    # Not part of the queries of the request which submitted the job
+    query_tracker.untrack()
+    try:
+      async with self._semaphore:
+        await job(*args)
+      self.completed += 1
+    except Exception:  # pylint: disable=broad-except
+      self.failed += 1
+      logger.exception("Background job %s failed", key)
+    finally:
+      self._tasks.pop(key, None)
+
+  async def drain(self, timeout: float = 10.0) -> None:
+    """
+    Wait for the running jobs, cancelling those still running after timeout.
+    """
+    tasks = list(self._tasks.values())
+    if not tasks:
+      return
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+      task.cancel()
+
+  def stats(self) -> dict[str, Any]:
+    """
+    Running jobs and counters.
+    """
+    return {
+      "running": sorted(self._tasks),
+      "completed": self.completed,
+      "failed": self.failed,
+    }
+
+
+background_jobs = BackgroundJobs(settings.BACKGROUND_JOBS_CONCURRENCY)
@@ -0,0 +1,134 @@
+"""
+Events between worker processes, over Postgres LISTEN/NOTIFY.
+
+Per-process caches use it to drop entries another worker made stale. Events
+are published with pg_notify in the writer's transaction, so they are only
+delivered once it commits. Each worker listens on its own connection and
+ignores the events it published itself.
+
+Events can be lost while the listener reconnects, so subscribers are called
+with None after a reconnection and must then drop everything they cache.
+With BROADCAST_ENABLED off (a single worker) publish does nothing.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+import psycopg
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import async_engine
+
+logger = logging.getLogger(__name__)
+
+# Handler of a topic, called with the event payload, or None to resync
+Handler = Callable[[dict[str, Any] | None], None]
+
+NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD_BYTES = 7_900
+
+# How often the listener checks if it must stop
+STOP_CHECK_SECONDS = 1.0
+
+
+class Broadcast:
+  """
+  Publish events to the other workers and dispatch theirs to subscribers.
+  """
+
+  def __init__(self, channel: str, enabled: bool) -> None:
+    self.channel = channel
+    self.enabled = enabled
+    self.origin = uuid.uuid4().hex
+    self.handlers: dict[str, list[Handler]] = {}
+    self._task: asyncio.Task[None] | None = None
+    self._stopping = False
+
+  def subscribe(self, topic: str, handler: Handler) -> None:
+    """
+    Call handler with the payload of every event of topic from other workers.
+    """
+    self.handlers.setdefault(topic, []).append(handler)
+
+  async def publish(self, session: AsyncSession, topic: str, payload: dict[str, Any]) -> None:
+    """
+    Publish an event in the session's transaction, it is delivered on commit.
+    """
+    if not self.enabled:
+      return
+    message = json.dumps({"topic": topic, "origin": self.origin, "payload": payload})
+    if len(message.encode()) > MAX_PAYLOAD_BYTES:
+      # Too large to be sent, have the other workers drop everything instead
+      message = json.dumps({"topic": topic, "origin": self.origin, "payload": None})
+    await session.execute(NOTIFY, {"channel": self.channel, "payload": message})
+
+  def _dispatch(self, message: str) -> None:
+    try:
+      event = json.loads(message)
+    except ValueError:
+      logger.warning("Ignoring malformed broadcast event: %r", message)
+      return
+    if event.get("origin") == self.origin:
+      return
+    for handler in self.handlers.get(event.get("topic"), []):
+      try:
+        handler(event.get("payload"))
+      except Exception:  # pylint: disable=broad-except
+        logger.exception("Broadcast handler of %s failed", event.get("topic"))
+
+  def _resync(self) -> None:
+    for handlers in self.handlers.values():
+      for handler in handlers:
+        handler(None)
+
+  async def _listen(self) -> None:
+    dsn = async_engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    delay = 1.0
+    connected_before = False
+    while not self._stopping:
+      try:
+        async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+          await conn.execute(f'LISTEN "{self.channel}"')
+          if connected_before:
+            # Events published while we were away are lost
+            self._resync()
+          connected_before = True
+          delay = 1.0
+          while not self._stopping:
+            # Wake up regularly to see if we must stop, cancelling a
+            # connection waiting for notifications can hang
+            async for notify in conn.notifies(timeout=STOP_CHECK_SECONDS):
+              self._dispatch(notify.payload)
+      except Exception as e:  # pylint: disable=broad-except
+        logger.warning("Broadcast listener disconnected: %s, retrying in %.0fs", e, delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+  async def start(self) -> None:
+    """
+    Start listening, from the application lifespan.
+    """
+    if self.enabled and self._task is None:
+      self._stopping = False
+      self._task = asyncio.create_task(self._listen())
+
+  async def stop(self) -> None:
+    """
+    Stop listening.
+    """
+    if self._task is not None:
+      self._stopping = True
+      _, pending = await asyncio.wait([self._task], timeout=STOP_CHECK_SECONDS * 2)
+      for task in pending:
+        task.cancel()
+      self._task = None
+
+
+broadcast = Broadcast(settings.BROADCAST_CHANNEL, settings.BROADCAST_ENABLED)
@@ -0,0 +1,208 @@
+"""
+Response compression.
+
+CompressionMiddleware compresses the responses whose type is in
+COMPRESSIBLE_TYPES, with the best encoding the client accepts: zstd or br
+when the zstandard or brotli packages are installed, else gzip.
+- A response sent in one message is compressed if it is at least
+  COMPRESSION_MIN_SIZE bytes;
+- a streamed response (NDJSON exports, server-sent events) is compressed
+  chunk by chunk, each chunk being flushed so the client gets it at once
+  instead of when the compressor's buffer fills.
+Responses already encoded, partial or marked no-transform are left alone.
+"""
+import zlib
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+  import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+  brotli = None
+
+try:
+  import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+  zstandard = None
+
+COMPRESSIBLE_TYPES = {
+  "application/json",
+  "application/x-ndjson",
+  "application/javascript",
+  "application/xml",
+  "image/svg+xml",
+  "text/css",
+  "text/csv",
+  "text/event-stream",
+  "text/html",
+  "text/javascript",
+  "text/plain",
+}
+
+
+def accepted_encodings(headers: Headers) -> set[str]:
+  """
+  Encodings listed in an Accept-Encoding header, unless refused with q=0.
+  """
+  encodings = set()
+  for part in headers.get("accept-encoding", "").split(","):
+    encoding, _, params = part.strip().partition(";")
+    if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+      encodings.add(encoding.strip().lower())
+  return encodings
+
+
+class GzipEncoder:
+  """
+  Incremental gzip.
+  """
+
+  def __init__(self, level: int) -> None:
+    self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+  def compress(self, data: bytes) -> bytes:
+    return self._compressor.compress(data)
+
+  def flush(self) -> bytes:
+    return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+  def finish(self) -> bytes:
+    return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+  """
+  Incremental brotli.
+  """
+
+  def __init__(self, level: int) -> None:
+    self._compressor = brotli.Compressor(quality=level)
+
+  def compress(self, data: bytes) -> bytes:
+    return self._compressor.process(data)
+
+  def flush(self) -> bytes:
+    return self._compressor.flush()
+
+  def finish(self) -> bytes:
+    return self._compressor.finish()
+
+
+class ZstdEncoder:
+  """
+  Incremental zstd.
+  """
+
+  def __init__(self, level: int) -> None:
+    self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+  def compress(self, data: bytes) -> bytes:
+    return self._compressor.compress(data)
+
+  def flush(self) -> bytes:
+    return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+  def finish(self) -> bytes:
+    return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class CompressionMiddleware:
+  """
+  Compress the responses of compressible types, whole or streamed.
+  """
+
+  def __init__(
+    self,
+    app: ASGIApp,
+    minimum_size: int = 1_024,
+    gzip_level: int = 6,
+    brotli_level: int = 4,
+    zstd_level: int = 3,
+  ) -> None:
+    self.app = app
+    self.minimum_size = minimum_size
+    # Preferred encodings first
+    self.encoders: list[tuple[str, Any]] = []
+    if zstandard is not None:
+      self.encoders.append(("zstd", lambda: ZstdEncoder(zstd_level)))
+    if brotli is not None:
+      self.encoders.append(("br", lambda: BrotliEncoder(brotli_level)))
+    self.encoders.append(("gzip", lambda: GzipEncoder(gzip_level)))
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    accepted = accepted_encodings(Headers(scope=scope))
+    for encoding, make_encoder in self.encoders:
+      if encoding in accepted:
+        break
+    else:
+      await self.app(scope, receive, send)
+      return
+
+    start: Message | None = None
+    encoder = None
+    passthrough = False
+
+    async def send_compressed(message: Message) -> None:
+      nonlocal start, encoder, passthrough
+      if passthrough:
+        await send(message)
+        return
+      if message["type"] == "http.response.start":
+        if self._compressible(message):
+          # Held until the first body message tells whether it's streamed
+          start = message
+        else:
+          passthrough = True
+          await send(message)
+        return
+      if message["type"] != "http.response.body" or start is None:
+        await send(message)
+        return
+      body = message.get("body", b"")
+      more_body = message.get("more_body", False)
+      if encoder is None:
+        if not more_body and len(body) < self.minimum_size:
+          passthrough = True
+          await send(start)
+          await send(message)
+          return
+        encoder = make_encoder()
+        headers = MutableHeaders(scope=start)
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+          # Not byte for byte the same representation anymore
+          headers["ETag"] = f"W/{etag}"
+        if not more_body:
+          compressed = encoder.compress(body) + encoder.finish()
+          headers["Content-Length"] = str(len(compressed))
+          await send(start)
+          await send({"type": "http.response.body", "body": compressed})
+          return
+        del headers["Content-Length"]
+        await send(start)
+      if more_body:
+        chunk = encoder.compress(body) + encoder.flush() if body else b""
+      else:
+        chunk = encoder.compress(body) + encoder.finish()
+      await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    await self.app(scope, receive, send_compressed)
+
+  @staticmethod
+  def _compressible(start: Message) -> bool:
+    headers = Headers(raw=start["headers"])
+    if start["status"] < 200 or start["status"] in (204, 206, 304):
+      return False
+    if "content-encoding" in headers or "content-range" in headers:
+      return False
+    if "no-transform" in headers.get("cache-control", ""):
+      return False
+    content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES
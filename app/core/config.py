@@ -1,6 +1,7 @@
 """
 Application settings.
 """
+import math
 import os
 import secrets
 import warnings
@@ -23,7 +24,7 @@ load_dotenv()
 
 def parse_cors(v: Any) -> list[str] | str:
   """
-  Parse CORS origins from a string or a list of strings.
+  Parse CORS origins (or any comma separated list) from a string or a list of strings.
   """
   if isinstance(v, str) and not v.startswith("["):
     return [i.strip() for i in v.split(",")]
@@ -66,6 +67,19 @@ class Settings(BaseSettings):
 
   PROJECT_NAME: str
   SENTRY_DSN: HttpUrl | None = None
+  # Trace sampling (app.core.tracing): share of the requests traced, by
+  # default and by path prefix; share traced to keep the slow (over
+  # SENTRY_TRACES_SLOW_SECONDS) and failing ones of
+  SENTRY_TRACES_SAMPLE_RATE: float = 0.05
+  SENTRY_TRACES_TAIL_RATE: float = 0.2
+  SENTRY_TRACES_SLOW_SECONDS: float = 1.0
+  SENTRY_TRACES_ROUTE_RATES: dict[str, float] = {
+    "/api/v1/utils/health-check/": 0.0,
+    "/api/v1/utils/live/": 0.0,
+    "/api/v1/utils/ready/": 0.0,
+    "/assets/": 0.0,
+    "/metrics": 0.0,
+  }
   POSTGRES_SERVER: str
   POSTGRES_PORT: int = 5432
   POSTGRES_USER: str
@@ -87,6 +101,198 @@ class Settings(BaseSettings):
       path=self.POSTGRES_DB,
     )
 
+  @computed_field  # type: ignore[prop-decorator]
+  @property
+  def sqlalchemy_async_database_uri(self) -> PostgresDsn:
+    """
+    Build the database URL for the async engine (psycopg 3 async driver).
+    """
+    return Url.build(
+      scheme="postgresql+psycopg",
+      username=self.POSTGRES_USER,
+      password=self.POSTGRES_PASSWORD,
+      host=self.POSTGRES_SERVER,
+      port=self.POSTGRES_PORT,
+      path=self.POSTGRES_DB,
+    )
+
+  # Optional read replicas (comma separated DSNs). GET routes read from them
+  # unless the user wrote recently or every replica lags too far behind.
+  POSTGRES_REPLICA_URIS: Annotated[
+      list[PostgresDsn] | str, BeforeValidator(parse_cors)
+  ] = []
+  REPLICA_STICKINESS_SECONDS: float = 5.0
+  REPLICA_MAX_LAG_SECONDS: float = 10.0
+  REPLICA_LAG_CHECK_SECONDS: float = 5.0
+
+  @computed_field  # type: ignore[prop-decorator]
+  @property
+  def replica_async_database_uris(self) -> list[str]:
+    """
+    Replica URLs for the async engine (psycopg 3 async driver).
+    """
+    return [
+      f"postgresql+psycopg://{str(uri).split('://', 1)[1]}"
+      for uri in self.POSTGRES_REPLICA_URIS
+    ]
+
+  # Prometheus metrics at /metrics, only served to requests bearing
+  # METRICS_TOKEN when it is set
+  METRICS_ENABLED: bool = True
+  METRICS_TOKEN: str | None = None
+
+  # On-demand profiles of a worker (app.core.profiler): longest duration,
+  # and seconds between two stack samples
+  PROFILER_MAX_SECONDS: int = 60
+  PROFILER_INTERVAL_SECONDS: float = 0.01
+
+  # Readiness probes (app.health): seconds their results are reused for,
+  # and seconds the database has to answer
+  HEALTH_CHECK_CACHE_SECONDS: float = 5.0
+  HEALTH_CHECK_TIMEOUT_SECONDS: float = 2.0
+
+  # Most seconds from starting a worker to its first answer, checked by the
+  # startup test and `python -m app.startup bench`
+  STARTUP_BUDGET_SECONDS: float = 5.0
+
+  # Gunicorn workers (gunicorn.conf.py): how many, defaulting to the CPUs
+  # available to the container, the requests after which a worker is
+  # replaced (plus a random jitter so they don't all restart at once), the
+  # seconds a silent worker is killed after, and the seconds a worker has
+  # to finish its requests when stopped
+  WEB_WORKERS: int | None = None
+  WEB_WORKER_MAX_REQUESTS: int = 10_000
+  WEB_WORKER_MAX_REQUESTS_JITTER: int = 1_000
+  WEB_WORKER_TIMEOUT: int = 60
+  WEB_WORKER_GRACEFUL_TIMEOUT: int = 30
+
+  # Connection pool, applied to every engine. Set DB_PGBOUNCER_MODE when
+  # connecting through PgBouncer in transaction pooling mode, it turns off
+  # server-side prepared statements which don't survive a backend switch.
+  DB_POOL_SIZE: int = 5
+  DB_MAX_OVERFLOW: int = 10
+  DB_POOL_TIMEOUT: float = 30.0
+  DB_POOL_RECYCLE: int = 1800
+  DB_POOL_PRE_PING: bool = True
+  DB_PGBOUNCER_MODE: bool = False
+  # Checkouts waiting longer than this are logged as a warning
+  DB_POOL_SLOW_CHECKOUT_SECONDS: float = 1.0
+
+  # Bulk endpoints: max rows per request, and batch size from which COPY is
+  # used instead of multi-row INSERT statements
+  BULK_MAX_ROWS: int = 50_000
+  BULK_COPY_THRESHOLD: int = 1_000
+  # Largest bulk request body, and NDJSON line, accepted, in bytes
+  BULK_MAX_BYTES: int = 64 * 1024 * 1024
+  BULK_MAX_LINE_BYTES: int = 4 * 1024 * 1024
+
+  # Message content: longest accepted message (in characters), and body size
+  # (in bytes) from which the full body of a long message is stored compressed
+  MESSAGE_MAX_LENGTH: int = 200_000
+  MESSAGE_COMPRESS_THRESHOLD: int = 1_024
+
+  # Imports are rejected past these sizes, measured after decompression so
+  # that a small gzip bomb can't exhaust the worker's memory
+  IMPORT_MAX_LINE_BYTES: int = 4 * 1024 * 1024
+  IMPORT_MAX_BYTES: int = 1024 * 1024 * 1024
+
+  # Rolling window of the last messages of active chats, kept in memory to
+  # build prompt context without reading the history again
+  CONVERSATION_WINDOW_MESSAGES: int = 20
+  CONVERSATION_CACHE_SIZE: int = 10_000
+  CONVERSATION_CACHE_TTL_SECONDS: int = 30 * 60
+
+  # Responses of compressible types from COMPRESSION_MIN_SIZE bytes, and all
+  # streamed ones, are compressed with zstd, br (when zstandard or brotli
+  # are installed) or gzip, at these levels
+  COMPRESSION_ENABLED: bool = True
+  COMPRESSION_MIN_SIZE: int = 1_024
+  COMPRESSION_GZIP_LEVEL: int = 6
+  COMPRESSION_BROTLI_LEVEL: int = 4
+  COMPRESSION_ZSTD_LEVEL: int = 3
+
+  # Token buckets per user and route class: sustained requests per minute
+  # and burst. Buckets are shared by the workers through Redis when
+  # RATE_LIMIT_REDIS_URL is set, else each worker has its own
+  RATE_LIMIT_ENABLED: bool = True
+  RATE_LIMIT_COMPLETIONS_PER_MINUTE: int = 20
+  RATE_LIMIT_COMPLETIONS_BURST: int = 5
+  RATE_LIMIT_CRUD_PER_MINUTE: int = 600
+  RATE_LIMIT_CRUD_BURST: int = 100
+  RATE_LIMIT_SHARDS: int = 16
+  RATE_LIMIT_MAX_KEYS: int = 100_000
+  RATE_LIMIT_REDIS_URL: str | None = None
+  # Redis connect and command timeout, and how long the local buckets are
+  # used after a Redis failure before trying it again
+  RATE_LIMIT_REDIS_TIMEOUT_SECONDS: float = 0.2
+  RATE_LIMIT_REDIS_RETRY_SECONDS: float = 30.0
+
+  # Per request query counting, to catch N+1 queries in development and
+  # tests: "warn" logs requests sending more than QUERY_COUNT_THRESHOLD
+  # queries, "raise" also fails them
+  QUERY_COUNT_MODE: Literal["off", "warn", "raise"] = "off"
+  QUERY_COUNT_THRESHOLD: int = 20
+
+  # Password hashing process pool: worker processes, most calls queued or
+  # running before new ones are rejected, and the timeout of a call. The
+  # pool gets through WORKERS * TIMEOUT_SECONDS / COST_SECONDS (the CPU
+  # time of a bcrypt call) calls within the timeout: MAX_PENDING defaults
+  # to that and can't exceed it, the calls past it would only time out
+  PASSWORD_HASH_WORKERS: int = 2
+  PASSWORD_HASH_TIMEOUT_SECONDS: float = 5.0
+  PASSWORD_HASH_COST_SECONDS: float = 0.25
+  PASSWORD_HASH_MAX_PENDING: int | None = None
+
+  @model_validator(mode="after")
+  def _set_password_hash_max_pending(self) -> Self:
+    most = math.floor(
+      self.PASSWORD_HASH_WORKERS * self.PASSWORD_HASH_TIMEOUT_SECONDS
+      / self.PASSWORD_HASH_COST_SECONDS
+    )
+    if self.PASSWORD_HASH_MAX_PENDING is None:
+      self.PASSWORD_HASH_MAX_PENDING = max(most, 1)
+    elif self.PASSWORD_HASH_MAX_PENDING > most:
+      raise ValueError(
+        f"PASSWORD_HASH_MAX_PENDING is {self.PASSWORD_HASH_MAX_PENDING}, but "
+        f"{self.PASSWORD_HASH_WORKERS} workers only get through {most} calls of "
+        f"{self.PASSWORD_HASH_COST_SECONDS}s in {self.PASSWORD_HASH_TIMEOUT_SECONDS}s"
+      )
+    return self
+
+  # Authenticated users cached by get_current_user
+  USER_CACHE_SIZE: int = 10_000
+  USER_CACHE_TTL_SECONDS: int = 60
+
+  # Cross-worker events (cache invalidations) through Postgres LISTEN/NOTIFY.
+  # Turn on when running more than one worker process. The listener needs a
+  # session level connection, so it must not go through PgBouncer in
+  # transaction pooling mode.
+  BROADCAST_ENABLED: bool = False
+  BROADCAST_CHANNEL: str = "alima_events"
+
+  # Large models: LargeModel module answering completions, its model (a
+  # template's model field overrides it) and the most tokens of conversation
+  # (summary and recent messages) sent per turn
+  DEFAULT_LARGE_MODEL: str = "open_ai_large"
+  OPENAI_API_KEY: str | None = None
+  OPENAI_MODEL: str = "gpt-4o-mini"
+  OPENAI_TIMEOUT_SECONDS: float = 60.0
+  COMPLETION_CONTEXT_TOKENS: int = 4_000
+
+  # Chat summaries: once the messages not yet summarized reach
+  # SUMMARY_TRIGGER_TOKENS, all but the last SUMMARY_KEEP_MESSAGES are folded
+  # into the chat's summary by a background job
+  SUMMARY_TRIGGER_TOKENS: int = 2_000
+  SUMMARY_KEEP_MESSAGES: int = 6
+  SUMMARY_MAX_TOKENS: int = 500
+  # Most tokens of messages summarized per model call
+  SUMMARY_CHUNK_TOKENS: int = 6_000
+  BACKGROUND_JOBS_CONCURRENCY: int = 4
+  # Users owning more rows than USER_PURGE_SYNC_MAX_ROWS are deleted by a
+  # background job, USER_PURGE_CHUNK_ROWS rows per transaction
+  USER_PURGE_SYNC_MAX_ROWS: int = 10_000
+  USER_PURGE_CHUNK_ROWS: int = 5_000
+
   SMTP_TLS: bool = True
   SMTP_SSL: bool = False
   SMTP_PORT: int = 587
@@ -104,6 +310,20 @@ class Settings(BaseSettings):
     return self
 
   EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
+  # Emails are queued in the outbox table and sent by a background sender in
+  # each worker, up to EMAIL_OUTBOX_BATCH_SIZE per round on one connection,
+  # which is closed after EMAIL_SMTP_IDLE_SECONDS without emails. A round
+  # claims its emails for EMAIL_OUTBOX_LEASE_SECONDS, which must exceed the
+  # time to send a batch or its emails may be sent twice
+  EMAIL_OUTBOX_BATCH_SIZE: int = 50
+  EMAIL_OUTBOX_POLL_SECONDS: float = 5.0
+  EMAIL_OUTBOX_LEASE_SECONDS: float = 300.0
+  EMAIL_SMTP_IDLE_SECONDS: float = 60.0
+  # Failed sends are retried after EMAIL_RETRY_BASE_SECONDS, doubled on each
+  # attempt up to EMAIL_RETRY_MAX_SECONDS, EMAIL_MAX_ATTEMPTS times in all
+  EMAIL_RETRY_BASE_SECONDS: float = 30.0
+  EMAIL_RETRY_MAX_SECONDS: float = 3_600.0
+  EMAIL_MAX_ATTEMPTS: int = 8
 
   @computed_field  # type: ignore[prop-decorator]
   @property
@@ -1,13 +1,67 @@
 """
 Database initialization
 """
+from typing import Any
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlmodel import Session, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import crud
 from app.core.config import settings
+from app.core.pool import (
+  InstrumentedAsyncAdaptedQueuePool,
+  InstrumentedQueuePool,
+  instrument_engine_pool,
+)
 from app.models import User, UserCreate
 
-engine = create_engine(str(settings.sqlalchemy_database_uri))
+
+def pool_options() -> dict[str, Any]:
+  """
+  Pool sizing options shared by all engines.
+  """
+  return {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+  }
+
+
+def async_connect_args() -> dict[str, Any]:
+  """
+  Driver options for the psycopg 3 async engines.
+  """
+  if settings.DB_PGBOUNCER_MODE:
+    # PgBouncer in transaction mode may hand every transaction a different
+    # server connection, so never prepare statements server-side
+    return {"prepare_threshold": None}
+  return {}
+
+
+# Sync engine, used by Alembic, the pre-start scripts and init_db
+engine = create_engine(
+  str(settings.sqlalchemy_database_uri),
+  poolclass=InstrumentedQueuePool,
+  **pool_options(),
+)
+instrument_engine_pool(engine, "primary-sync")
+
+# Async engine, used by the API routes
+async_engine = create_async_engine(
+  str(settings.sqlalchemy_async_database_uri),
+  poolclass=InstrumentedAsyncAdaptedQueuePool,
+  connect_args=async_connect_args(),
+  **pool_options(),
+)
+instrument_engine_pool(async_engine, "primary")
+
+# Objects returned by the routes are serialized after commit, so don't expire them
+async_session_factory = async_sessionmaker(
+  async_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
@@ -0,0 +1,143 @@
+"""
+Password hashing in a process pool.
+
+A bcrypt hash or verification costs about 250ms of CPU. Run in the worker,
+a burst of logins would starve every other request. They run in a pool of
+PASSWORD_HASH_WORKERS processes instead:
+- at most PASSWORD_HASH_MAX_PENDING calls are queued or running, further
+  ones are rejected at once with a 503;
+- a call not done within PASSWORD_HASH_TIMEOUT_SECONDS (queueing included)
+  fails with a 503 too, so clients retry instead of piling up. A call
+  already running in a process can't be stopped, it counts as pending
+  until it finishes.
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.metrics import LatencyStats
+from app.core.security import get_password_hash, verify_password
+
+logger = logging.getLogger(__name__)
+
+
+def _busy(detail: str) -> HTTPException:
+  return HTTPException(status_code=503, detail=detail, headers={"Retry-After": "1"})
+
+
+class PasswordHasher:
+  """
+  Bounded, queued, timed password hashing and verification.
+  """
+
+  def __init__(self, workers: int, max_pending: int, timeout: float) -> None:
+    self.workers = workers
+    self.max_pending = max_pending
+    self.timeout = timeout
+    self.pending = 0
+    self.rejected = 0
+    self.timeouts = 0
+    self.hash_latency = LatencyStats()
+    self.verify_latency = LatencyStats()
+    self._executor: ProcessPoolExecutor | None = None
+
+  def _get_executor(self) -> ProcessPoolExecutor:
+    if self._executor is None:
+      # Spawned, forking a process running an event loop and threads isn't
+      # safe. Spawned processes import __main__ again, which entry points
+      # must guard with if __name__ == "__main__" (uvicorn and gunicorn do).
+      self._executor = ProcessPoolExecutor(
+        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+      )
+    return self._executor
+
+  def _release(self, loop: asyncio.AbstractEventLoop) -> Callable[[Future], None]:
+    def done(_future: Future) -> None:
+      # Called in the executor's thread
+      try:
+        loop.call_soon_threadsafe(self._done)
+      except RuntimeError:
+        # The loop is closed, at shutdown
+        pass
+
+    return done
+
+  def _done(self) -> None:
+    self.pending -= 1
+
+  async def _run(self, latency: LatencyStats, func: Callable[..., Any], *args: Any) -> Any:
+    if self.pending >= self.max_pending:
+      self.rejected += 1
+      raise _busy("Too many password checks in progress, retry later")
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+      future = self._get_executor().submit(func, *args)
+    except BrokenProcessPool:
+      logger.exception("Password hashing pool broken, restarting it")
+      self._executor = None
+      raise _busy("Password check failed, retry later")
+    self.pending += 1
+    # Pending until the process is done with it, not until we stop waiting
+    future.add_done_callback(self._release(loop))
+    try:
+      # Shielded, a timeout mustn't cancel the call with the wait
+      return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+    except asyncio.TimeoutError:
+      self.timeouts += 1
+      # Only drops it if still queued, a running call finishes anyway
+      future.cancel()
+      raise _busy("Password check timed out, retry later")
+    except BrokenProcessPool:
+      logger.exception("Password hashing pool broken, restarting it")
+      self._executor = None
+      raise _busy("Password check failed, retry later")
+    finally:
+      latency.observe(time.perf_counter() - start)
+
+  async def hash(self, password: str) -> str:
+    """
+    Hash a password.
+    """
+    return await self._run(self.hash_latency, get_password_hash, password)
+
+  async def verify(self, plain_password: str, hashed_password: str) -> bool:
+    """
+    Check a password against its hash.
+    """
+    return await self._run(self.verify_latency, verify_password, plain_password, hashed_password)
+
+  def shutdown(self) -> None:
+    """
+    Stop the worker processes.
+    """
+    if self._executor is not None:
+      self._executor.shutdown(wait=False, cancel_futures=True)
+      self._executor = None
+
+  def stats(self) -> dict[str, Any]:
+    """
+    Queue state, rejection counters and latencies (queueing included).
+    """
+    return {
+      "workers": self.workers,
+      "pending": self.pending,
+      "rejected": self.rejected,
+      "timeouts": self.timeouts,
+      "hash": self.hash_latency.snapshot(),
+      "verify": self.verify_latency.snapshot(),
+    }
+
+
+password_hasher = PasswordHasher(
+  workers=settings.PASSWORD_HASH_WORKERS,
+  max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+  timeout=settings.PASSWORD_HASH_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,88 @@
+"""
+Lightweight in-process metrics, and the Prometheus metrics of the app.
+
+The Prometheus metrics are all labelled: their values only exist once
+recorded, so processes importing this module without serving requests
+(the password hashing pool) don't show up in the multiprocess files.
+Exposed by app.core.prometheus.
+"""
+import threading
+from dataclasses import dataclass, field
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Request latencies, from a few milliseconds to a model's answer
+LATENCY_BUCKETS = (
+  0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+HTTP_REQUESTS = Counter(
+  "http_requests_total", "HTTP requests, by route template", ["method", "route", "status"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+  "http_request_duration_seconds", "HTTP request latency, by route template",
+  ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+  "http_requests_in_progress", "HTTP requests being served", ["method"],
+  multiprocess_mode="livesum",
+)
+REQUEST_DB_QUERIES = Histogram(
+  "http_request_db_queries", "Database queries sent per HTTP request", ["route"],
+  buckets=(0, 1, 2, 3, 5, 8, 13, 20, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+  "http_request_db_seconds", "Time spent in database queries per HTTP request", ["route"],
+  buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+  "db_pool_checkout_seconds", "Time to check a connection out of a pool", ["pool"],
+  buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DB_POOL_TIMEOUTS = Counter(
+  "db_pool_timeouts_total", "Checkouts which timed out waiting for a connection", ["pool"]
+)
+DB_POOL_CONNECTIONS = Gauge(
+  "db_pool_connections", "Connections of the pools, by state", ["pool", "state"],
+  multiprocess_mode="livesum",
+)
+COMPLETION_STAGE_SECONDS = Histogram(
+  "completion_stage_seconds", "Time spent in each stage of a chat completion", ["stage"],
+  buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+  "llm_tokens_total", "Tokens used by the large models", ["model", "kind"]
+)
+
+
+@dataclass
+class LatencyStats:
+  """
+  Count, total and max of observed durations, in seconds.
+  """
+  count: int = 0
+  total: float = 0.0
+  max: float = 0.0
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def observe(self, seconds: float) -> None:
+    """
+    Record one duration.
+    """
+    with self._lock:
+      self.count += 1
+      self.total += seconds
+      if seconds > self.max:
+        self.max = seconds
+
+  def snapshot(self) -> dict[str, float]:
+    """
+    Return the current values as a dict.
+    """
+    with self._lock:
+      return {
+        "count": self.count,
+        "total": self.total,
+        "avg": self.total / self.count if self.count else 0.0,
+        "max": self.max,
+      }
@@ -0,0 +1,142 @@
+"""
+Instrumented connection pools.
+
+The pools keep track of how many checkouts had to wait for a connection and
+for how long, so pool exhaustion shows up in the metrics instead of only as
+unexplained latency.
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection, QueuePool
+
+from app.core.config import settings
+from app.core.metrics import (
+  DB_POOL_CHECKOUT_SECONDS, DB_POOL_CONNECTIONS, DB_POOL_TIMEOUTS, LatencyStats
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolMetrics:
+  """
+  Checkout statistics of one pool. Survives pool recreation (engine.dispose).
+  """
+  name: str
+  waiters: int = 0
+  timeouts: int = 0
+  checkout: LatencyStats = field(default_factory=LatencyStats)
+  wait: LatencyStats = field(default_factory=LatencyStats)
+  engine: Any = field(default=None, repr=False)
+
+
+# pool name -> metrics, filled by instrument_engine_pool
+pool_metrics: dict[str, PoolMetrics] = {}
+
+
+class _InstrumentedPoolMixin:
+  """
+  Time every checkout and count the ones that find the pool exhausted.
+  """
+  metrics: PoolMetrics | None = None
+
+  def _exhausted(self) -> bool:
+    # Same test QueuePool._do_get uses to decide to block on the queue
+    return (
+      self._max_overflow > -1
+      and self._overflow >= self._max_overflow
+      and self._pool.empty()
+    )
+
+  def connect(self) -> PoolProxiedConnection:
+    """
+    Check out a connection, recording how long it took.
+    """
+    metrics = self.metrics
+    if metrics is None:
+      return super().connect()
+    waiting = self._exhausted()
+    if waiting:
+      metrics.waiters += 1
+    start = time.perf_counter()
+    try:
+      return super().connect()
+    except exc.TimeoutError:
+      metrics.timeouts += 1
+      DB_POOL_TIMEOUTS.labels(metrics.name).inc()
+      raise
+    finally:
+      elapsed = time.perf_counter() - start
+      metrics.checkout.observe(elapsed)
+      DB_POOL_CHECKOUT_SECONDS.labels(metrics.name).observe(elapsed)
+      if waiting:
+        metrics.waiters -= 1
+        metrics.wait.observe(elapsed)
+      if elapsed > settings.DB_POOL_SLOW_CHECKOUT_SECONDS:
+        logger.warning(
+          "Slow connection checkout from pool %s: %.3fs", metrics.name, elapsed
+        )
+
+  def recreate(self) -> Any:
+    """
+    Carry the metrics over to the new pool.
+    """
+    pool = super().recreate()
+    pool.metrics = self.metrics
+    return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+  """
+  QueuePool with checkout metrics, for sync engines.
+  """
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+  """
+  AsyncAdaptedQueuePool with checkout metrics, for async engines.
+  """
+
+
+def instrument_engine_pool(engine: Any, name: str) -> PoolMetrics:
+  """
+  Attach (or reuse) the named metrics to the pool of an engine.
+  """
+  metrics = pool_metrics.setdefault(name, PoolMetrics(name=name))
+  metrics.engine = engine
+  engine.pool.metrics = metrics
+  return metrics
+
+
+def update_pool_gauges() -> None:
+  """
+  Copy the connection counts of this worker's pools to the Prometheus gauges.
+  """
+  for metrics in pool_metrics.values():
+    pool = metrics.engine.pool
+    DB_POOL_CONNECTIONS.labels(metrics.name, "checked_out").set(pool.checkedout())
+    DB_POOL_CONNECTIONS.labels(metrics.name, "idle").set(pool.checkedin())
+    DB_POOL_CONNECTIONS.labels(metrics.name, "waiting").set(metrics.waiters)
+
+
+def pool_status(engine: Any) -> dict[str, Any]:
+  """
+  Return live pool counters and checkout statistics of an engine.
+  """
+  pool = engine.pool
+  metrics: PoolMetrics | None = getattr(pool, "metrics", None)
+  return {
+    "name": metrics.name if metrics else str(engine.url.host),
+    "size": pool.size(),
+    "checked_in": pool.checkedin(),
+    "checked_out": pool.checkedout(),
+    "overflow": pool.overflow(),
+    "waiters": metrics.waiters if metrics else 0,
+    "timeouts": metrics.timeouts if metrics else 0,
+    "checkout": metrics.checkout.snapshot() if metrics else {},
+    "wait": metrics.wait.snapshot() if metrics else {},
+  }
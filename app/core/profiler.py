@@ -0,0 +1,158 @@
+"""
+On-demand profiling of a live worker.
+
+- cpu: a thread samples the stacks of all the worker's threads every
+  PROFILER_INTERVAL_SECONDS (sys._current_frames, no tracing hooks, so the
+  worker keeps running at nearly full speed) and counts them. The report
+  is in the collapsed format of flamegraph.pl, speedscope and friends, one
+  "thread;outer frame;...;inner frame count" line per distinct stack;
+- memory: tracemalloc traces the allocations for the duration (slowing
+  allocations down meanwhile) and the report lists the lines whose
+  allocated memory grew most between the start and the end.
+
+Only one profile runs at a time in a worker. They profile the worker that
+got the request, which a load balancer picks: run them a few times to see
+the others.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+
+from fastapi import HTTPException
+
+ROOT = str(Path(__file__).resolve().parent.parent.parent)
+
+_running = threading.Lock()
+
+
+def _frame_name(frame: FrameType) -> str:
+  code = frame.f_code
+  filename = code.co_filename
+  if filename.startswith(ROOT):
+    filename = os.path.relpath(filename, ROOT)
+  elif "site-packages" in filename:
+    filename = filename.rsplit("site-packages" + os.sep, 1)[1]
+  else:
+    filename = os.path.basename(filename)
+  return f"{code.co_name} ({filename})"
+
+
+def _collapse(frame: FrameType | None) -> list[str]:
+  names = []
+  while frame is not None:
+    names.append(_frame_name(frame))
+    frame = frame.f_back
+  names.reverse()
+  return names
+
+
+class StackSampler:
+  """
+  Count the stacks of the process' threads, sampled from a thread.
+  """
+
+  def __init__(self, interval: float) -> None:
+    self.interval = interval
+    self.stacks: Counter[str] = Counter()
+    self.samples = 0
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+  def _run(self) -> None:
+    own = threading.get_ident()
+    while not self._stop.wait(self.interval):
+      names = {thread.ident: thread.name for thread in threading.enumerate()}
+      for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+        if ident == own:
+          continue
+        thread = names.get(ident, str(ident)).replace(";", ":").replace(" ", "_")
+        self.stacks[";".join([thread, *_collapse(frame)])] += 1
+      self.samples += 1
+
+  def start(self) -> None:
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._stop.set()
+    self._thread.join()
+
+  def report(self) -> str:
+    """
+    The stacks in the collapsed format, most frequent first.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _acquire() -> None:
+  if not _running.acquire(blocking=False):
+    raise HTTPException(status_code=409, detail="A profile is already running in this worker")
+
+
+async def profile_cpu(seconds: float, interval: float) -> str:
+  """
+  Sample the worker's stacks for seconds, return the collapsed report.
+  """
+  _acquire()
+  try:
+    sampler = StackSampler(interval)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+      await asyncio.sleep(seconds)
+    finally:
+      await asyncio.to_thread(sampler.stop)
+    elapsed = time.perf_counter() - started
+    header = (
+      f"# pid {os.getpid()}: {sampler.samples} samples in {elapsed:.1f}s, "
+      f"every {interval * 1000:g}ms\n"
+    )
+    return header + sampler.report()
+  finally:
+    _running.release()
+
+
+async def profile_memory(seconds: float, top: int) -> str:
+  """
+  Trace allocations for seconds, return the lines whose memory grew most.
+  """
+  _acquire()
+  try:
+    # Tracing may have been started at startup (PYTHONTRACEMALLOC), keep it
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+      tracemalloc.start()
+    try:
+      # Snapshots of a big heap take a while, off the event loop
+      before = await asyncio.to_thread(tracemalloc.take_snapshot)
+      await asyncio.sleep(seconds)
+      after = await asyncio.to_thread(tracemalloc.take_snapshot)
+    finally:
+      if started_here:
+        tracemalloc.stop()
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = await asyncio.to_thread(
+      after.filter_traces(ignored).compare_to, before.filter_traces(ignored), "lineno"
+    )
+    growth = sum(stat.size_diff for stat in stats)
+    grown = sorted(
+      (stat for stat in stats if stat.size_diff > 0), key=lambda stat: stat.size_diff, reverse=True
+    )
+    lines = [
+      f"# pid {os.getpid()}: {growth / 1024:+.1f} KiB traced in {seconds:g}s, "
+      f"top {top} lines by growth\n"
+    ]
+    for stat in grown[:top]:
+      frame = stat.traceback[0]
+      lines.append(
+        f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+        f"{frame.filename}:{frame.lineno}\n"
+      )
+    return "".join(lines)
+  finally:
+    _running.release()
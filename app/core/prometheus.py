@@ -0,0 +1,106 @@
+"""
+Prometheus metrics endpoint and HTTP request metrics.
+
+MetricsMiddleware records, per route template (not the raw path, so ids
+don't make a series each), the latency and status of every request, the
+requests in progress, and how many database queries each one sent and the
+time they took. The metrics themselves are in app.core.metrics.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py) and
+each worker writes its values to its own memory-mapped files there: no
+locks or messages between workers on the request path, and /metrics adds
+up the files of all the workers when it is scraped. Without it, as under
+a single uvicorn, /metrics reports this process' values.
+"""
+import os
+import secrets
+import time
+
+from fastapi import Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import (
+  HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_REQUESTS_IN_PROGRESS, REQUEST_DB_QUERIES,
+  REQUEST_DB_SECONDS,
+)
+from app.core.pool import update_pool_gauges
+from app.core.query_tracker import track, untrack
+
+# Pool gauges are refreshed at most this often by a worker's requests
+POOL_GAUGES_SECONDS = 1.0
+
+
+def _route(scope: Scope) -> str:
+  route = scope.get("route")
+  if route is not None:
+    return route.path
+  # Mounts (the frontend assets) and unmatched paths
+  return "<other>"
+
+
+class MetricsMiddleware:
+  """
+  Record the Prometheus metrics of each HTTP request.
+  """
+
+  def __init__(self, app: ASGIApp) -> None:
+    self.app = app
+    self._pool_gauges_at = 0.0
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    method = scope["method"]
+    status = 500
+    queries = track()
+
+    async def send_with_status(message: Message) -> None:
+      nonlocal status
+      if message["type"] == "http.response.start":
+        status = message["status"]
+      await send(message)
+
+    in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+    in_progress.inc()
+    start = time.perf_counter()
+    try:
+      await self.app(scope, receive, send_with_status)
+    finally:
+      elapsed = time.perf_counter() - start
+      untrack()
+      in_progress.dec()
+      route = _route(scope)
+      HTTP_REQUESTS.labels(method, route, str(status)).inc()
+      HTTP_REQUEST_SECONDS.labels(method, route).observe(elapsed)
+      REQUEST_DB_QUERIES.labels(route).observe(queries.count)
+      REQUEST_DB_SECONDS.labels(route).observe(queries.seconds)
+      now = time.monotonic()
+      if now - self._pool_gauges_at > POOL_GAUGES_SECONDS:
+        self._pool_gauges_at = now
+        update_pool_gauges()
+
+
+def _render() -> bytes:
+  if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+  return generate_latest(REGISTRY)
+
+
+async def metrics(request: Request) -> Response:
+  """
+  The metrics in the Prometheus text format, of all the workers.
+  """
+  if settings.METRICS_TOKEN and not secrets.compare_digest(
+    request.headers.get("authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+  ):
+    return Response(status_code=401)
+  update_pool_gauges()
+  # Reading the workers' files is blocking
+  return Response(await run_in_threadpool(_render), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,128 @@
+"""
+SQL query counting per request, to catch N+1 queries.
+
+With QUERY_COUNT_MODE set to "warn" or "raise", every request counts the
+statements it sends to the database, on any engine. A request sending more
+than QUERY_COUNT_THRESHOLD is logged with its most repeated statement, in
+"raise" mode it also fails with TooManyQueries once the response is sent,
+which test clients re-raise. Responses carry the count so far in an
+X-Query-Count header. Meant for development and tests, keep it "off" in
+production. The metrics middleware also counts and times the queries of
+every request, through the same tracking.
+"""
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyQueries(RuntimeError):
+  """
+  A request sent more queries than allowed.
+  """
+
+
+@dataclass
+class QueryCount:
+  """
+  Statements sent while tracking, by SQL text, and the seconds they took.
+  """
+  statements: Counter[str] = field(default_factory=Counter)
+  seconds: float = 0.0
+
+  @property
+  def count(self) -> int:
+    return sum(self.statements.values())
+
+
+_current: ContextVar[QueryCount | None] = ContextVar("query_count", default=None)
+
+
+def _count(conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+  current = _current.get()
+  if current is not None:
+    current.statements[statement] += 1
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _time(conn: Any, *_args: Any) -> None:
+  current = _current.get()
+  # A statement which failed left its start behind, overwritten by the next
+  started = conn.info.pop("query_started", None)
+  if current is not None and started is not None:
+    current.seconds += time.perf_counter() - started
+
+
+def track() -> QueryCount:
+  """
+  Count the queries of the current context from now on, e.g. a test.
+  """
+  if not event.contains(Engine, "before_cursor_execute", _count):
+    event.listen(Engine, "before_cursor_execute", _count)
+    event.listen(Engine, "after_cursor_execute", _time)
+  current = QueryCount()
+  _current.set(current)
+  return current
+
+
+def tracked() -> QueryCount | None:
+  """
+  The query count of the current context, if it is tracked.
+  """
+  return _current.get()
+
+
+def untrack() -> None:
+  """
+  Stop counting the queries of the current context, e.g. in a background
+  job spawned by a request, which isn't part of the request's queries.
+  """
+  _current.set(None)
+
+
+class QueryCountMiddleware:
+  """
+  Count the queries of each HTTP request and report those sending too many.
+  """
+
+  def __init__(self, app: ASGIApp, threshold: int, fail: bool = False) -> None:
+    self.app = app
+    self.threshold = threshold
+    self.fail = fail
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    # Shared with the metrics middleware when it tracks this request already
+    outer = tracked()
+    current = outer or track()
+
+    async def send_with_count(message: Message) -> None:
+      if message["type"] == "http.response.start":
+        MutableHeaders(scope=message)["X-Query-Count"] = str(current.count)
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_with_count)
+    finally:
+      if outer is None:
+        untrack()
+    if current.count > self.threshold:
+      statement, repeats = current.statements.most_common(1)[0]
+      report = (
+        f"{scope['method']} {scope['path']} sent {current.count} queries "
+        f"(threshold {self.threshold}), {repeats} times: {statement}"
+      )
+      logger.warning(report)
+      if self.fail:
+        raise TooManyQueries(report)
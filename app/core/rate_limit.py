@@ -0,0 +1,159 @@
+"""
+Per-user rate limiting with token buckets.
+
+Each user has a bucket per route class (completions, crud), refilled at the
+class's rate up to its burst. A request takes a token or is rejected with a
+429 and a Retry-After header, so one user flooding a class of routes can't
+degrade it for the others.
+
+Buckets live in this worker, in shards each guarded by its own lock, so the
+threads of sync routes rarely wait on each other; idle buckets expire once
+they would be full again. With RATE_LIMIT_REDIS_URL set (and the redis
+package installed) buckets live in Redis instead and are shared by all the
+workers, without it every worker enforces the limits on its own share of
+the traffic. When Redis can't be reached the local buckets are used: its
+calls time out after RATE_LIMIT_REDIS_TIMEOUT_SECONDS, and after a failure
+it is left alone for RATE_LIMIT_REDIS_RETRY_SECONDS, so an unreachable
+Redis doesn't slow down every request.
+"""
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from cachetools import TTLCache
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Limit:
+  """
+  Refill rate, in tokens per second, and capacity of a bucket.
+  """
+  rate: float
+  burst: int
+
+
+LIMITS = {
+  "completions": Limit(
+    settings.RATE_LIMIT_COMPLETIONS_PER_MINUTE / 60, settings.RATE_LIMIT_COMPLETIONS_BURST
+  ),
+  "crud": Limit(settings.RATE_LIMIT_CRUD_PER_MINUTE / 60, settings.RATE_LIMIT_CRUD_BURST),
+}
+
+# Takes a token from the bucket at KEYS[1] and returns the seconds to wait
+# for one when it is empty, using Redis' clock so all workers agree
+REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class LocalBuckets:
+  """
+  Token buckets of this worker, by key, in locked shards.
+  """
+
+  def __init__(self, shards: int, max_keys: int, ttl: float) -> None:
+    self._shards: list[tuple[threading.Lock, TTLCache[str, tuple[float, float]]]] = [
+      (threading.Lock(), TTLCache(maxsize=max(1, max_keys // shards), ttl=ttl))
+      for _ in range(shards)
+    ]
+
+  def take(self, key: str, limit: Limit) -> float:
+    """
+    Take a token, return 0 or the seconds to wait for one.
+    """
+    lock, buckets = self._shards[hash(key) % len(self._shards)]
+    with lock:
+      now = time.monotonic()
+      tokens, updated = buckets.get(key, (float(limit.burst), now))
+      tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+      if tokens >= 1:
+        buckets[key] = (tokens - 1, now)
+        return 0.0
+      buckets[key] = (tokens, now)
+      return (1 - tokens) / limit.rate
+
+
+class RateLimiter:
+  """
+  Token buckets per route class and key, local or in Redis.
+  """
+
+  def __init__(self, enabled: bool, redis_url: str | None) -> None:
+    self.enabled = enabled
+    self.redis_url = redis_url
+    # Idle buckets expire once they'd be full again
+    ttl = max(limit.burst / limit.rate for limit in LIMITS.values())
+    self.local = LocalBuckets(settings.RATE_LIMIT_SHARDS, settings.RATE_LIMIT_MAX_KEYS, ttl)
+    self.rejected = 0
+    self._redis_take: Any = None
+    # Redis isn't tried again before then, after a failure
+    self._redis_retry_at = -math.inf
+
+  def _get_redis_take(self) -> Any:
+    if self._redis_take is None:
+      import redis.asyncio  # pylint: disable=import-outside-toplevel
+
+      client = redis.asyncio.from_url(
+        self.redis_url,
+        socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+        socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+      )
+      self._redis_take = client.register_script(REDIS_TAKE)
+    return self._redis_take
+
+  async def _take(self, key: str, limit: Limit) -> float:
+    if self.redis_url and time.monotonic() >= self._redis_retry_at:
+      try:
+        wait = await self._get_redis_take()(
+          keys=[f"rate_limit:{key}"], args=[limit.rate, limit.burst]
+        )
+        return float(wait)
+      except Exception as e:  # pylint: disable=broad-except
+        self._redis_retry_at = time.monotonic() + settings.RATE_LIMIT_REDIS_RETRY_SECONDS
+        logger.warning(
+          "Rate limiting with local buckets for %ss, Redis failed: %s",
+          settings.RATE_LIMIT_REDIS_RETRY_SECONDS, e,
+        )
+    return self.local.take(key, limit)
+
+  async def check(self, route_class: str, key: str) -> None:
+    """
+    Take a token of key's bucket for route_class, or raise a 429.
+    """
+    if not self.enabled:
+      return
+    wait = await self._take(f"{route_class}:{key}", LIMITS[route_class])
+    if wait > 0:
+      self.rejected += 1
+      raise HTTPException(
+        status_code=429,
+        detail="Too many requests, retry later",
+        headers={"Retry-After": str(math.ceil(wait))},
+      )
+
+
+rate_limiter = RateLimiter(settings.RATE_LIMIT_ENABLED, settings.RATE_LIMIT_REDIS_URL)
@@ -0,0 +1,212 @@
+"""
+Read replica routing.
+
+Read-only requests go to a replica, round robin, unless:
+- the user wrote something in the last REPLICA_STICKINESS_SECONDS, so they
+  keep reading their own writes from the primary;
+- the replica lags more than REPLICA_MAX_LAG_SECONDS behind (or can't be
+  reached), in which case it is skipped until the next lag check.
+
+Recent writes are known from the last_write cookie, which
+ReadYourWritesMiddleware sets on the responses of successful writes: the
+time of the write, signed with SECRET_KEY, so every worker and host (they
+must share SECRET_KEY) honors it. Each worker also remembers the users who
+wrote through it, which covers the clients not keeping cookies as long as
+they hit the same worker; on another one they may not see their own writes
+for up to the replica lag.
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import math
+import time
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from cachetools import TTLCache
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.db import async_connect_args, async_session_factory, pool_options
+from app.core.pool import InstrumentedAsyncAdaptedQueuePool, instrument_engine_pool
+
+logger = logging.getLogger(__name__)
+
+WRITE_COOKIE = "last_write"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Replication lag in seconds, 0 when the replica has replayed everything it received
+LAG_QUERY = text(
+  """
+  SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+  END
+  """
+)
+
+
+@dataclass
+class Replica:
+  """
+  A replica engine and its last measured lag.
+  """
+  engine: AsyncEngine
+  lag: float = float("inf")
+  checked_at: float = 0.0
+  lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+  async def current_lag(self) -> float:
+    """
+    Return the lag, measuring it again when the last probe is too old.
+    """
+    if time.monotonic() - self.checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+      return self.lag
+    async with self.lock:
+      # Another request may have refreshed it while we waited
+      if time.monotonic() - self.checked_at >= settings.REPLICA_LAG_CHECK_SECONDS:
+        try:
+          async with self.engine.connect() as conn:
+            self.lag = float((await conn.execute(LAG_QUERY)).scalar_one())
+        except Exception as e:  # pylint: disable=broad-except
+          logger.warning("Replica %s unavailable: %s", self.engine.url.host, e)
+          self.lag = float("inf")
+        self.checked_at = time.monotonic()
+    return self.lag
+
+
+class ReplicaRouter:
+  """
+  Pick the engine read-only requests should use.
+  """
+
+  def __init__(self, uris: list[str]) -> None:
+    self.replicas = []
+    for index, uri in enumerate(uris):
+      replica_engine = create_async_engine(
+        uri,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        connect_args=async_connect_args(),
+        **pool_options(),
+      )
+      instrument_engine_pool(replica_engine, f"replica-{index}")
+      self.replicas.append(Replica(engine=replica_engine))
+    self._next = itertools.count()
+    self._recent_writers: TTLCache = TTLCache(
+      maxsize=100_000, ttl=settings.REPLICA_STICKINESS_SECONDS
+    )
+
+  def mark_write(self, user_id: uuid.UUID) -> None:
+    """
+    Pin the user's reads to the primary for the stickiness window.
+    """
+    if self.replicas:
+      self._recent_writers[user_id] = True
+
+  async def read_engine(
+    self, user_id: uuid.UUID | None, wrote_recently: bool = False
+  ) -> AsyncEngine | None:
+    """
+    Return a replica engine for the user's reads, or None to use the primary.
+    """
+    if not self.replicas or wrote_recently:
+      return None
+    if user_id is not None and user_id in self._recent_writers:
+      return None
+    start = next(self._next)
+    for offset in range(len(self.replicas)):
+      replica = self.replicas[(start + offset) % len(self.replicas)]
+      if await replica.current_lag() <= settings.REPLICA_MAX_LAG_SECONDS:
+        return replica.engine
+    return None
+
+
+replica_router = ReplicaRouter(settings.replica_async_database_uris)
+
+
+def _signature(value: str) -> str:
+  return hmac.new(
+    settings.SECRET_KEY.encode(), f"{WRITE_COOKIE}={value}".encode(), hashlib.sha256
+  ).hexdigest()
+
+
+def write_cookie_value() -> str:
+  """
+  Signed time of a write, for the last_write cookie.
+  """
+  value = f"{time.time():.3f}"
+  return f"{value}.{_signature(value)}"
+
+
+def wrote_recently(connection: HTTPConnection) -> bool:
+  """
+  Check if the client's last_write cookie is a write of the stickiness window.
+  """
+  cookie = connection.cookies.get(WRITE_COOKIE)
+  if not cookie:
+    return False
+  value, _, signature = cookie.rpartition(".")
+  if not hmac.compare_digest(signature, _signature(value)):
+    return False
+  try:
+    written_at = float(value)
+  except ValueError:
+    return False
+  # Written in the future is clock skew between hosts, still recent
+  return time.time() - written_at < settings.REPLICA_STICKINESS_SECONDS
+
+
+class ReadYourWritesMiddleware:
+  """
+  Set the last_write cookie on the responses of successful writes.
+  """
+
+  def __init__(self, app: ASGIApp) -> None:
+    self.app = app
+    self._attributes = (
+      f"Max-Age={math.ceil(settings.REPLICA_STICKINESS_SECONDS)}; "
+      f"Path={settings.API_V1_STR}; HttpOnly; SameSite=lax"
+    )
+    if settings.ENVIRONMENT != "local":
+      self._attributes += "; Secure"
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+      await self.app(scope, receive, send)
+      return
+
+    async def send_with_cookie(message: Message) -> None:
+      # The session has committed by the time the response starts
+      if message["type"] == "http.response.start" and message["status"] < 400:
+        headers = MutableHeaders(scope=message)
+        headers.append(
+          "set-cookie", f"{WRITE_COOKIE}={write_cookie_value()}; {self._attributes}"
+        )
+      await send(message)
+
+    await self.app(scope, receive, send_with_cookie)
+
+
+@asynccontextmanager
+async def open_read_session(
+  user_id: uuid.UUID | None, wrote_recently: bool = False
+) -> AsyncIterator[AsyncSession]:
+  """
+  Open a session for reads outside of the request dependencies, e.g. in a
+  streamed response body that outlives them.
+  """
+  engine = await replica_router.read_engine(user_id, wrote_recently)
+  factory_kwargs = {"bind": engine} if engine is not None else {}
+  async with async_session_factory(**factory_kwargs) as session:
+    yield session
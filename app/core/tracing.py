@@ -0,0 +1,170 @@
+"""
+Sentry trace sampling.
+
+Tracing every request costs CPU in the workers and Sentry quota, so requests
+are sampled in two steps:
+- at the start, traces_sampler traces a share of the requests of each path:
+  the route's rate (the longest matching prefix of the route rates, else
+  the default rate), raised to the tail rate so enough are traced to keep
+  the slow and failing ones. Routes at rate 0, health checks, metrics and
+  static assets, are never traced. A trace started upstream keeps its
+  parent's decision;
+- at the end, before_send_transaction keeps the traced requests which
+  failed (5xx) or took longer than the slow threshold, and the others
+  with probability route rate / traced rate, so ordinary requests are kept
+  at their route's rate.
+Errors are reported as events whether their request was traced or not.
+
+Rates are read from the settings at startup and changed at runtime with
+PUT /utils/trace-sampling/, which the broadcast applies to the other
+workers (with BROADCAST_ENABLED). A restart goes back to the settings.
+"""
+import logging
+import random
+from datetime import datetime
+from typing import Any
+from urllib.parse import urlsplit
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.broadcast import broadcast
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_TOPIC = "trace_sampling"
+
+FIELDS = ("sample_rate", "tail_rate", "slow_seconds", "route_rates")
+
+# Span statuses of server errors, as Sentry maps 5xx responses and exceptions
+ERROR_STATUSES = frozenset({
+  "internal_error", "unknown_error", "unknown", "unimplemented", "unavailable",
+  "deadline_exceeded", "data_loss",
+})
+
+
+class TraceSampler:
+  """
+  Head and tail sampling decisions of Sentry transactions.
+  """
+
+  def __init__(
+    self,
+    sample_rate: float,
+    tail_rate: float,
+    slow_seconds: float,
+    route_rates: dict[str, float],
+  ) -> None:
+    self.sample_rate = sample_rate
+    self.tail_rate = tail_rate
+    self.slow_seconds = slow_seconds
+    self.route_rates: dict[str, float] = {}
+    self._prefixes: list[tuple[str, float]] = []
+    self._set_route_rates(route_rates)
+
+  def _set_route_rates(self, route_rates: dict[str, float]) -> None:
+    self.route_rates = dict(route_rates)
+    # Longest prefixes first, the most specific rate wins
+    self._prefixes = sorted(route_rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+  def rate(self, path: str) -> float:
+    """
+    Share of the requests of path to keep.
+    """
+    for prefix, rate in self._prefixes:
+      if path.startswith(prefix):
+        return rate
+    return self.sample_rate
+
+  def _traced_rate(self, rate: float) -> float:
+    return max(rate, self.tail_rate) if rate > 0 else 0.0
+
+  def sample(self, sampling_context: dict[str, Any]) -> float:
+    """
+    traces_sampler: share of the requests like this one to trace.
+    """
+    if sampling_context.get("parent_sampled") is not None:
+      return float(sampling_context["parent_sampled"])
+    scope = sampling_context.get("asgi_scope")
+    if scope is None:
+      # Not a request, e.g. a background job
+      return self.sample_rate
+    return self._traced_rate(self.rate(scope.get("path", "")))
+
+  @staticmethod
+  def _failed(event: dict[str, Any]) -> bool:
+    contexts = event.get("contexts", {})
+    status_code = contexts.get("response", {}).get("status_code")
+    if isinstance(status_code, int) and status_code >= 500:
+      return True
+    return contexts.get("trace", {}).get("status") in ERROR_STATUSES
+
+  def keep(self, event: dict[str, Any], _hint: dict[str, Any]) -> dict[str, Any] | None:
+    """
+    before_send_transaction: the transaction, or None to drop it.
+    """
+    trace = event.get("contexts", {}).get("trace", {})
+    if trace.get("parent_span_id"):
+      return event
+    if self._failed(event):
+      return event
+    try:
+      duration = (
+        datetime.fromisoformat(event["timestamp"])
+        - datetime.fromisoformat(event["start_timestamp"])
+      ).total_seconds()
+    except (KeyError, TypeError, ValueError):
+      duration = 0.0
+    if duration >= self.slow_seconds:
+      return event
+    url = event.get("request", {}).get("url")
+    if url is None:
+      return event
+    rate = self.rate(urlsplit(url).path)
+    traced = self._traced_rate(rate)
+    if traced and random.random() < rate / traced:
+      return event
+    return None
+
+  def config(self) -> dict[str, Any]:
+    """
+    The current rates and threshold.
+    """
+    return {name: getattr(self, name) for name in FIELDS}
+
+  def update(self, changes: dict[str, Any]) -> None:
+    """
+    Change some of the rates and threshold in this worker.
+    """
+    for name, value in changes.items():
+      if name == "route_rates":
+        self._set_route_rates(value)
+      elif name in FIELDS:
+        setattr(self, name, value)
+    logger.info("Trace sampling changed: %s", changes)
+
+  @staticmethod
+  async def publish(session: AsyncSession, changes: dict[str, Any]) -> None:
+    """
+    Send changes to the other workers, once the session commits. Update
+    this worker after the commit.
+    """
+    await broadcast.publish(session, BROADCAST_TOPIC, changes)
+
+
+trace_sampler = TraceSampler(
+  sample_rate=settings.SENTRY_TRACES_SAMPLE_RATE,
+  tail_rate=settings.SENTRY_TRACES_TAIL_RATE,
+  slow_seconds=settings.SENTRY_TRACES_SLOW_SECONDS,
+  route_rates=settings.SENTRY_TRACES_ROUTE_RATES,
+)
+
+
+def _on_broadcast(payload: dict[str, Any] | None) -> None:
+  # Changes missed while reconnecting can't be recovered, but every change
+  # carries the whole config: the next one brings all the workers in line
+  if payload is not None:
+    trace_sampler.update(payload)
+
+
+broadcast.subscribe(BROADCAST_TOPIC, _on_broadcast)
@@ -0,0 +1,112 @@
+"""
+Cache of authenticated users.
+
+get_current_user would otherwise read the user on every request. Active
+users are cached by id for USER_CACHE_TTL_SECONDS; routes changing a user
+(profile, password, activation, deletion) invalidate the entry after commit,
+and in the other workers through the broadcast. Without BROADCAST_ENABLED,
+other workers may see a change up to USER_CACHE_TTL_SECONDS late.
+
+Entries are column snapshots, not ORM objects: each request gets its own
+User, attached to its session as if it had been loaded.
+"""
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from cachetools import TTLCache
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.broadcast import broadcast
+from app.core.config import settings
+from app.core.versions import KeyVersions, Version
+from app.models import User
+
+BROADCAST_TOPIC = "user"
+
+
+class UserCache:
+  """
+  TTL cache of user column values by id.
+  """
+
+  def __init__(self, maxsize: int, ttl: float) -> None:
+    self._cache: TTLCache[uuid.UUID, dict[str, Any]] = TTLCache(maxsize=maxsize, ttl=ttl)
+    # Invalidations of the users being read, a read that raced with one isn't cached
+    self._versions = KeyVersions()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, session: AsyncSession, user_id: uuid.UUID) -> User | None:
+    """
+    Return the cached user attached to the session, or None.
+    """
+    values = self._cache.get(user_id)
+    if values is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    user = User(**values)
+    # Persistent without a query, updates and deletes work as usual
+    make_transient_to_detached(user)
+    session.add(user)
+    return user
+
+  @contextmanager
+  def reading(self, user_id: uuid.UUID) -> Iterator[Version]:
+    """
+    Read the user from the database inside, then put it with the version.
+    """
+    with self._versions.reading(user_id) as version:
+      yield version
+
+  def put(self, user: User, version: Version) -> None:
+    """
+    Cache a user, unless it was invalidated since version was taken.
+    """
+    if self._versions.current(version) and user.is_active:
+      self._cache[user.id] = {
+        name: getattr(user, name) for name in User.__table__.columns.keys()  # type: ignore[attr-defined]
+      }
+
+  def invalidate(self, user_id: uuid.UUID | None = None) -> None:
+    """
+    Drop a user, or all of them.
+    """
+    if user_id is None:
+      self._versions.bump_all()
+      self._cache.clear()
+    else:
+      self._versions.bump(user_id)
+      self._cache.pop(user_id, None)
+
+  def stats(self) -> dict[str, Any]:
+    """
+    Cache size and hit counters.
+    """
+    return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(
+  maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS
+)
+
+
+async def publish_change(session: AsyncSession, user_id: uuid.UUID) -> None:
+  """
+  Have the other workers drop a user once the session's transaction commits.
+  Call it before the commit, and user_cache.invalidate after it.
+  """
+  await broadcast.publish(session, BROADCAST_TOPIC, {"user_id": str(user_id)})
+
+
+def _on_broadcast(payload: dict[str, Any] | None) -> None:
+  if payload is None:
+    user_cache.invalidate()
+  else:
+    user_cache.invalidate(uuid.UUID(payload["user_id"]))
+
+
+broadcast.subscribe(BROADCAST_TOPIC, _on_broadcast)
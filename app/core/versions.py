@@ -0,0 +1,71 @@
+"""
+Per-key change counters guarding cache fills against races.
+
+A cache miss reads the database, awaits, then stores what it read. If the
+key changed meanwhile, what was read may be stale and mustn't be stored.
+Only the changes of the key being read matter: a change of another key,
+or a full invalidation, doesn't discard it unless it covers that key.
+
+Counters only exist while a read of their key is in flight, so they don't
+grow with the number of keys.
+"""
+from collections import Counter
+from collections.abc import Hashable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass(frozen=True)
+class Version:
+  """
+  The version of a key when a read of it started.
+  """
+  key: Any
+  epoch: int
+  count: int
+
+
+class KeyVersions:
+  """
+  Change counters of the keys being read.
+  """
+
+  def __init__(self) -> None:
+    # Bumped by full invalidations, which change every key
+    self._epoch = 0
+    self._counts: dict[Hashable, int] = {}
+    self._readers: Counter[Hashable] = Counter()
+
+  @contextmanager
+  def reading(self, key: Hashable) -> Iterator[Version]:
+    """
+    Track the changes of key while reading it, yield its current version.
+    """
+    self._readers[key] += 1
+    try:
+      yield Version(key, self._epoch, self._counts.get(key, 0))
+    finally:
+      self._readers[key] -= 1
+      if not self._readers[key]:
+        del self._readers[key]
+        self._counts.pop(key, None)
+
+  def current(self, version: Version) -> bool:
+    """
+    Check if the key didn't change since version was taken.
+    """
+    return version.epoch == self._epoch and version.count == self._counts.get(version.key, 0)
+
+  def bump(self, key: Hashable) -> None:
+    """
+    Record a change of key.
+    """
+    if key in self._readers:
+      self._counts[key] = self._counts.get(key, 0) + 1
+
+  def bump_all(self) -> None:
+    """
+    Record a change of every key.
+    """
+    self._epoch += 1
@@ -2,12 +2,17 @@
 This module contains the CRUD (Create, Read, Update, Delete) operations for the database.
 """
 import uuid
+from datetime import datetime
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import tuple_
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import SelectOfScalar
 
+from app.core.hashing import password_hasher
 from app.core.security import get_password_hash, verify_password
-from app.models import Item, ItemCreate, User, UserCreate, UserUpdate
+from app.models import Item, ItemCreate, Message, User, UserCreate, UserUpdate
 
 
 def create_user(*, session: Session, user_create: UserCreate) -> User:
@@ -70,3 +75,143 @@ def create_item(*, session: Session, item_in: ItemCreate, owner_id: uuid.UUID) -
   session.commit()
   session.refresh(db_item)
   return db_item
+
+
+# Async versions of the helpers above, used by the API routes. The sync ones
+# stay for init_db and the scripts that run outside of the event loop.
+
+
+async def create_user_async(*, session: AsyncSession, user_create: UserCreate) -> User:
+  """
+  Create a new user in the database.
+  """
+  hashed_password = await password_hasher.hash(user_create.password)
+  db_obj = User.model_validate(user_create, update={"hashed_password": hashed_password})
+  session.add(db_obj)
+  await session.commit()
+  await session.refresh(db_obj)
+  return db_obj
+
+
+async def update_user_async(*, session: AsyncSession, db_user: User, user_in: UserUpdate) -> Any:
+  """
+  Update a user in the database.
+  """
+  user_data = user_in.model_dump(exclude_unset=True)
+  extra_data = {}
+  if "password" in user_data:
+    password = user_data["password"]
+    hashed_password = await password_hasher.hash(password)
+    extra_data["hashed_password"] = hashed_password
+  db_user.sqlmodel_update(user_data, update=extra_data)
+  session.add(db_user)
+  await session.commit()
+  await session.refresh(db_user)
+  return db_user
+
+
+async def get_user_by_email_async(*, session: AsyncSession, email: str) -> User | None:
+  """
+  Get a user from the database by email.
+  """
+  statement = select(User).where(User.email == email)
+  session_user = (await session.exec(statement)).first()
+  return session_user
+
+
+async def authenticate_async(*, session: AsyncSession, email: str, password: str) -> User | None:
+  """
+  Authenticate a user by email and password.
+  """
+  db_user = await get_user_by_email_async(session=session, email=email)
+  if not db_user:
+    return None
+  if not await password_hasher.verify(password, db_user.hashed_password):
+    return None
+  return db_user
+
+
+async def create_item_async(
+  *, session: AsyncSession, item_in: ItemCreate, owner_id: uuid.UUID
+) -> Item:
+  """
+  Create a new item in the database.
+  """
+  db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
+  session.add(db_item)
+  await session.commit()
+  await session.refresh(db_item)
+  return db_item
+
+
+# Position of a message in its chat's history: messages are ordered by
+# created_at, then id, as several may share a timestamp
+MessageKey = tuple[datetime, uuid.UUID]
+
+
+def chat_messages_statement(
+  *,
+  chat_id: uuid.UUID,
+  after: datetime | MessageKey | None = None,
+  before: datetime | MessageKey | None = None,
+  tail: int | None = None,
+  limit: int | None = None,
+) -> SelectOfScalar[Message]:
+  """
+  Build the query for a range of a chat's messages, served by the
+  (chat_id, created_at) index.
+
+  after and before are times, or message keys to page from a message
+  without skipping the others of its timestamp. Without tail the range is
+  returned oldest first, from after up to before. With tail the newest
+  messages come first, callers reverse them.
+  """
+  statement = select(Message).where(Message.chat_id == chat_id)
+  key = tuple_(col(Message.created_at), col(Message.id))
+  if isinstance(after, tuple):
+    # The created_at bound alone is what the index can seek on
+    statement = statement.where(col(Message.created_at) >= after[0], key > tuple_(*after))
+  elif after is not None:
+    statement = statement.where(Message.created_at > after)
+  if isinstance(before, tuple):
+    statement = statement.where(col(Message.created_at) <= before[0], key < tuple_(*before))
+  elif before is not None:
+    statement = statement.where(Message.created_at < before)
+  if tail is not None:
+    statement = statement.order_by(
+      col(Message.created_at).desc(), col(Message.id).desc()
+    ).limit(tail)
+  else:
+    statement = statement.order_by(col(Message.created_at), col(Message.id))
+    if limit is not None:
+      statement = statement.limit(limit)
+  return statement
+
+
+async def get_chat_messages_async(
+  *,
+  session: AsyncSession,
+  chat_id: uuid.UUID,
+  after: datetime | MessageKey | None = None,
+  before: datetime | MessageKey | None = None,
+  tail: int | None = None,
+  limit: int = 100,
+) -> tuple[list[Message], bool]:
+  """
+  Get a range of a chat's messages, oldest first, and whether more
+  messages exist past the range (older ones for tail, newer ones otherwise).
+  """
+  size = tail if tail is not None else limit
+  statement = chat_messages_statement(
+    chat_id=chat_id,
+    after=after,
+    before=before,
+    tail=size + 1 if tail is not None else None,
+    limit=size + 1,
+  )
+  messages = list((await session.exec(statement)).all())
+  has_more = len(messages) > size
+  messages = messages[:size]
+  if tail is not None:
+    messages.reverse()
+  return messages, has_more
@@ -0,0 +1,171 @@
+"""
+Serving of the built frontend.
+
+Assets under /assets are served by AssetFiles:
+- files Vite named after their content hash (name-<hash>.ext, directly in
+  the assets directory) never change, they are cached for a year as
+  immutable. The files copied from frontend/public keep their name and are
+  revalidated with their ETag instead;
+- a precompressed name.br or name.gz next to a file is sent instead of it
+  to clients accepting that encoding. They are created after the build by
+  `python -m app.frontend frontend/dist`, .br only when the brotli package
+  is installed.
+
+index.html, the shell of every SPA route, is read once and served from
+memory by IndexPage, compressed and with an ETag. In the local environment
+it is read again when the file changes, for frontend rebuilds.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Any
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from app.core.compression import accepted_encodings
+
+try:
+  import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+  brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Vite's output file names: name-<8 characters hash>.ext
+HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+COMPRESSIBLE = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".wasm"}
+# Smaller files aren't worth compressing
+MIN_COMPRESS_BYTES = 1_024
+
+# Preferred encodings first, with the suffix of their precompressed files
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+class AssetFiles(StaticFiles):
+  """
+  StaticFiles sending precompressed variants and long-lived cache headers.
+  """
+
+  def __init__(self, *, directory: str | Path, **kwargs: Any) -> None:
+    super().__init__(directory=directory, **kwargs)
+    # Served paths are resolved, so is the directory they're compared to
+    self.real_directory = os.path.realpath(directory)
+
+  def file_response(
+    self,
+    full_path: "os.PathLike[str] | str",
+    stat_result: os.stat_result,
+    scope: Scope,
+    status_code: int = 200,
+  ) -> Response:
+    path = str(full_path)
+    accepted = accepted_encodings(Headers(scope=scope))
+    response = None
+    for encoding, suffix in ENCODINGS:
+      if encoding not in accepted:
+        continue
+      try:
+        variant_stat = os.stat(path + suffix)
+      except OSError:
+        continue
+      # Its type is guessed from the original's extension, e.g. .js.br
+      response = super().file_response(path + suffix, variant_stat, scope, status_code)
+      if response.status_code != 304:
+        response.headers["Content-Encoding"] = encoding
+      break
+    if response is None:
+      response = super().file_response(full_path, stat_result, scope, status_code)
+    hashed = os.path.dirname(path) == self.real_directory and HASHED_NAME.search(path)
+    response.headers["Cache-Control"] = IMMUTABLE if hashed else REVALIDATE
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+class IndexPage:
+  """
+  index.html kept in memory, with its compressed variants and ETag.
+  """
+
+  def __init__(self, path: str | Path, reload: bool = False) -> None:
+    self.path = Path(path)
+    self.reload = reload
+    self.mtime: float | None = None
+    self.bodies: dict[str, bytes] = {}
+    self.etag = ""
+
+  def load(self) -> None:
+    """
+    Read and compress the page.
+    """
+    self.mtime = self.path.stat().st_mtime
+    html = self.path.read_bytes()
+    self.bodies = {"identity": html, "gzip": gzip.compress(html, compresslevel=9, mtime=0)}
+    if brotli is not None:
+      self.bodies["br"] = brotli.compress(html)
+    self.etag = f'"{hashlib.blake2b(html, digest_size=12).hexdigest()}"'
+
+  def response(self, request: Request) -> Response:
+    """
+    Response to a request of the page.
+    """
+    if self.mtime is None or (self.reload and self.path.stat().st_mtime != self.mtime):
+      self.load()
+    headers = {"ETag": self.etag, "Cache-Control": REVALIDATE, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if self.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+      return Response(status_code=304, headers=headers)
+    accepted = accepted_encodings(request.headers)
+    for encoding, _ in ENCODINGS:
+      if encoding in accepted and encoding in self.bodies:
+        headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type="text/html", headers=headers)
+    return Response(self.bodies["identity"], media_type="text/html", headers=headers)
+
+
+def precompress(directory: str | Path) -> int:
+  """
+  Write the .gz (and .br) variants of the compressible files of a build
+  which don't have up to date ones yet. Returns how many were written.
+  """
+  written = 0
+  for path in Path(directory).rglob("*"):
+    if not path.is_file() or path.suffix not in COMPRESSIBLE:
+      continue
+    stat = path.stat()
+    if stat.st_size < MIN_COMPRESS_BYTES:
+      continue
+    data = None
+    for encoding, suffix in ENCODINGS:
+      if encoding == "br" and brotli is None:
+        continue
+      variant = path.with_name(path.name + suffix)
+      if variant.exists() and variant.stat().st_mtime >= stat.st_mtime:
+        continue
+      data = path.read_bytes() if data is None else data
+      if encoding == "br":
+        compressed = brotli.compress(data)
+      else:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+      # Only worth it if smaller
+      if len(compressed) < len(data):
+        variant.write_bytes(compressed)
+        written += 1
+  return written
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Precompress a frontend build.")
+  parser.add_argument("directory", nargs="?", default="frontend/dist")
+  args = parser.parse_args()
+  if brotli is None:
+    print("brotli isn't installed, only writing .gz files", file=sys.stderr)
+  print(f"Wrote {precompress(args.directory)} compressed files")
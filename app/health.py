@@ -0,0 +1,165 @@
+"""
+Liveness and readiness of a worker.
+
+A worker is live as long as its event loop answers, the liveness route
+checks nothing else. It is ready when it can serve requests:
+- database: a pooled connection to the primary answers within
+  HEALTH_CHECK_TIMEOUT_SECONDS;
+- migrations: the database is at the migration head of this code. A
+  database migrated further by a newer release is fine, so the old
+  workers keep serving during rolling deploys;
+- frontend: the built index.html is there to serve the SPA routes;
+- large_model: the default large model is configured;
+- replicas: how many replicas are usable for reads.
+Only the first two are critical, they make the worker unready and the load
+balancer stop sending it traffic. The others are reported, a worker without
+them still serves most of the API and every worker would fail them alike.
+
+Probes run at most every HEALTH_CHECK_CACHE_SECONDS, polls in between get
+the last results, so frequent polling costs no queries.
+"""
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import text
+
+import LargeModel
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.replicas import replica_router
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class Check:
+  """
+  Result of a probe.
+  """
+  name: str
+  ok: bool
+  critical: bool
+  detail: str | None = None
+
+
+def migration_revisions() -> tuple[set[str], set[str]]:
+  """
+  Head revisions and all the revisions of the migrations of this code.
+  """
+  # pylint: disable=import-outside-toplevel
+  from alembic.config import Config
+  from alembic.script import ScriptDirectory
+
+  config = Config(str(ROOT / "alembic.ini"))
+  config.set_main_option("script_location", str(ROOT / "app" / "alembic"))
+  script = ScriptDirectory.from_config(config)
+  return set(script.get_heads()), {r.revision for r in script.walk_revisions()}
+
+
+class Readiness:
+  """
+  Cached readiness probes of this worker.
+  """
+
+  def __init__(self) -> None:
+    self.checks: list[Check] = []
+    self.checked_at = -math.inf
+    self.checked_at_time: datetime | None = None
+    self._revisions: tuple[set[str], set[str]] | None = None
+    self._lock: asyncio.Lock | None = None
+
+  async def _check_database(self) -> list[Check]:
+    if self._revisions is None:
+      self._revisions = await asyncio.to_thread(migration_revisions)
+    heads, known = self._revisions
+    try:
+      async with asyncio.timeout(settings.HEALTH_CHECK_TIMEOUT_SECONDS):
+        async with async_engine.connect() as conn:
+          result = await conn.execute(text("SELECT version_num FROM alembic_version"))
+          revisions = set(result.scalars())
+    except Exception as e:  # pylint: disable=broad-except
+      # The route is public, the error only goes to the logs
+      logger.warning("Readiness: database unavailable: %s", e)
+      return [
+        Check("database", False, True, type(e).__name__),
+        Check("migrations", False, True, "Database unavailable"),
+      ]
+    database = Check("database", True, True)
+    if revisions == heads:
+      return [database, Check("migrations", True, True)]
+    detail = (
+      f"Database at {', '.join(sorted(revisions)) or 'no revision'}, "
+      f"code at {', '.join(sorted(heads))}"
+    )
+    # Revisions this code doesn't know come from a newer release
+    ahead = bool(revisions - known)
+    return [database, Check("migrations", ahead, True, detail)]
+
+  @staticmethod
+  def _check_frontend() -> Check:
+    index = Path(settings.BUILD_PATH) / "index.html"
+    if index.is_file():
+      return Check("frontend", True, False)
+    return Check("frontend", False, False, f"{index} not found")
+
+  @staticmethod
+  def _check_large_model() -> Check:
+    try:
+      if LargeModel.load().available():
+        return Check("large_model", True, False)
+      return Check("large_model", False, False, "Not configured")
+    except ImportError as e:
+      logger.warning("Readiness: large model unavailable: %s", e)
+      return Check("large_model", False, False, "Not installed")
+
+  @staticmethod
+  async def _check_replicas() -> Check:
+    if not replica_router.replicas:
+      return Check("replicas", True, False, "None configured")
+    lags = await asyncio.gather(*(r.current_lag() for r in replica_router.replicas))
+    usable = sum(lag <= settings.REPLICA_MAX_LAG_SECONDS for lag in lags)
+    return Check("replicas", usable > 0, False, f"{usable} of {len(lags)} usable")
+
+  async def probe(self) -> list[Check]:
+    """
+    Return the checks, probing again when the last ones are too old.
+    """
+    if time.monotonic() - self.checked_at < settings.HEALTH_CHECK_CACHE_SECONDS:
+      return self.checks
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    async with self._lock:
+      # Another poll may have probed while we waited
+      if time.monotonic() - self.checked_at >= settings.HEALTH_CHECK_CACHE_SECONDS:
+        self.checks = [
+          *await self._check_database(),
+          self._check_frontend(),
+          # Its first call imports the provider's SDK
+          await asyncio.to_thread(self._check_large_model),
+          await self._check_replicas(),
+        ]
+        self.checked_at = time.monotonic()
+        self.checked_at_time = datetime.utcnow()
+    return self.checks
+
+  async def status(self) -> dict[str, Any]:
+    """
+    Readiness and the checks it was decided on.
+    """
+    checks = await self.probe()
+    return {
+      "ready": all(check.ok for check in checks if check.critical),
+      "checked_at": self.checked_at_time,
+      "checks": [vars(check) for check in checks],
+    }
+
+
+readiness = Readiness()
@@ -0,0 +1,143 @@
+"""
+Storage of message content.
+
+The message table only keeps a preview of the content (PREVIEW_LENGTH
+characters) with its full length, so listing messages stays cheap however
+long the answers get. The full content of longer messages is stored in
+MessageBody, zlib compressed from MESSAGE_COMPRESS_THRESHOLD bytes, and is
+only read for a message's detail and the chat history.
+"""
+import uuid
+import zlib
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+from sqlalchemy import delete, insert
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models import Message, MessageBody, MessageCreate, MessagePublic
+
+# Same as the length of the message.content column
+PREVIEW_LENGTH = 255
+
+# Encoded body: data and whether it is compressed
+EncodedBody = tuple[bytes, bool]
+
+
+def encode_body(content: str) -> EncodedBody:
+  """
+  Encode a content for MessageBody, compressing it when large enough and
+  worth it.
+  """
+  data = content.encode()
+  if len(data) >= settings.MESSAGE_COMPRESS_THRESHOLD:
+    compressed = zlib.compress(data)
+    if len(compressed) < len(data):
+      return compressed, True
+  return data, False
+
+
+def decode_body(body: MessageBody) -> str:
+  """
+  Return the content stored in a MessageBody.
+  """
+  data = zlib.decompress(body.data) if body.compressed else body.data
+  return data.decode()
+
+
+def split_content(content: str) -> tuple[dict[str, Any], EncodedBody | None]:
+  """
+  Return the message columns for a content, and its encoded body when the
+  content doesn't fit the preview.
+  """
+  fields = {
+    "content": content[:PREVIEW_LENGTH],
+    "content_length": len(content),
+    "truncated": len(content) > PREVIEW_LENGTH,
+  }
+  return fields, encode_body(content) if fields["truncated"] else None
+
+
+def body_row(message_id: uuid.UUID, body: EncodedBody) -> dict[str, Any]:
+  """
+  MessageBody row, for bulk inserts.
+  """
+  data, compressed = body
+  return {"message_id": message_id, "data": data, "compressed": compressed}
+
+
+def new_message(message_in: MessageCreate) -> tuple[Message, MessageBody | None]:
+  """
+  Build a message and, for long content, its body.
+  """
+  fields, body = split_content(message_in.content)
+  message = Message.model_validate(message_in, update=fields)
+  if body is None:
+    return message, None
+  return message, MessageBody(**body_row(message.id, body))
+
+
+async def set_content(session: AsyncSession, message: Message, content: str) -> None:
+  """
+  Replace the content of a message and its body, in the session.
+  """
+  fields, body = split_content(content)
+  message.sqlmodel_update(fields)
+  stored = await session.get(MessageBody, message.id)
+  if body is None:
+    if stored is not None:
+      await session.delete(stored)
+  elif stored is None:
+    session.add(MessageBody(**body_row(message.id, body)))
+  else:
+    stored.data, stored.compressed = body
+    session.add(stored)
+
+
+async def replace_bodies(
+  session: AsyncSession, bodies: dict[uuid.UUID, EncodedBody | None]
+) -> None:
+  """
+  Replace the bodies of many messages whose content changed, None for
+  contents which now fit the preview.
+  """
+  if not bodies:
+    return
+  await session.execute(
+    delete(MessageBody).where(col(MessageBody.message_id).in_(list(bodies)))
+  )
+  rows = [body_row(message_id, body) for message_id, body in bodies.items() if body]
+  if rows:
+    await session.execute(insert(MessageBody), rows)
+
+
+async def full_contents(
+  session: AsyncSession, messages: Iterable[Message]
+) -> dict[uuid.UUID, str]:
+  """
+  Load the full content of the truncated messages, with a single query.
+  """
+  ids = [message.id for message in messages if message.truncated]
+  if not ids:
+    return {}
+  statement = select(MessageBody).where(col(MessageBody.message_id).in_(ids))
+  return {body.message_id: decode_body(body) for body in await session.exec(statement)}
+
+
+async def with_full_content(
+  session: AsyncSession, messages: Sequence[Message]
+) -> list[MessagePublic]:
+  """
+  Return messages with their full content.
+  """
+  contents = await full_contents(session, messages)
+  return [
+    MessagePublic.model_validate(
+      message, update={"content": contents[message.id], "truncated": False}
+    )
+    if message.id in contents
+    else MessagePublic.model_validate(message)
+    for message in messages
+  ]
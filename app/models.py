@@ -4,9 +4,12 @@ The schema is used to validate the data that is sent to the application.
 """
 from datetime import datetime
 import uuid
+from typing import Annotated, Any
 
 from pydantic import EmailStr
-from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel import JSON, Field, Index, Relationship, SQLModel, Text
+
+from app.core.config import settings
 
 
 # Shared properties
@@ -69,10 +72,19 @@ class User(UserBase, table=True):
   """
   id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
   hashed_password: str
-  items: list["Item"] = Relationship(back_populates="owner", cascade_delete=True)
-  organizations: list["Organization"] = Relationship(back_populates="owner", cascade_delete=True)
-  templates: list["Template"] = Relationship(back_populates="owner", cascade_delete=True)
-  chats: list["Chat"] = Relationship(back_populates="owner", cascade_delete=True)
+  # Deleted by the database's ON DELETE CASCADE, without being loaded first
+  items: list["Item"] = Relationship(
+    back_populates="owner", cascade_delete=True, passive_deletes=True
+  )
+  organizations: list["Organization"] = Relationship(
+    back_populates="owner", cascade_delete=True, passive_deletes=True
+  )
+  templates: list["Template"] = Relationship(
+    back_populates="owner", cascade_delete=True, passive_deletes=True
+  )
+  chats: list["Chat"] = Relationship(
+    back_populates="owner", cascade_delete=True, passive_deletes=True
+  )
 
 
 class UserPublic(UserBase):
@@ -123,6 +135,9 @@ class Organization(OrganizationBase, table=True):
     foreign_key="user.id", nullable=False, ondelete="CASCADE"
   )
   owner: User | None = Relationship(back_populates="organizations")
+  updated_at: datetime = Field(
+    default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
+  )
 
 
 class OrganizationPublic(OrganizationBase):
@@ -280,6 +295,9 @@ class Template(TemplateBase, table=True):
     foreign_key="user.id", nullable=False, ondelete="CASCADE"
   )
   owner: User | None = Relationship(back_populates="templates")
+  updated_at: datetime = Field(
+    default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
+  )
 
 
 class TemplatePublic(TemplateBase):
@@ -332,9 +350,19 @@ class Chat(ChatBase, table=True):
     foreign_key="user.id", nullable=False, ondelete="CASCADE"
   )
   owner: User | None = Relationship(back_populates="chats")
-  messages: list["Message"] = Relationship(back_populates="chat", cascade_delete=True)
+  template: Template | None = Relationship()
+  messages: list["Message"] = Relationship(
+    back_populates="chat", cascade_delete=True, passive_deletes=True
+  )
   created_at: datetime = Field(default_factory=datetime.utcnow)
-  updated_at: datetime = Field(default_factory=datetime.utcnow)
+  # Bumped by every update, ETags of the chat routes derive from it
+  updated_at: datetime = Field(
+    default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
+  )
+  # Rolling summary of the messages created up to summary_until, maintained
+  # by a background job and sent to the model instead of those messages
+  summary: str | None = Field(default=None, sa_type=Text)
+  summary_until: datetime | None = None
 
 
 class ChatPublic(ChatBase):
@@ -344,6 +372,13 @@ class ChatPublic(ChatBase):
   id: uuid.UUID | None = None
 
 
+class ChatDetailPublic(ChatPublic):
+  """
+  A single chat, with its summary, which lists leave out for their size
+  """
+  summary: str | None = None
+
+
 class ChatsPublic(SQLModel):
   """
   Properties to return via API, id is always required
@@ -357,14 +392,14 @@ class MessageBase(SQLModel):
   This is the schema for the message
   """
   role: str = Field(max_length=255)
-  content: str = Field(max_length=255)
+  content: str = Field(max_length=settings.MESSAGE_MAX_LENGTH)
 
 
 class MessageCreate(MessageBase):
   """
   Properties to receive on item creation
   """
-  pass
+  chat_id: uuid.UUID
 
 
 class MessageUpdate(MessageBase):
@@ -372,16 +407,22 @@ class MessageUpdate(MessageBase):
   Properties to receive on item update
   """
   role: str | None = Field(default=None, min_length=1, max_length=255)  # type: ignore
-  content: str | None = Field(default=None, max_length=255)
+  content: str | None = Field(default=None, max_length=settings.MESSAGE_MAX_LENGTH)
 
 
 class Message(MessageBase, table=True):
   """
   Database model, database table inferred from class name
   """
+  # Chat history is always read as a created_at range of one chat
+  __table_args__ = (Index("ix_message_chat_id_created_at", "chat_id", "created_at"),)
+
   id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
   role: str = Field(max_length=255)
+  # Preview of the content, the full content of longer messages is in MessageBody
   content: str = Field(max_length=255)
+  content_length: int = 0
+  truncated: bool = False
   chat_id: uuid.UUID = Field(
     foreign_key="chat.id", nullable=False, ondelete="CASCADE"
   )
@@ -389,11 +430,30 @@ class Message(MessageBase, table=True):
   created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class MessageBody(SQLModel, table=True):
+  """
+  Full content of a message longer than its preview, kept out of the message
+  table so lists don't read it
+  """
+  message_id: uuid.UUID = Field(
+    foreign_key="message.id", primary_key=True, ondelete="CASCADE"
+  )
+  # UTF-8 content, zlib compressed when compressed is set
+  data: bytes
+  compressed: bool = False
+
+
 class MessagePublic(MessageBase):
   """
   Properties to return via API, id is always required
   """
   id: uuid.UUID | None = None
+  chat_id: uuid.UUID | None = None
+  created_at: datetime | None = None
+  content_length: int | None = None
+  # Set when content is only a preview, the full content is returned by
+  # GET /messages/{id} and the chat history
+  truncated: bool = False
 
 
 class MessagesPublic(SQLModel):
@@ -404,6 +464,16 @@ class MessagesPublic(SQLModel):
   count: int
 
 
+class ChatMessagesPublic(SQLModel):
+  """
+  A page of a chat's history, oldest first
+  """
+  data: list[MessagePublic]
+  has_more: bool
+  # Pass it as cursor to get the next page, when has_more
+  next_cursor: str | None = None
+
+
 # All Completion models
 class CompletionInput(SQLModel):
   """
@@ -451,6 +521,9 @@ class Item(ItemBase, table=True):
       foreign_key="user.id", nullable=False, ondelete="CASCADE"
   )
   owner: User | None = Relationship(back_populates="items")
+  updated_at: datetime = Field(
+    default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
+  )
 
 
 # Properties to return via API, id is always required
@@ -485,6 +558,142 @@ class TokenPayload(SQLModel):
   sub: str | None = None
 
 
+class BulkRowError(SQLModel):
+  """
+  Why a row of a bulk request was rejected, index is its position in the request
+  """
+  index: int
+  errors: list[dict[str, Any]]
+
+
+class BulkResult(SQLModel):
+  """
+  Ids of the rows written by a bulk request and the rows that were rejected
+  """
+  ids: list[uuid.UUID]
+  count: int
+  errors: list[BulkRowError]
+
+
+class ImportResult(SQLModel):
+  """
+  Number of rows imported per record type
+  """
+  organization: int
+  template: int
+  chat: int
+  message: int
+
+
+class DatabasePoolStatus(SQLModel):
+  """
+  Live counters and checkout statistics of a database connection pool
+  """
+  name: str
+  size: int
+  checked_in: int
+  checked_out: int
+  overflow: int
+  waiters: int
+  timeouts: int
+  checkout: dict[str, float]
+  wait: dict[str, float]
+
+
+class PasswordHashingStatus(SQLModel):
+  """
+  Queue state, rejection counters and latencies of the password hashing pool
+  """
+  workers: int
+  pending: int
+  rejected: int
+  timeouts: int
+  hash: dict[str, float]
+  verify: dict[str, float]
+
+
+class HealthCheck(SQLModel):
+  """
+  Result of a readiness probe, critical ones decide readiness
+  """
+  name: str
+  ok: bool
+  critical: bool
+  detail: str | None = None
+
+
+class ReadinessStatus(SQLModel):
+  """
+  Readiness of a worker and the probes it was decided on
+  """
+  ready: bool
+  checked_at: datetime | None
+  checks: list[HealthCheck]
+
+
+class TraceSampling(SQLModel):
+  """
+  Trace sampling rates, by default and by path prefix, and slow threshold
+  """
+  sample_rate: float = Field(ge=0, le=1)
+  tail_rate: float = Field(ge=0, le=1)
+  slow_seconds: float = Field(gt=0)
+  route_rates: dict[str, float]
+
+
+class TraceSamplingUpdate(SQLModel):
+  """
+  Trace sampling changes, the rates given replace the current ones
+  """
+  sample_rate: float | None = Field(default=None, ge=0, le=1)
+  tail_rate: float | None = Field(default=None, ge=0, le=1)
+  slow_seconds: float | None = Field(default=None, gt=0)
+  route_rates: dict[str, Annotated[float, Field(ge=0, le=1)]] | None = None
+
+
+class EmailOutbox(SQLModel, table=True):
+  """
+  Email waiting to be sent, deleted once it is
+  """
+  # The sender reads the due emails, oldest first
+  __table_args__ = (Index("ix_emailoutbox_failed_next_attempt_at", "failed", "next_attempt_at"),)
+
+  id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+  email_to: str = Field(max_length=255)
+  # Rendered when sent, secrets (reset tokens) are only made then. The
+  # context is cleared when the email is given up
+  template_name: str = Field(max_length=255)
+  context: dict[str, Any] = Field(default_factory=dict, sa_type=JSON)
+  created_at: datetime = Field(default_factory=datetime.utcnow)
+  attempts: int = 0
+  next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+  last_error: str | None = Field(default=None, max_length=1000)
+  # Set when EMAIL_MAX_ATTEMPTS were made, the email isn't retried anymore
+  failed: bool = False
+
+
+class EmailOutboxStatus(SQLModel):
+  """
+  Outbox backlog and counters of this worker's email sender
+  """
+  pending: int
+  failed: int
+  sent: int
+  retried: int
+  given_up: int
+  connected: bool
+
+
+class UserPurgeStatus(SQLModel):
+  """
+  Progress of the deletion of a user, rows are counted by table
+  """
+  user_id: uuid.UUID
+  running: bool
+  deleted: dict[str, int]
+  remaining: dict[str, int]
+
+
 class NewPassword(SQLModel):
   """
   Properties to receive via API on update
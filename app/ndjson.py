@@ -0,0 +1,23 @@
+"""
+Newline delimited JSON helpers, for streamed responses and uploads.
+"""
+from collections.abc import AsyncIterable, AsyncIterator
+
+from sqlmodel import SQLModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(accept: str | None) -> bool:
+  """
+  Check if the client asked for an NDJSON response.
+  """
+  return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+async def encode_models(models: AsyncIterable[SQLModel]) -> AsyncIterator[bytes]:
+  """
+  Encode models as NDJSON lines.
+  """
+  async for model in models:
+    yield model.model_dump_json().encode() + b"\n"
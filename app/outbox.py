@@ -0,0 +1,269 @@
+"""
+Transactional email outbox.
+
+Routes don't talk to the SMTP server: enqueue_email adds the email to the
+emailoutbox table in the request's transaction, so it is only sent if the
+transaction commits, and the request doesn't wait for the server. Emails
+are queued as a template and its context and rendered when sent: the
+secrets of an email (a reset token) are made then and never stored, and
+the context of an email given up is cleared.
+
+Each worker runs an EmailSender, which claims the due emails in batches:
+it takes them with FOR UPDATE SKIP LOCKED (workers never claim the same
+email), pushes their next attempt EMAIL_OUTBOX_LEASE_SECONDS away and
+commits. It then sends them on one SMTP connection, kept open between
+batches, without holding a database connection, and records the outcome in
+a second transaction: sent emails are deleted, a failed send is retried
+later with an exponential backoff, until the email is marked failed after
+EMAIL_MAX_ATTEMPTS. Emails claimed by a worker which died before recording
+the outcome are sent again once the lease expires.
+"""
+import asyncio
+import logging
+import smtplib
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any
+
+from sqlalchemy import delete, func, update
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import async_session_factory
+from app.models import EmailOutbox
+from app.utils import build_email, generate_queued_email, smtp_options
+
+if TYPE_CHECKING:
+  from emails.backend.smtp import SMTPBackend  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def unreachable_errors() -> tuple[type[Exception], ...]:
+  """
+  Errors meaning the SMTP server can't be reached at the moment. The email
+  stack is imported on the first send, not with the app.
+  """
+  # pylint: disable=import-outside-toplevel
+  from emails.backend.smtp.exceptions import SMTPConnectNetworkError  # type: ignore
+
+  return (
+    SMTPConnectNetworkError, smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError
+  )
+
+
+def enqueue_email(
+  session: AsyncSession, *, email_to: str, template_name: str, context: dict[str, Any]
+) -> EmailOutbox:
+  """
+  Queue an email in the session's transaction, it is sent once committed.
+  Call email_sender.wake after the commit to send it right away. The
+  context must hold no secrets, see app.utils.generate_queued_email.
+  """
+  assert settings.emails_enabled, "no provided configuration for email variables"
+  email = EmailOutbox(email_to=email_to, template_name=template_name, context=context)
+  session.add(email)
+  return email
+
+
+def retry_delay(attempts: int) -> timedelta:
+  """
+  Delay before the next attempt of an email which failed attempts times.
+  """
+  seconds = settings.EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+  return timedelta(seconds=min(seconds, settings.EMAIL_RETRY_MAX_SECONDS))
+
+
+class EmailSender:
+  """
+  Send the outbox's emails in the background.
+  """
+
+  def __init__(
+    self, batch_size: int, poll_seconds: float, idle_seconds: float, lease_seconds: float
+  ) -> None:
+    self.batch_size = batch_size
+    self.poll_seconds = poll_seconds
+    self.idle_seconds = idle_seconds
+    self.lease_seconds = lease_seconds
+    self.sent = 0
+    self.retried = 0
+    self.given_up = 0
+    self._backend: "SMTPBackend | None" = None
+    self._last_send = 0.0
+    self._wakeup: asyncio.Event | None = None
+    self._task: asyncio.Task[None] | None = None
+    self._stopping = False
+
+  def _send(self, emails: list[tuple[str, str, dict[str, Any]]]) -> list[str | None]:
+    """
+    Send emails on the open connection, in a thread. Returns the error of
+    each email, None when it was sent.
+    """
+    from emails.backend.smtp import SMTPBackend  # type: ignore  # pylint: disable=import-outside-toplevel
+
+    unreachable = unreachable_errors()
+    errors: list[str | None] = []
+    for email_to, template_name, context in emails:
+      try:
+        email_data = generate_queued_email(template_name, context)
+      except Exception as e:  # pylint: disable=broad-except
+        errors.append(f"{type(e).__name__}: {e}")
+        continue
+      if self._backend is None:
+        self._backend = SMTPBackend(fail_silently=False, **smtp_options())
+      try:
+        build_email(subject=email_data.subject, html_content=email_data.html_content).send(
+          to=email_to, smtp=self._backend
+        )
+        errors.append(None)
+      except unreachable as e:
+        # The others would fail the same way, retry them all later
+        self._close()
+        errors.extend([f"{type(e).__name__}: {e}"] * (len(emails) - len(errors)))
+        break
+      except Exception as e:  # pylint: disable=broad-except
+        errors.append(f"{type(e).__name__}: {e}")
+        # Start over on a new connection
+        self._close()
+    self._last_send = time.monotonic()
+    return errors
+
+  def _close(self) -> None:
+    if self._backend is not None:
+      try:
+        self._backend.close()
+      except Exception:  # pylint: disable=broad-except
+        logger.debug("Closing the SMTP connection failed", exc_info=True)
+      self._backend = None
+
+  async def _claim(self) -> list[EmailOutbox]:
+    async with async_session_factory() as session:
+      now = datetime.utcnow()
+      statement = (
+        select(EmailOutbox)
+        .where(col(EmailOutbox.failed).is_(False), EmailOutbox.next_attempt_at <= now)
+        .order_by(col(EmailOutbox.next_attempt_at))
+        .limit(self.batch_size)
+        .with_for_update(skip_locked=True)
+      )
+      emails = list((await session.exec(statement)).all())
+      if emails:
+        await session.execute(
+          update(EmailOutbox)
+          .where(col(EmailOutbox.id).in_([e.id for e in emails]))
+          .values(next_attempt_at=now + timedelta(seconds=self.lease_seconds))
+        )
+        await session.commit()
+      return emails
+
+  async def _record(self, emails: list[EmailOutbox], errors: list[str | None]) -> None:
+    async with async_session_factory() as session:
+      now = datetime.utcnow()
+      sent = [e.id for e, error in zip(emails, errors) if error is None]
+      if sent:
+        await session.execute(delete(EmailOutbox).where(col(EmailOutbox.id).in_(sent)))
+      for email, error in zip(emails, errors):
+        if error is None:
+          continue
+        attempts = email.attempts + 1
+        values: dict[str, Any] = {"attempts": attempts, "last_error": error[:1000]}
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+          # Kept to count and inspect, without its context
+          values["failed"] = True
+          values["context"] = {}
+          self.given_up += 1
+          logger.error("Giving up sending email %s to %s: %s", email.id, email.email_to, error)
+        else:
+          values["next_attempt_at"] = now + retry_delay(attempts)
+          self.retried += 1
+          logger.warning("Sending email %s failed, will retry: %s", email.id, error)
+        await session.execute(
+          update(EmailOutbox).where(col(EmailOutbox.id) == email.id).values(**values)
+        )
+      await session.commit()
+      self.sent += len(sent)
+
+  async def send_batch(self) -> int:
+    """
+    Send a batch of due emails. Returns how many were attempted.
+    """
+    emails = await self._claim()
+    if not emails:
+      return 0
+    # No connection or transaction is held while sending
+    errors = await asyncio.to_thread(
+      self._send, [(e.email_to, e.template_name, e.context) for e in emails]
+    )
+    await self._record(emails, errors)
+    return len(emails)
+
+  async def _run(self) -> None:
+    assert self._wakeup is not None
+    while not self._stopping:
+      try:
+        if await self.send_batch() == self.batch_size:
+          # There may be more
+          continue
+      except Exception:  # pylint: disable=broad-except
+        logger.exception("Email sender failed")
+      if self._backend is not None and time.monotonic() - self._last_send > self.idle_seconds:
+        await asyncio.to_thread(self._close)
+      try:
+        await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+      except asyncio.TimeoutError:
+        pass
+      self._wakeup.clear()
+
+  def wake(self) -> None:
+    """
+    Look for due emails now, e.g. after committing new ones.
+    """
+    if self._wakeup is not None:
+      self._wakeup.set()
+
+  async def start(self) -> None:
+    """
+    Start sending, from the application lifespan.
+    """
+    if settings.emails_enabled and self._task is None:
+      self._stopping = False
+      self._wakeup = asyncio.Event()
+      self._task = asyncio.create_task(self._run())
+
+  async def stop(self) -> None:
+    """
+    Stop sending, after the batch being sent.
+    """
+    if self._task is not None:
+      self._stopping = True
+      self.wake()
+      _, pending = await asyncio.wait([self._task], timeout=10.0)
+      for task in pending:
+        task.cancel()
+      self._task = None
+      await asyncio.to_thread(self._close)
+
+  async def stats(self, session: AsyncSession) -> dict[str, Any]:
+    """
+    Outbox backlog and counters of this worker.
+    """
+    statement = select(EmailOutbox.failed, func.count()).group_by(col(EmailOutbox.failed))
+    counts = dict((await session.exec(statement)).all())
+    return {
+      "pending": counts.get(False, 0),
+      "failed": counts.get(True, 0),
+      "sent": self.sent,
+      "retried": self.retried,
+      "given_up": self.given_up,
+      "connected": self._backend is not None,
+    }
+
+
+email_sender = EmailSender(
+  batch_size=settings.EMAIL_OUTBOX_BATCH_SIZE,
+  poll_seconds=settings.EMAIL_OUTBOX_POLL_SECONDS,
+  idle_seconds=settings.EMAIL_SMTP_IDLE_SECONDS,
+  lease_seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS,
+)
@@ -0,0 +1,138 @@
+"""
+Deletion of users and everything they own.
+
+The rows of a user are deleted by the database's ON DELETE CASCADE, the
+ORM doesn't load them first. That is one statement for most users, but for
+a user owning more than USER_PURGE_SYNC_MAX_ROWS rows it would hold row
+locks and a worker for minutes. Such a user is deactivated right away and
+purged by a background job instead, children first, USER_PURGE_CHUNK_ROWS
+rows per transaction, the user row last.
+
+The job is lost if the worker stops, the user then stays deactivated with
+part of their rows: deleting it again resumes the purge.
+"""
+import logging
+import uuid
+from collections.abc import Callable
+
+from sqlalchemy import Delete, Select, delete, func, or_
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.background import background_jobs
+from app.core.config import settings
+from app.core.db import async_session_factory
+from app.core.user_cache import publish_change, user_cache
+from app.models import Chat, Item, Message, Organization, Template, User
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted by the purges running in this worker, by user and table
+_progress: dict[uuid.UUID, dict[str, int]] = {}
+
+
+def _chat_ids(user_id: uuid.UUID) -> Select:
+  # Chats of other users on the user's templates go with the templates
+  templates = select(Template.id).where(col(Template.owner_id) == user_id)
+  return select(Chat.id).where(
+    or_(col(Chat.owner_id) == user_id, col(Chat.template_id).in_(templates))
+  )
+
+
+# Ids of the rows of each table owned by a user, in deletion order
+OWNED: list[tuple[str, Callable[[uuid.UUID], Select]]] = [
+  ("message", lambda user_id: select(Message.id).where(
+    col(Message.chat_id).in_(_chat_ids(user_id))
+  )),
+  ("chat", _chat_ids),
+  ("template", lambda user_id: select(Template.id).where(col(Template.owner_id) == user_id)),
+  ("organization", lambda user_id: select(Organization.id).where(
+    col(Organization.owner_id) == user_id
+  )),
+  ("item", lambda user_id: select(Item.id).where(col(Item.owner_id) == user_id)),
+]
+
+TABLES = {
+  "message": Message, "chat": Chat, "template": Template, "organization": Organization, "item": Item
+}
+
+
+async def count_owned(
+  session: AsyncSession, user_id: uuid.UUID, limit: int | None = None
+) -> dict[str, int]:
+  """
+  Count the rows owned by a user, by table, up to limit + 1 per table.
+  """
+  counts = {}
+  for table, ids in OWNED:
+    statement = ids(user_id)
+    if limit is not None:
+      statement = statement.limit(limit + 1)
+    counts[table] = (
+      await session.execute(select(func.count()).select_from(statement.subquery()))
+    ).scalar_one()
+  return counts
+
+
+def _delete_chunk(table: str, ids: Select) -> Delete:
+  model = TABLES[table]
+  chunk = ids.limit(settings.USER_PURGE_CHUNK_ROWS)
+  return delete(model).where(col(model.id).in_(chunk))  # type: ignore[attr-defined]
+
+
+async def _delete_user_row(session: AsyncSession, user_id: uuid.UUID) -> None:
+  await session.execute(delete(User).where(col(User.id) == user_id))
+  await publish_change(session, user_id)
+  await session.commit()
+  user_cache.invalidate(user_id)
+
+
+async def purge_user(user_id: uuid.UUID) -> None:
+  """
+  Delete the rows of a user chunk by chunk, then the user.
+  """
+  progress = _progress.setdefault(user_id, {})
+  try:
+    for table, ids in OWNED:
+      while True:
+        async with async_session_factory() as session:
+          result = await session.execute(_delete_chunk(table, ids(user_id)))
+          await session.commit()
+        progress[table] = progress.get(table, 0) + result.rowcount
+        if result.rowcount < settings.USER_PURGE_CHUNK_ROWS:
+          break
+    async with async_session_factory() as session:
+      await _delete_user_row(session, user_id)
+    logger.info("Purged user %s: %s", user_id, progress)
+  finally:
+    _progress.pop(user_id, None)
+
+
+async def delete_user(session: AsyncSession, user: User) -> bool:
+  """
+  Delete a user right away if they own few rows and return True, else
+  deactivate them, start purging them in the background and return False.
+  """
+  limit = settings.USER_PURGE_SYNC_MAX_ROWS
+  if sum((await count_owned(session, user.id, limit)).values()) <= limit:
+    await _delete_user_row(session, user.id)
+    return True
+  user.is_active = False
+  session.add(user)
+  await publish_change(session, user.id)
+  await session.commit()
+  user_cache.invalidate(user.id)
+  background_jobs.submit(f"purge:{user.id}", purge_user, user.id)
+  return False
+
+
+async def purge_status(session: AsyncSession, user_id: uuid.UUID) -> dict:
+  """
+  Rows of a user deleted by this worker so far and rows left, by table.
+  """
+  return {
+    "user_id": user_id,
+    "running": user_id in _progress,
+    "deleted": dict(_progress.get(user_id, {})),
+    "remaining": await count_owned(session, user_id),
+  }
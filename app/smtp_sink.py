@@ -0,0 +1,122 @@
+"""
+Local SMTP stand-in, for development and tests.
+
+It accepts every email and keeps it in memory instead of delivering it. Run
+it with `python -m app.smtp_sink` and point the application at it:
+
+  SMTP_HOST=localhost SMTP_PORT=1025 SMTP_TLS=False
+
+Tests can start an SMTPSink in their event loop and read sink.messages, or
+set sink.fail_next to have the next emails refused and exercise retries.
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from email import message_from_bytes
+from email.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReceivedEmail:
+  """
+  An email as received by the sink.
+  """
+  mail_from: str
+  rcpt_to: list[str]
+  data: bytes
+
+  @property
+  def message(self) -> Message:
+    return message_from_bytes(self.data)
+
+
+@dataclass
+class SMTPSink:
+  """
+  Minimal SMTP server keeping the emails it receives.
+  """
+  host: str = "localhost"
+  port: int = 1025
+  messages: list[ReceivedEmail] = field(default_factory=list)
+  # Number of next emails to refuse with a temporary error
+  fail_next: int = 0
+  connections: int = 0
+  _server: asyncio.Server | None = None
+
+  async def start(self) -> None:
+    """
+    Start listening, port 0 picks a free port.
+    """
+    self._server = await asyncio.start_server(self._handle, self.host, self.port)
+    self.port = self._server.sockets[0].getsockname()[1]
+
+  async def stop(self) -> None:
+    """
+    Stop listening.
+    """
+    if self._server is not None:
+      self._server.close()
+      await self._server.wait_closed()
+      self._server = None
+
+  async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    self.connections += 1
+
+    async def reply(line: str) -> None:
+      writer.write(f"{line}\r\n".encode())
+      await writer.drain()
+
+    mail_from, rcpt_to = "", []
+    await reply("220 smtp-sink ready")
+    try:
+      while line := await reader.readline():
+        command = line.decode(errors="replace").strip()
+        verb = command[:4].upper()
+        if verb in ("HELO", "EHLO"):
+          await reply("250 smtp-sink")
+        elif verb == "MAIL":
+          mail_from, rcpt_to = command.partition(":")[2].strip(" <>"), []
+          await reply("250 OK")
+        elif verb == "RCPT":
+          rcpt_to.append(command.partition(":")[2].strip(" <>"))
+          await reply("250 OK")
+        elif verb == "DATA":
+          await reply("354 End data with <CR><LF>.<CR><LF>")
+          data = bytearray()
+          while (chunk := await reader.readline()) not in (b".\r\n", b".\n", b""):
+            data += chunk[1:] if chunk.startswith(b"..") else chunk
+          if self.fail_next > 0:
+            self.fail_next -= 1
+            await reply("451 Try again later")
+          else:
+            self.messages.append(ReceivedEmail(mail_from, rcpt_to, bytes(data)))
+            logger.info("Received email from %s to %s", mail_from, ", ".join(rcpt_to))
+            await reply("250 OK")
+        elif verb in ("RSET", "NOOP"):
+          await reply("250 OK")
+        elif verb == "QUIT":
+          await reply("221 Bye")
+          break
+        else:
+          await reply("502 Command not implemented")
+    finally:
+      writer.close()
+
+
+async def _serve(host: str, port: int) -> None:
+  sink = SMTPSink(host, port)
+  await sink.start()
+  logger.info("SMTP sink listening on %s:%s", host, sink.port)
+  await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=1025)
+  args = parser.parse_args()
+  asyncio.run(_serve(args.host, args.port))
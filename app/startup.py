@@ -0,0 +1,134 @@
+"""
+Startup profiling.
+
+Cold starts of autoscaled workers delay the requests waiting for them, so
+heavy optional dependencies (the email stack, sentry, the large model SDKs)
+are imported when first used instead of with the app. Two commands keep an
+eye on it:
+- `python -m app.startup imports` imports main in a fresh interpreter with
+  `-X importtime` and lists the slowest imports, with the time spent in
+  the module itself and cumulated over the modules it imports;
+- `python -m app.startup bench` starts uvicorn a few times and measures
+  the time until the health check first answers. It exits with an error
+  when the median exceeds the budget, STARTUP_BUDGET_SECONDS by default.
+  The slow test app/tests/test_startup.py checks the same budget.
+"""
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from pathlib import Path
+
+from app.core.config import settings
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class ImportTime:
+  """
+  Import time of a module, in microseconds.
+  """
+  module: str
+  self_us: int
+  cumulative_us: int
+
+
+def import_times(module: str = "main") -> list[ImportTime]:
+  """
+  Import times of module and of everything it imports, slowest first.
+  """
+  result = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+    cwd=ROOT, capture_output=True, text=True, check=True,
+  )
+  times = []
+  for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "|" not in line:
+      continue
+    self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+    if not self_us.strip().isdigit():
+      # The header line
+      continue
+    times.append(ImportTime(name.strip(), int(self_us), int(cumulative_us)))
+  return sorted(times, key=lambda t: t.cumulative_us, reverse=True)
+
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def time_to_first_request(timeout: float = 60.0) -> float:
+  """
+  Seconds from starting uvicorn to the first answer of the health check.
+  """
+  port = _free_port()
+  url = f"http://127.0.0.1:{port}{settings.API_V1_STR}/utils/health-check/"
+  start = time.perf_counter()
+  server = subprocess.Popen(
+    [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+    cwd=ROOT,
+  )
+  try:
+    while time.perf_counter() - start < timeout:
+      if server.poll() is not None:
+        raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+      try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+          if response.status == 200:
+            return time.perf_counter() - start
+      except (urllib.error.URLError, ConnectionError):
+        time.sleep(0.01)
+    raise TimeoutError(f"No answer from {url} after {timeout} seconds")
+  finally:
+    server.terminate()
+    server.wait()
+
+
+def median_time_to_first_request(runs: int = 3) -> float:
+  """
+  Median of runs measures of time_to_first_request.
+  """
+  return statistics.median(time_to_first_request() for _ in range(runs))
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Profile the startup of the app.")
+  commands = parser.add_subparsers(dest="command", required=True)
+  imports = commands.add_parser("imports", help="list the slowest imports of main")
+  imports.add_argument("--top", type=int, default=30)
+  bench = commands.add_parser("bench", help="time the first request after starting")
+  bench.add_argument("--runs", type=int, default=3)
+  bench.add_argument(
+    "--budget", type=float, default=settings.STARTUP_BUDGET_SECONDS, help="seconds, fail above"
+  )
+  args = parser.parse_args()
+
+  if args.command == "imports":
+    times = import_times()
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for t in times[:args.top]:
+      print(f"{t.cumulative_us / 1000:>14.1f} {t.self_us / 1000:>8.1f}  {t.module}")
+    return 0
+
+  durations = []
+  for run in range(args.runs):
+    durations.append(time_to_first_request())
+    print(f"run {run + 1}: {durations[-1]:.2f}s")
+  median = statistics.median(durations)
+  print(f"median time to first request: {median:.2f}s (budget {args.budget:.2f}s)")
+  if median > args.budget:
+    print("Startup is over budget", file=sys.stderr)
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
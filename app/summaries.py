@@ -0,0 +1,175 @@
+"""
+Rolling summaries of long chats.
+
+Sending a whole chat to the model makes every turn slower and more expensive
+as the chat grows. Once the messages not summarized yet reach
+SUMMARY_TRIGGER_TOKENS, a background job folds all of them but the last
+SUMMARY_KEEP_MESSAGES into the chat's summary, and completions send the
+summary plus the messages after it, so the prompt size stays bounded.
+
+The job reads and summarizes one chunk of messages at a time, without
+holding a connection during the model calls. Progress is saved after each
+chunk with a conditional update, so a worker summarizing the same chat
+concurrently can't move the summary backwards.
+"""
+import logging
+import uuid
+from collections.abc import Sequence
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlmodel import col, select
+
+import LargeModel
+from app import crud, message_body
+from app.conversation import estimate_tokens
+from app.core.background import background_jobs
+from app.core.config import settings
+from app.core.db import async_session_factory
+from app.models import Chat, Message, MessagePublic
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+  "You maintain the running summary of a conversation between a user and an "
+  "assistant. Update the summary with the new messages. Keep facts, decisions, "
+  "names, numbers and open questions, drop small talk. Answer with the updated "
+  "summary only, in at most {words} words."
+)
+
+# Messages read per chunk, before the token budget applies
+CHUNK_MESSAGES = 200
+
+
+def pending_messages(chat: Chat, messages: Sequence[MessagePublic]) -> list[MessagePublic]:
+  """
+  Return the messages not covered by the chat's summary.
+  """
+  if chat.summary_until is None:
+    return list(messages)
+  return [
+    message for message in messages
+    if message.created_at is None or message.created_at > chat.summary_until
+  ]
+
+
+def needs_summary(chat: Chat, messages: Sequence[MessagePublic]) -> bool:
+  """
+  Check if the summary of a chat is due, from its latest messages.
+  """
+  pending = pending_messages(chat, messages)
+  if len(pending) <= settings.SUMMARY_KEEP_MESSAGES:
+    return False
+  if len(pending) >= settings.CONVERSATION_WINDOW_MESSAGES:
+    # Older messages not summarized yet don't even fit the window
+    return True
+  tokens = sum(estimate_tokens(message.content) for message in pending)
+  return tokens >= settings.SUMMARY_TRIGGER_TOKENS
+
+
+def schedule_summary(chat_id: uuid.UUID) -> None:
+  """
+  Summarize a chat in the background, unless it is already being done.
+  """
+  background_jobs.submit(f"summary:{chat_id}", summarize_chat, chat_id)
+
+
+def extractive_summary(summary: str | None, messages: Sequence[MessagePublic]) -> str:
+  """
+  Summary without a model: the start of each message, the latest ones last,
+  cut to SUMMARY_MAX_TOKENS.
+  """
+  lines = [summary] if summary else []
+  lines += [f"{message.role}: {message.content[:200]}" for message in messages]
+  return "\n".join(lines)[-settings.SUMMARY_MAX_TOKENS * 4:]
+
+
+async def summarize(summary: str | None, messages: Sequence[MessagePublic]) -> str:
+  """
+  Fold messages into a summary.
+  """
+  large_model = LargeModel.load()
+  if not large_model.available():
+    return extractive_summary(summary, messages)
+  transcript = "\n\n".join(f"{message.role}: {message.content}" for message in messages)
+  prompt = [
+    {
+      "role": "system",
+      "content": SUMMARY_INSTRUCTIONS.format(words=settings.SUMMARY_MAX_TOKENS * 3 // 4),
+    },
+    {
+      "role": "user",
+      "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}",
+    },
+  ]
+  return await large_model.complete(prompt, max_tokens=settings.SUMMARY_MAX_TOKENS)
+
+
+async def _next_chunk(chat_id: uuid.UUID, after: datetime | None) -> list[MessagePublic]:
+  """
+  Return the next messages to summarize, within SUMMARY_CHUNK_TOKENS.
+  """
+  async with async_session_factory() as session:
+    keep_statement = (
+      select(Message.created_at)
+      .where(Message.chat_id == chat_id)
+      .order_by(col(Message.created_at).desc())
+      .offset(settings.SUMMARY_KEEP_MESSAGES - 1)
+      .limit(1)
+    )
+    # The last SUMMARY_KEEP_MESSAGES messages are sent as they are
+    keep_from = (await session.exec(keep_statement)).first()
+    if keep_from is None:
+      return []
+    statement = crud.chat_messages_statement(
+      chat_id=chat_id, after=after, before=keep_from, limit=CHUNK_MESSAGES
+    )
+    messages = await message_body.with_full_content(
+      session, (await session.exec(statement)).all()
+    )
+  budget = settings.SUMMARY_CHUNK_TOKENS
+  chunk: list[MessagePublic] = []
+  for message in messages:
+    tokens = estimate_tokens(message.content)
+    if chunk and tokens > budget:
+      break
+    if tokens > budget:
+      # A single huge message, summarize its start
+      message = message.model_copy(update={"content": message.content[:budget * 4]})
+      tokens = budget
+    chunk.append(message)
+    budget -= tokens
+  return chunk
+
+
+async def summarize_chat(chat_id: uuid.UUID) -> None:
+  """
+  Fold the chat's messages, but the last SUMMARY_KEEP_MESSAGES, into its
+  summary.
+  """
+  async with async_session_factory() as session:
+    chat = await session.get(Chat, chat_id)
+  if chat is None:
+    return
+  summary, summary_until = chat.summary, chat.summary_until
+  while True:
+    chunk = await _next_chunk(chat_id, summary_until)
+    if not chunk:
+      return
+    new_summary = await summarize(summary, chunk)
+    new_until = chunk[-1].created_at
+    async with async_session_factory() as session:
+      statement = (
+        update(Chat)
+        .where(
+          col(Chat.id) == chat_id,
+          col(Chat.summary_until).is_not_distinct_from(summary_until),
+        )
+        .values(summary=new_summary, summary_until=new_until)
+      )
+      result = await session.execute(statement)
+      await session.commit()
+    if result.rowcount == 0:
+      logger.info("Summary of chat %s was updated concurrently, stopping", chat_id)
+      return
+    summary, summary_until = new_summary, new_until
@@ -0,0 +1,40 @@
+"""
+Fixtures shared by the tests, which run against the database configured in
+the settings, with its first superuser.
+"""
+from collections.abc import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.db import async_engine
+
+
+def pytest_configure(config: pytest.Config) -> None:
+  config.addinivalue_line("markers", "slow: starts processes, skipped with -m 'not slow'")
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+  return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def client() -> Iterator[TestClient]:
+  # pylint: disable=import-outside-toplevel
+  from main import app
+
+  with TestClient(app) as test_client:
+    yield test_client
+    # The pool's connections belong to the client's event loop
+    test_client.portal.call(async_engine.dispose)
+
+
+@pytest.fixture(scope="module")
+def superuser_headers(client: TestClient) -> dict[str, str]:
+  response = client.post(
+    f"{settings.API_V1_STR}/login/access-token",
+    data={"username": settings.FIRST_SUPERUSER, "password": settings.FIRST_SUPERUSER_PASSWORD},
+  )
+  return {"Authorization": f"Bearer {response.json()['access_token']}"}
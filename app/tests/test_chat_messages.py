@@ -0,0 +1,96 @@
+"""
+Paging through a chat's messages with cursors.
+"""
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.db import engine
+from app.models import Message
+
+CHATS = f"{settings.API_V1_STR}/chats/"
+
+
+@pytest.fixture
+def chat_with_tied_messages(
+  client: TestClient, superuser_headers: dict[str, str]
+) -> tuple[str, list[str]]:
+  """
+  A chat with seven messages, five of them created at the same time.
+  """
+  template = client.post(
+    f"{settings.API_V1_STR}/templates/", headers=superuser_headers, json={"title": "Paging"}
+  ).json()
+  chat = client.post(
+    CHATS, headers=superuser_headers, json={"title": "Paging", "template_id": template["id"]}
+  ).json()
+  times = [datetime(2026, 1, 1, 0, 0, 0)] + [datetime(2026, 1, 1, 0, 0, 1)] * 5
+  times.append(datetime(2026, 1, 1, 0, 0, 2))
+  messages = [
+    Message(id=uuid.uuid4(), chat_id=chat["id"], created_at=at, role="user", content=f"m{n}")
+    for n, at in enumerate(times)
+  ]
+  ordered = [str(m.id) for m in sorted(messages, key=lambda m: (m.created_at, m.id))]
+  with Session(engine) as session:
+    session.add_all(messages)
+    session.commit()
+  return chat["id"], ordered
+
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_pages_forward_without_skipping_ties(
+  client: TestClient,
+  superuser_headers: dict[str, str],
+  chat_with_tied_messages: tuple[str, list[str]],
+  size: int,
+) -> None:
+  chat_id, expected = chat_with_tied_messages
+  seen: list[str] = []
+  params: dict[str, object] = {"limit": size}
+  while True:
+    page = client.get(f"{CHATS}{chat_id}/messages", headers=superuser_headers, params=params)
+    assert page.status_code == 200
+    body = page.json()
+    seen += [m["id"] for m in body["data"]]
+    if not body["has_more"]:
+      assert body["next_cursor"] is None
+      break
+    params = {"limit": size, "cursor": body["next_cursor"]}
+  assert seen == expected
+
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_pages_backward_with_tail_without_skipping_ties(
+  client: TestClient,
+  superuser_headers: dict[str, str],
+  chat_with_tied_messages: tuple[str, list[str]],
+  size: int,
+) -> None:
+  chat_id, expected = chat_with_tied_messages
+  seen: list[str] = []
+  params: dict[str, object] = {"tail": size}
+  while True:
+    body = client.get(
+      f"{CHATS}{chat_id}/messages", headers=superuser_headers, params=params
+    ).json()
+    seen = [m["id"] for m in body["data"]] + seen
+    if not body["has_more"]:
+      break
+    params = {"tail": size, "cursor": body["next_cursor"]}
+  assert seen == expected
+
+
+def test_invalid_cursor(
+  client: TestClient,
+  superuser_headers: dict[str, str],
+  chat_with_tied_messages: tuple[str, list[str]],
+) -> None:
+  chat_id, _ = chat_with_tied_messages
+  response = client.get(
+    f"{CHATS}{chat_id}/messages", headers=superuser_headers, params={"cursor": "not-a-cursor"}
+  )
+  assert response.status_code == 422
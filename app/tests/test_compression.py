@@ -0,0 +1,87 @@
+"""
+Compression of whole and streamed responses.
+"""
+import gzip
+import zlib
+from typing import Any
+
+import pytest
+
+from app.core.compression import CompressionMiddleware
+from starlette.types import Message, Receive, Scope, Send
+
+
+def _app(start_headers: list[tuple[bytes, bytes]], bodies: list[bytes], status: int = 200):
+  async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": start_headers})
+    for n, body in enumerate(bodies):
+      await send({"type": "http.response.body", "body": body, "more_body": n < len(bodies) - 1})
+
+  return app
+
+
+async def _call(app: Any, accept_encoding: str = "gzip") -> list[Message]:
+  scope = {
+    "type": "http", "method": "GET", "path": "/",
+    "headers": [(b"accept-encoding", accept_encoding.encode())],
+  }
+  sent: list[Message] = []
+
+  async def receive() -> Message:
+    return {"type": "http.request", "body": b""}
+
+  async def send(message: Message) -> None:
+    sent.append(message)
+
+  await CompressionMiddleware(app, minimum_size=100)(scope, receive, send)
+  return sent
+
+
+def _headers(start: Message) -> dict[bytes, bytes]:
+  return dict(start["headers"])
+
+
+@pytest.mark.anyio
+async def test_streamed_chunks_flushed_one_by_one() -> None:
+  chunks = [b'{"n": %d}\n' % n for n in range(3)]
+  app = _app([(b"content-type", b"application/x-ndjson")], [*chunks, b""])
+  start, *bodies = await _call(app)
+  assert _headers(start)[b"content-encoding"] == b"gzip"
+  assert b"content-length" not in _headers(start)
+  decompressor = zlib.decompressobj(wbits=31)
+  # Each chunk can be decoded as soon as it arrives
+  for chunk, body in zip(chunks, bodies):
+    assert decompressor.decompress(body["body"]) == chunk
+  decompressor.decompress(bodies[-1]["body"])
+  assert decompressor.eof
+  assert bodies[-1]["more_body"] is False
+
+
+@pytest.mark.anyio
+async def test_whole_response_compressed_with_length() -> None:
+  body = b"x" * 1000
+  app = _app([(b"content-type", b"application/json"), (b"etag", b'"v1"')], [body])
+  start, message = await _call(app)
+  headers = _headers(start)
+  assert headers[b"content-encoding"] == b"gzip"
+  assert int(headers[b"content-length"]) == len(message["body"])
+  assert headers[b"etag"] == b'W/"v1"'
+  assert gzip.decompress(message["body"]) == body
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+  "headers, body, accept_encoding, status",
+  [
+    ([(b"content-type", b"application/json")], b"small", "gzip", 200),
+    ([(b"content-type", b"image/png")], b"x" * 1000, "gzip", 200),
+    ([(b"content-type", b"application/json")], b"x" * 1000, "gzip;q=0", 200),
+    ([(b"content-type", b"application/json")], b"", "gzip", 304),
+  ],
+)
+async def test_left_alone(
+  headers: list[tuple[bytes, bytes]], body: bytes, accept_encoding: str, status: int
+) -> None:
+  start, message = await _call(_app(headers, [body], status), accept_encoding)
+  assert b"content-encoding" not in _headers(start)
+  assert message["body"] == body
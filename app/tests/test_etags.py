@@ -0,0 +1,78 @@
+"""
+ETags and 304s of the list and detail routes.
+"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+TEMPLATES = f"{settings.API_V1_STR}/templates/"
+
+
+def _create(client: TestClient, headers: dict[str, str], title: str) -> str:
+  response = client.post(TEMPLATES, headers=headers, json={"title": title})
+  assert response.status_code == 200
+  return response.json()["id"]
+
+
+def test_list_not_modified_until_a_change(
+  client: TestClient, superuser_headers: dict[str, str]
+) -> None:
+  _create(client, superuser_headers, "ETag list")
+  response = client.get(TEMPLATES, headers=superuser_headers)
+  etag = response.headers["etag"]
+
+  again = client.get(TEMPLATES, headers={**superuser_headers, "If-None-Match": etag})
+  assert again.status_code == 304
+  assert again.headers["etag"] == etag
+
+  _create(client, superuser_headers, "ETag list, added")
+  changed = client.get(TEMPLATES, headers={**superuser_headers, "If-None-Match": etag})
+  assert changed.status_code == 200
+  assert changed.headers["etag"] != etag
+
+
+def test_list_changes_when_an_update_is_older_than_the_latest(
+  client: TestClient, superuser_headers: dict[str, str]
+) -> None:
+  # pylint: disable=import-outside-toplevel
+  from sqlmodel import Session
+
+  from app.core.db import engine
+  from app.models import Template
+
+  older_id = _create(client, superuser_headers, "ETag older")
+  newer_id = _create(client, superuser_headers, "ETag newer")
+  # As written by a worker whose clock is ahead
+  with Session(engine) as session:
+    newer = session.get(Template, newer_id)
+    assert newer is not None
+    newer.title = "ETag newer, ahead"
+    session.add(newer)
+    session.flush()
+    newer.updated_at = datetime.utcnow() + timedelta(hours=3)
+    session.commit()
+  etag = client.get(TEMPLATES, headers=superuser_headers).headers["etag"]
+
+  response = client.put(
+    f"{TEMPLATES}{older_id}", headers=superuser_headers, json={"title": "ETag older, updated"}
+  )
+  assert response.status_code == 200
+  changed = client.get(TEMPLATES, headers={**superuser_headers, "If-None-Match": etag})
+  assert changed.status_code == 200
+  assert "ETag older, updated" in {t["title"] for t in changed.json()["data"]}
+
+
+def test_detail_not_modified_until_updated(
+  client: TestClient, superuser_headers: dict[str, str]
+) -> None:
+  template_id = _create(client, superuser_headers, "ETag detail")
+  url = f"{TEMPLATES}{template_id}"
+  etag = client.get(url, headers=superuser_headers).headers["etag"]
+  assert client.get(url, headers={**superuser_headers, "If-None-Match": etag}).status_code == 304
+
+  client.put(url, headers=superuser_headers, json={"title": "ETag detail, updated"})
+  changed = client.get(url, headers={**superuser_headers, "If-None-Match": etag})
+  assert changed.status_code == 200
+  assert changed.json()["title"] == "ETag detail, updated"
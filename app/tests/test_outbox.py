@@ -0,0 +1,132 @@
+"""
+Email outbox sending, against the SMTP sink and the database.
+"""
+from collections.abc import AsyncIterator
+
+import pytest
+from sqlalchemy import delete
+from sqlmodel import select
+
+from app import utils
+from app.core.config import settings
+from app.core.db import async_engine, async_session_factory
+from app.models import EmailOutbox
+from app.outbox import EmailSender, enqueue_email
+from app.smtp_sink import SMTPSink
+
+
+@pytest.fixture
+async def sink(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[SMTPSink]:
+  sink = SMTPSink(port=0)
+  await sink.start()
+  monkeypatch.setattr(settings, "SMTP_HOST", sink.host)
+  monkeypatch.setattr(settings, "SMTP_PORT", sink.port)
+  monkeypatch.setattr(settings, "SMTP_TLS", False)
+  monkeypatch.setattr(settings, "SMTP_SSL", False)
+  monkeypatch.setattr(settings, "SMTP_USER", None)
+  monkeypatch.setattr(settings, "SMTP_PASSWORD", None)
+  monkeypatch.setattr(settings, "EMAILS_FROM_EMAIL", "sender@example.com")
+  # Failed emails are due again at once, and given up on the second failure
+  monkeypatch.setattr(settings, "EMAIL_RETRY_BASE_SECONDS", 0.0)
+  monkeypatch.setattr(settings, "EMAIL_MAX_ATTEMPTS", 2)
+  # The built templates come from the frontend build, render the context
+  monkeypatch.setattr(
+    utils, "render_email_template",
+    lambda *, template_name, context: f"<p>{template_name} {context}</p>",
+  )
+  async with async_session_factory() as session:
+    await session.execute(delete(EmailOutbox))
+    await session.commit()
+  yield sink
+  async with async_session_factory() as session:
+    await session.execute(delete(EmailOutbox))
+    await session.commit()
+  await sink.stop()
+  # The pool's connections belong to this test's event loop
+  await async_engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_send_batch_counts_sent_retried_given_up(sink: SMTPSink) -> None:
+  async with async_session_factory() as session:
+    for n in range(3):
+      enqueue_email(
+        session,
+        email_to=f"user{n}@example.com",
+        template_name="test_email.html",
+        context={"email_to": f"user{n}@example.com"},
+      )
+    await session.commit()
+  sender = EmailSender(batch_size=10, poll_seconds=1.0, idle_seconds=60.0, lease_seconds=60.0)
+
+  # Two refused, retried, one sent
+  sink.fail_next = 2
+  assert await sender.send_batch() == 3
+  assert (sender.sent, sender.retried, sender.given_up) == (1, 2, 0)
+
+  # Of the two retried, one refused again and given up, one sent
+  sink.fail_next = 1
+  assert await sender.send_batch() == 2
+  assert (sender.sent, sender.retried, sender.given_up) == (2, 2, 1)
+
+  # Nothing due anymore
+  assert await sender.send_batch() == 0
+  await sender.stop()
+
+  assert len(sink.messages) == 2
+  async with async_session_factory() as session:
+    remaining = (await session.exec(select(EmailOutbox))).all()
+  assert len(remaining) == 1
+  assert remaining[0].failed
+  assert remaining[0].attempts == 2
+  assert remaining[0].last_error
+
+
+@pytest.mark.anyio
+async def test_reset_token_made_at_send_and_given_up_email_cleared(sink: SMTPSink) -> None:
+  async with async_session_factory() as session:
+    enqueue_email(
+      session,
+      email_to="reset@example.com",
+      template_name="reset_password.html",
+      context={"email_to": "reset@example.com", "email": "reset@example.com"},
+    )
+    await session.commit()
+    queued = (await session.exec(select(EmailOutbox))).one()
+  assert queued.context == {"email_to": "reset@example.com", "email": "reset@example.com"}
+  sender = EmailSender(batch_size=10, poll_seconds=1.0, idle_seconds=60.0, lease_seconds=60.0)
+
+  # Both attempts refused, given up
+  sink.fail_next = 2
+  assert await sender.send_batch() == 1
+  assert await sender.send_batch() == 1
+  assert sender.given_up == 1
+  await sender.stop()
+
+  async with async_session_factory() as session:
+    given_up = (await session.exec(select(EmailOutbox))).one()
+  assert given_up.failed
+  assert given_up.context == {}
+  assert "token" not in given_up.model_dump_json()
+
+
+@pytest.mark.anyio
+async def test_sent_reset_email_carries_a_valid_token(sink: SMTPSink) -> None:
+  async with async_session_factory() as session:
+    enqueue_email(
+      session,
+      email_to="reset@example.com",
+      template_name="reset_password.html",
+      context={"email_to": "reset@example.com", "email": "reset@example.com"},
+    )
+    await session.commit()
+  sender = EmailSender(batch_size=10, poll_seconds=1.0, idle_seconds=60.0, lease_seconds=60.0)
+  assert await sender.send_batch() == 1
+  await sender.stop()
+
+  assert sender.sent == 1
+  body = sink.messages[0].message.get_payload(decode=True) or b""
+  for part in sink.messages[0].message.walk():
+    body += part.get_payload(decode=True) or b""
+  token = body.decode().split("token=")[1].split("'")[0].split('"')[0]
+  assert utils.verify_password_reset_token(token) == "reset@example.com"
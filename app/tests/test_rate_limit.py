@@ -0,0 +1,53 @@
+"""
+Rate limiting, falling back to local buckets when Redis fails.
+"""
+import pytest
+from fastapi import HTTPException
+
+from app.core import rate_limit
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter
+
+
+class FailingRedisTake:
+  """
+  Stand-in for the registered Redis script, failing like a dead server.
+  """
+
+  def __init__(self) -> None:
+    self.calls = 0
+
+  async def __call__(self, keys: list[str], args: list[float]) -> str:
+    self.calls += 1
+    raise ConnectionError("Timeout connecting to server")
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+  now = [1000.0]
+  monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+  return now
+
+
+@pytest.mark.anyio
+async def test_redis_failure_falls_back_and_cools_down(clock: list[float]) -> None:
+  limiter = RateLimiter(enabled=True, redis_url="redis://unreachable:6379")
+  redis_take = FailingRedisTake()
+  limiter._redis_take = redis_take  # pylint: disable=protected-access
+  burst = rate_limit.LIMITS["completions"].burst
+
+  # Served by the local buckets, Redis is only tried by the first request
+  for _ in range(burst):
+    await limiter.check("completions", "user")
+  assert redis_take.calls == 1
+  with pytest.raises(HTTPException) as rejected:
+    await limiter.check("completions", "user")
+  assert rejected.value.status_code == 429
+  assert redis_take.calls == 1
+
+  # Tried again once the cooldown is over
+  clock[0] += settings.RATE_LIMIT_REDIS_RETRY_SECONDS
+  await limiter.check("crud", "user")
+  assert redis_take.calls == 2
+  await limiter.check("crud", "user")
+  assert redis_take.calls == 2
@@ -0,0 +1,15 @@
+"""
+Startup time of a worker, against its budget.
+"""
+import pytest
+
+from app.core.config import settings
+from app.startup import median_time_to_first_request
+
+
+@pytest.mark.slow
+def test_time_to_first_request_within_budget() -> None:
+  median = median_time_to_first_request(runs=3)
+  assert median <= settings.STARTUP_BUDGET_SECONDS, (
+    f"Median time to first request {median:.2f}s, budget {settings.STARTUP_BUDGET_SECONDS:.2f}s"
+  )
@@ -0,0 +1,91 @@
+"""
+Export and import of a user's data, and the size limits of imports.
+"""
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import transfer
+from app.core.config import settings
+
+ME = f"{settings.API_V1_STR}/users/me"
+
+
+async def _chunks(*chunks: bytes):
+  for chunk in chunks:
+    yield chunk
+
+
+async def _lines(data: bytes, gzipped: bool, chunk_size: int = 7) -> list[bytes]:
+  chunks = [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+  return [line async for line in transfer.decoded_lines(_chunks(*chunks), gzipped)]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("gzipped", [False, True])
+async def test_decoded_lines(gzipped: bool) -> None:
+  data = b"a\nbb\n\nccc\nlast"
+  lines = await _lines(gzip.compress(data) if gzipped else data, gzipped)
+  assert lines == [b"a", b"bb", b"", b"ccc", b"last"]
+
+
+@pytest.mark.anyio
+async def test_gzip_bomb_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+  monkeypatch.setattr(settings, "IMPORT_MAX_BYTES", 100_000)
+  # About 10 KB inflating to 10 MB
+  bomb = gzip.compress(b"\n" * 10_000_000)
+  with pytest.raises(transfer.ImportTooLarge) as error:
+    await _lines(bomb, True, chunk_size=len(bomb))
+  assert "larger than" in error.value.detail
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("gzipped", [False, True])
+async def test_long_line_rejected_with_its_number(
+  monkeypatch: pytest.MonkeyPatch, gzipped: bool
+) -> None:
+  monkeypatch.setattr(settings, "IMPORT_MAX_LINE_BYTES", 100)
+  data = b"short\nshort\n" + b"x" * 1000
+  with pytest.raises(transfer.ImportTooLarge) as error:
+    await _lines(gzip.compress(data) if gzipped else data, gzipped)
+  assert error.value.line == 3
+
+
+def test_export_import_round_trip(client: TestClient, superuser_headers: dict[str, str]) -> None:
+  template = client.post(
+    f"{settings.API_V1_STR}/templates/", headers=superuser_headers, json={"title": "Transfer"}
+  ).json()
+  client.post(
+    f"{settings.API_V1_STR}/chats/",
+    headers=superuser_headers,
+    json={"title": "Transfer", "template_id": template["id"]},
+  )
+  exported = client.get(f"{ME}/export", headers=superuser_headers, params={"gzip": True})
+  assert exported.status_code == 200
+  # The client doesn't inflate an attachment's application/gzip body
+  records = [json.loads(line) for line in gzip.decompress(exported.content).splitlines()]
+  chats = sum(record["type"] == "chat" for record in records)
+  assert chats >= 1
+
+  imported = client.post(
+    f"{ME}/import",
+    headers={**superuser_headers, "Content-Type": "application/gzip"},
+    params={"new_ids": True},
+    content=exported.content,
+  )
+  assert imported.status_code == 200
+  assert imported.json()["chat"] == chats
+
+
+def test_import_too_large(
+  client: TestClient, superuser_headers: dict[str, str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+  monkeypatch.setattr(settings, "IMPORT_MAX_BYTES", 100_000)
+  response = client.post(
+    f"{ME}/import",
+    headers={**superuser_headers, "Content-Type": "application/gzip"},
+    content=gzip.compress(b"\n" * 10_000_000),
+  )
+  assert response.status_code == 413
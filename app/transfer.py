@@ -0,0 +1,263 @@
+"""
+Export and import of a user's data (organizations, templates, chats and
+messages) as NDJSON, one {"type": ..., "data": ...} record per line.
+
+Both directions stream: export reads each table through a server-side
+cursor, import writes fixed size batches with COPY as lines come in, so
+memory use doesn't grow with the size of the tenant.
+"""
+import json
+import uuid
+import zlib
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Any
+
+from pydantic import ValidationError
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import bulk, message_body
+from app.core.config import settings
+from app.models import Chat, Message, MessageBody, Organization, Template
+
+# Parents come before their children, import relies on this order
+RECORD_TYPES: dict[str, type[SQLModel]] = {
+  "organization": Organization,
+  "template": Template,
+  "chat": Chat,
+  "message": Message,
+}
+
+# Foreign keys of imported rows, they must point to rows of the same user
+REFERENCES: dict[str, type[SQLModel]] = {"template_id": Template, "chat_id": Chat}
+
+# Rows per server-side cursor fetch and per COPY batch
+BATCH_SIZE = 1000
+
+
+class TransferError(ValueError):
+  """
+  An import line that can't be imported, line is 1-based.
+  """
+
+  def __init__(self, line: int, detail: Any) -> None:
+    super().__init__(f"line {line}: {detail}")
+    self.line = line
+    self.detail = detail
+
+
+class ImportTooLarge(TransferError):
+  """
+  An import whose line or total size, decompressed, exceeds the limits.
+  """
+
+
+def owner_statements(owner_id: uuid.UUID) -> list[tuple[str, Any]]:
+  """
+  Queries selecting everything a user owns, in RECORD_TYPES order.
+  """
+  return [
+    ("organization", select(Organization).where(Organization.owner_id == owner_id)),
+    ("template", select(Template).where(Template.owner_id == owner_id)),
+    ("chat", select(Chat).where(Chat.owner_id == owner_id)),
+    (
+      "message",
+      select(Message, MessageBody)
+      .join(Chat)
+      .outerjoin(MessageBody)
+      .where(Chat.owner_id == owner_id)
+      .order_by(Message.chat_id, Message.created_at),
+    ),
+  ]
+
+
+def record_data(row: Any) -> dict[str, Any]:
+  """
+  Exported data of a row, messages are exported with their full content.
+  """
+  model, *body = row
+  data = model.model_dump(mode="json")
+  if body and body[0] is not None:
+    data["content"] = message_body.decode_body(body[0])
+  return data
+
+
+async def export_records(session: AsyncSession, owner_id: uuid.UUID) -> AsyncIterator[bytes]:
+  """
+  Yield a user's data as NDJSON lines.
+  """
+  # One snapshot for all the tables, so exported children match their parents
+  await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+  for record_type, statement in owner_statements(owner_id):
+    rows = await session.stream(statement.execution_options(yield_per=BATCH_SIZE))
+    async for row in rows:
+      yield json.dumps({"type": record_type, "data": record_data(row)}).encode() + b"\n"
+
+
+async def gzip_chunks(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+  """
+  Gzip a stream of chunks incrementally.
+  """
+  compressor = zlib.compressobj(wbits=31)
+  async for chunk in chunks:
+    data = compressor.compress(chunk)
+    if data:
+      yield data
+  yield compressor.flush()
+
+
+async def decoded_lines(chunks: AsyncIterable[bytes], gzipped: bool) -> AsyncIterator[bytes]:
+  """
+  Split a (possibly gzipped) stream of chunks into lines, of at most
+  IMPORT_MAX_LINE_BYTES and IMPORT_MAX_BYTES in all.
+  """
+  decompressor = zlib.decompressobj(wbits=47) if gzipped else None
+  max_line = settings.IMPORT_MAX_LINE_BYTES
+  buffer = b""
+  total = 0
+  lines_done = 0
+
+  def split(data: bytes) -> list[bytes]:
+    nonlocal buffer, total, lines_done
+    total += len(data)
+    if total > settings.IMPORT_MAX_BYTES:
+      raise ImportTooLarge(lines_done + 1, f"Import larger than {settings.IMPORT_MAX_BYTES} bytes")
+    buffer += data
+    *lines, buffer = buffer.split(b"\n")
+    # The unfinished line is the last one, it only grows
+    for number, line in enumerate([*lines, buffer], lines_done + 1):
+      if len(line) > max_line:
+        raise ImportTooLarge(number, f"Line longer than {max_line} bytes")
+    lines_done += len(lines)
+    return lines
+
+  async for chunk in chunks:
+    if decompressor is None:
+      for line in split(chunk):
+        yield line
+      continue
+    # Inflated a bounded piece at a time, checked before the next one
+    while chunk:
+      for line in split(decompressor.decompress(chunk, max_line)):
+        yield line
+      chunk = decompressor.unconsumed_tail
+  if decompressor is not None:
+    for line in split(decompressor.flush()):
+      yield line
+  yield buffer
+
+
+class Importer:
+  """
+  Validate records and write them with COPY, one batch at a time.
+
+  Records keep their ids unless new_ids is set, then every row gets a new
+  id and references to imported parents are rewritten. The owner is always
+  the importing user. Long message contents are split into a preview and a
+  MessageBody, written after their batch of messages.
+  """
+
+  def __init__(self, session: AsyncSession, owner_id: uuid.UUID, new_ids: bool) -> None:
+    self.session = session
+    self.owner_id = owner_id
+    self.new_ids = new_ids
+    # Old id -> new id of imported parents, only filled with new_ids
+    self.id_map: dict[uuid.UUID, uuid.UUID] = {}
+    # Ids rows may reference: imported parents and checked existing ones
+    self.owned_ids: set[uuid.UUID] = set()
+    self.batch_type: str | None = None
+    self.batch: list[dict[str, Any]] = []
+    self.bodies: list[dict[str, Any]] = []
+    self.counts = {record_type: 0 for record_type in RECORD_TYPES}
+
+  def _row(
+    self, record_type: str, data: Any
+  ) -> tuple[dict[str, Any], message_body.EncodedBody | None]:
+    table_model = RECORD_TYPES[record_type]
+    if isinstance(data, dict) and "owner_id" in table_model.model_fields:
+      data = {**data, "owner_id": self.owner_id}
+    body = None
+    if record_type == "message" and isinstance(data, dict) and isinstance(
+      data.get("content"), str
+    ):
+      if len(data["content"]) > settings.MESSAGE_MAX_LENGTH:
+        raise ValueError(f"Message content longer than {settings.MESSAGE_MAX_LENGTH}")
+      fields, body = message_body.split_content(data["content"])
+      data = {**data, **fields}
+    row = table_model.model_validate(data).model_dump()
+    if self.new_ids:
+      for reference in REFERENCES:
+        if reference in row:
+          row[reference] = self.id_map.get(row[reference], row[reference])
+      new_id = uuid.uuid4()
+      if record_type != "message":
+        self.id_map[row["id"]] = new_id
+      row["id"] = new_id
+    return row, body
+
+  async def _check_references(self, line_number: int, row: dict[str, Any]) -> None:
+    for reference, table_model in REFERENCES.items():
+      if reference not in row or row[reference] in self.owned_ids:
+        continue
+      statement = select(table_model.id).where(
+        table_model.id == row[reference], table_model.owner_id == self.owner_id
+      )
+      if not (await self.session.exec(statement)).first():
+        raise TransferError(line_number, f"Unknown {reference} {row[reference]}")
+      self.owned_ids.add(row[reference])
+
+  async def add(self, line_number: int, line: bytes) -> None:
+    """
+    Import one NDJSON line.
+    """
+    try:
+      record = json.loads(line)
+      record_type, data = record["type"], record["data"]
+    except (ValueError, KeyError, TypeError) as e:
+      raise TransferError(line_number, 'Expected a {"type": ..., "data": ...} object') from e
+    if record_type not in RECORD_TYPES:
+      raise TransferError(line_number, f"Unknown record type {record_type!r}")
+    try:
+      row, body = self._row(record_type, data)
+    except ValidationError as e:
+      raise TransferError(line_number, json.loads(e.json(include_url=False))) from e
+    except ValueError as e:
+      raise TransferError(line_number, str(e)) from e
+    await self._check_references(line_number, row)
+    if record_type != "message":
+      self.owned_ids.add(row["id"])
+    if record_type != self.batch_type or len(self.batch) >= BATCH_SIZE:
+      await self.flush()
+      self.batch_type = record_type
+    self.batch.append(row)
+    if body is not None:
+      self.bodies.append(message_body.body_row(row["id"], body))
+
+  async def flush(self) -> None:
+    """
+    Write the pending batch.
+    """
+    if self.batch_type and self.batch:
+      await bulk.copy_rows(self.session, RECORD_TYPES[self.batch_type], self.batch)
+      self.counts[self.batch_type] += len(self.batch)
+    if self.bodies:
+      await bulk.copy_rows(self.session, MessageBody, self.bodies)
+    self.batch = []
+    self.bodies = []
+
+
+async def import_records(
+  session: AsyncSession, owner_id: uuid.UUID, lines: AsyncIterable[bytes], new_ids: bool
+) -> dict[str, int]:
+  """
+  Import NDJSON lines for a user, in the session's transaction. Returns the
+  number of imported rows per record type.
+  """
+  importer = Importer(session, owner_id, new_ids)
+  line_number = 0
+  async for line in lines:
+    line_number += 1
+    if line.strip():
+      await importer.add(line_number, line)
+  await importer.flush()
+  return importer.counts
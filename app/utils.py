@@ -5,18 +5,19 @@ import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 from functools import wraps
 
-import emails  # type: ignore
 import jwt
-from jinja2 import Template
 from jwt.exceptions import InvalidTokenError
 from fastapi import Request
 
 from app.core import security
 from app.core.config import settings
 
+if TYPE_CHECKING:
+  import emails  # type: ignore
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -34,6 +35,9 @@ def render_email_template(*, template_name: str, context: dict[str, Any]) -> str
   """
   Render an email template.
   """
+  # Jinja and the email stack are only imported once an email is sent
+  from jinja2 import Template  # pylint: disable=import-outside-toplevel
+
   template_str = (
     Path(__file__).parent / "email-templates" / "build" / template_name
   ).read_text()
@@ -41,6 +45,35 @@ def render_email_template(*, template_name: str, context: dict[str, Any]) -> str
   return html_content
 
 
+def smtp_options() -> dict[str, Any]:
+  """
+  Options of the SMTP connection, from the settings.
+  """
+  options: dict[str, Any] = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
+  if settings.SMTP_TLS:
+    options["tls"] = True
+  elif settings.SMTP_SSL:
+    options["ssl"] = True
+  if settings.SMTP_USER:
+    options["user"] = settings.SMTP_USER
+  if settings.SMTP_PASSWORD:
+    options["password"] = settings.SMTP_PASSWORD
+  return options
+
+
+def build_email(*, subject: str = "", html_content: str = "") -> "emails.Message":
+  """
+  Build an email sent from the configured address.
+  """
+  import emails  # type: ignore  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+  return emails.Message(
+    subject=subject,
+    html=html_content,
+    mail_from=(settings.emails_from_name, settings.EMAILS_FROM_EMAIL),
+  )
+
+
 def send_email(
   *,
   email_to: str,
@@ -48,24 +81,12 @@ def send_email(
   html_content: str = "",
 ) -> None:
   """
-  Send an email.
+  Send an email right away, on a new connection. Routes queue their emails
+  in the outbox instead, see app.outbox.
   """
   assert settings.emails_enabled, "no provided configuration for email variables"
-  message = emails.Message(
-    subject=subject,
-    html=html_content,
-    mail_from=(settings.emails_from_email, settings.EMAILS_FROM_EMAIL),
-  )
-  smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-  if settings.SMTP_TLS:
-    smtp_options["tls"] = True
-  elif settings.SMTP_SSL:
-    smtp_options["ssl"] = True
-  if settings.SMTP_USER:
-    smtp_options["user"] = settings.SMTP_USER
-  if settings.SMTP_PASSWORD:
-    smtp_options["password"] = settings.SMTP_PASSWORD
-  response = message.send(to=email_to, smtp=smtp_options)
+  message = build_email(subject=subject, html_content=html_content)
+  response = message.send(to=email_to, smtp=smtp_options())
   logger.info("send email result: %s", response)
 
 
@@ -102,11 +123,10 @@ def generate_reset_password_email(email_to: str, email: str, token: str) -> Emai
   return EmailData(html_content=html_content, subject=subject)
 
 
-def generate_new_account_email(
-  email_to: str, username: str, password: str
-) -> EmailData:
+def generate_new_account_email(email_to: str, username: str) -> EmailData:
   """
-  Generate the email for a new account.
+  Generate the email for a new account. The password isn't in it, it would
+  sit in mailboxes and in the outbox.
   """
   project_name = settings.PROJECT_NAME
   subject = f"{project_name} - New account for user {username}"
@@ -115,7 +135,6 @@ def generate_new_account_email(
     context={
       "project_name": settings.PROJECT_NAME,
       "username": username,
-      "password": password,
       "email": email_to,
       "link": settings.FRONTEND_HOST,
     },
@@ -123,6 +142,24 @@ def generate_new_account_email(
   return EmailData(html_content=html_content, subject=subject)
 
 
+def generate_queued_email(template_name: str, context: dict[str, Any]) -> EmailData:
+  """
+  Generate an email queued in the outbox with its template and context,
+  making the secrets it carries (the reset token) now.
+  """
+  if template_name == "reset_password.html":
+    return generate_reset_password_email(
+      email_to=context["email_to"],
+      email=context["email"],
+      token=generate_password_reset_token(email=context["email"]),
+    )
+  if template_name == "new_account.html":
+    return generate_new_account_email(email_to=context["email_to"], username=context["username"])
+  if template_name == "test_email.html":
+    return generate_test_email(email_to=context["email_to"])
+  raise ValueError(f"Unknown email template {template_name!r}")
+
+
 def generate_password_reset_token(email: str) -> str:
   """
   Generate a password reset token.
@@ -0,0 +1,109 @@
+"""
+Gunicorn configuration of the production server: `gunicorn main:app`.
+
+- One uvicorn worker per CPU available to the container, from its cgroup
+  quota and CPU affinity, unless WEB_WORKERS is set;
+- the app is imported once by the master before forking, so the workers
+  share its memory copy-on-write. Connections, pools and background tasks
+  are only created in the workers (engines are reset after the fork, the
+  rest starts in the lifespan);
+- workers are replaced after WEB_WORKER_MAX_REQUESTS requests, against
+  slow leaks, and killed when their event loop stops checking in for
+  WEB_WORKER_TIMEOUT seconds;
+- `kill -HUP <master>` replaces the workers one by one, each finishing its
+  requests first. With the app preloaded they run the same code, deploy
+  new code by starting a new master (`kill -USR2`, then `-QUIT` the old).
+
+Workers starting, exiting and being killed are logged with their pid.
+
+Prometheus metrics are written by each worker to PROMETHEUS_MULTIPROC_DIR,
+emptied when gunicorn starts, and the files of exited workers' gauges
+dropped, see app.core.prometheus.
+"""
+import math
+import os
+import shutil
+
+# Read by prometheus_client when imported, before the app is preloaded
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+
+# pylint: disable=wrong-import-position
+from app.core.config import settings
+
+
+def available_cpus() -> int:
+  """
+  CPUs this process may use: its affinity, capped by the cgroup CPU quota.
+  """
+  cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+  quota = None
+  try:
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as f:
+      limit, period = f.read().split()
+    if limit != "max":
+      quota = int(limit) / int(period)
+  except (OSError, ValueError):
+    try:
+      # cgroup v1, -1 without quota
+      with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", encoding="utf-8") as f:
+        limit = int(f.read())
+      with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="utf-8") as f:
+        period = int(f.read())
+      if limit > 0:
+        quota = limit / period
+    except (OSError, ValueError):
+      pass
+  if quota is not None:
+    cpus = min(cpus or 1, math.ceil(quota))
+  return max(1, cpus or 1)
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = settings.WEB_WORKERS or available_cpus()
+preload_app = True
+max_requests = settings.WEB_WORKER_MAX_REQUESTS
+max_requests_jitter = settings.WEB_WORKER_MAX_REQUESTS_JITTER
+timeout = settings.WEB_WORKER_TIMEOUT
+graceful_timeout = settings.WEB_WORKER_GRACEFUL_TIMEOUT
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(_server) -> None:
+  # Values left by a previous run would be added to this one's
+  directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+  shutil.rmtree(directory, ignore_errors=True)
+  os.makedirs(directory)
+
+
+def when_ready(server) -> None:
+  server.log.info("Serving with %s workers", server.num_workers)
+  if server.num_workers > 1 and not settings.BROADCAST_ENABLED:
+    server.log.warning(
+      "BROADCAST_ENABLED is off, cache invalidations won't reach the other workers"
+    )
+
+
+def post_fork(server, worker) -> None:
+  # pylint: disable=import-outside-toplevel
+  from app.core.db import async_engine, engine
+
+  # Connections opened by the master while preloading belong to it
+  engine.dispose(close=False)
+  async_engine.sync_engine.dispose(close=False)
+  server.log.info("Worker %s started", worker.pid)
+
+
+def worker_abort(worker) -> None:
+  worker.log.warning("Worker %s timed out, killing it", worker.pid)
+
+
+def child_exit(server, worker) -> None:
+  # pylint: disable=import-outside-toplevel
+  from prometheus_client import multiprocess
+
+  # Gunicorn logs the exit code or signal of workers which didn't exit cleanly
+  server.log.info("Worker %s exited", worker.pid)
+  multiprocess.mark_process_dead(worker.pid)
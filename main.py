@@ -1,17 +1,26 @@
 """
 This is the main file for the FastAPI application. It contains the routes for the API endpoints.
 """
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.routing import APIRoute
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import sentry_sdk
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
+from app.core.background import background_jobs
+from app.core.broadcast import broadcast
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
-from app.utils import auth_required
-from app.models import CompletionInput, Message
+from app.core.hashing import password_hasher
+from app.core.prometheus import MetricsMiddleware, metrics
+from app.core.query_tracker import QueryCountMiddleware
+from app.core.replicas import ReadYourWritesMiddleware
+from app.core.tracing import trace_sampler
+from app.frontend import AssetFiles, IndexPage
+from app.outbox import email_sender
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -24,16 +33,41 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
-  sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
+  # Only imported when used, it's slow to import
+  import sentry_sdk
+
+  sentry_sdk.init(
+    dsn=str(settings.SENTRY_DSN),
+    traces_sampler=trace_sampler.sample,
+    before_send_transaction=trace_sampler.keep,
+  )
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+  """
+  Start and stop the background services of a worker.
+  """
+  await broadcast.start()
+  await email_sender.start()
+  yield
+  await email_sender.stop()
+  await background_jobs.drain()
+  await broadcast.stop()
+  password_hasher.shutdown()
+
 
 app = FastAPI(
   title=settings.PROJECT_NAME,
+  lifespan=lifespan,
+  default_response_class=ORJSONResponse,
   openapi_url=f"{settings.API_V1_STR}/openapi.json",
   generate_unique_id_function=custom_generate_unique_id,
 )
 
-app.mount("/assets", StaticFiles(directory=f"{settings.BUILD_PATH}/assets"), name="assets")
-templates = Jinja2Templates(directory=settings.BUILD_PATH)
+app.mount("/assets", AssetFiles(directory=f"{settings.BUILD_PATH}/assets"), name="assets")
+index_page = IndexPage(
+  f"{settings.BUILD_PATH}/index.html", reload=settings.ENVIRONMENT == "local"
+)
 
 # Set all CORS enabled origins
 if settings.all_cors_origins:
@@ -45,15 +79,31 @@ if settings.all_cors_origins:
     allow_headers=["*"],
   )
 
-app.include_router(api_router, prefix=settings.API_V1_STR)
+if settings.QUERY_COUNT_MODE != "off":
+  app.add_middleware(
+    QueryCountMiddleware,
+    threshold=settings.QUERY_COUNT_THRESHOLD,
+    fail=settings.QUERY_COUNT_MODE == "raise",
+  )
 
-@app.get("/api/completions")
-@auth_required
-def get_completions(user_input: CompletionInput) -> list[Message]:
-  """
-  Endpoint for generating completions for the user input.
-  """
-  return {"completions": user_input}
+if settings.COMPRESSION_ENABLED:
+  app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_level=settings.COMPRESSION_BROTLI_LEVEL,
+    zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+  )
+
+if settings.POSTGRES_REPLICA_URIS:
+  app.add_middleware(ReadYourWritesMiddleware)
+
+if settings.METRICS_ENABLED:
+  # Outermost, so the latencies include every other middleware
+  app.add_middleware(MetricsMiddleware)
+  app.add_route("/metrics", metrics, include_in_schema=False)
+
+app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/")
 @app.get("/login")
@@ -69,7 +119,7 @@ async def serve_index(request: Request):
   """
   Serve the frontend application.
   """
-  return templates.TemplateResponse("index.html", {"request": request})
+  return index_page.response(request)
 
 if __name__ == "__main__":
   import uvicorn